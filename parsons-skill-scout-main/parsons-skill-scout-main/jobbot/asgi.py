@@ -3,6 +3,9 @@ ASGI config for jobbot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The candidate and position match pages are async views (see parsonsjobbot/async_matching.py), served through an
+ASGI server such as ``uvicorn jobbot.asgi:application`` so a page scoring cache misses does not hold up a worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -13,13 +13,6 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 
-import spacy
-nlp = spacy.load('en_core_web_sm')
-# if nlp is not None:
-#     print('found')
-# else:
-#     print('not found')
-
 import pyresparser
 
 
@@ -96,6 +89,25 @@ DATABASES = {
     }
 }
 
+# final match lists are cached in 'matches' (parsonsjobbot/match_cache.py) under a data version that changes with the
+# candidates, positions and XLSX, so old entries are never served and just age out. The local memory backend evicts the
+# least recently used entries past MAX_ENTRIES; for a cache shared between processes use
+# 'django.core.cache.backends.filebased.FileBasedCache' with a directory as LOCATION, or
+# 'django.core.cache.backends.db.DatabaseCache' with a table name (run `python manage.py createcachetable` first)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'matches': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'skill-scout-matches',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -142,14 +154,114 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 pyresparser.PATH_TO_CONFIG = os.path.join(BASE_DIR, 'config.cfg')
 
+# spaCy pipelines, these are loaded lazily and only once per process by parsonsjobbot.language_models
+NLP_PREPROCESSING_MODEL = 'en_core_web_sm'
+NLP_SIMILARITY_MODEL = 'en_core_web_lg'
+# how many texts nlp.pipe works on at a time and how many processes it spreads them over when preprocessing in bulk
+NLP_BATCH_SIZE = 64
+NLP_N_PROCESS = 1
+# preprocessed texts are cached in memory (this many per process) and in the PreprocessedText table
+NLP_PREPROCESS_CACHE_SIZE = 10000
+NLP_PREPROCESS_CACHE_DATABASE = True
+# part of the PreprocessedText cache key, bump it when the lemma filtering changes so old cached texts are ignored
+NLP_PREPROCESSING_VERSION = '1'
+# how candidates and positions are scored: 'vectors' compares en_core_web_lg document vectors, 'tfidf' and 'bm25'
+# compare weighted word overlap with sparse matrices (parsonsjobbot/lexical.py) and never load the large model
+SIMILARITY_BACKEND = 'vectors'
+SIMILARITY_BM25_K1 = 1.5
+SIMILARITY_BM25_B = 0.75
+# the tfidf/bm25 models are fitted by `manage.py fit_lexical_model` (run it from cron), which only fits again once the
+# number of candidates and positions has moved this far (a fraction) from the last fit, see parsonsjobbot/lexical.py
+LEXICAL_REFIT_DRIFT = 0.1
+# part of the SimilarityScoreMatcher cache key, bump it when the scoring changes so old cached scores are ignored
+SIMILARITY_SCORING_VERSION = '1'
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# approximate nearest neighbour indexes used to shortlist matches, see parsonsjobbot/ann_index.py
+MATCH_INDEX_ROOT = os.path.join(MEDIA_ROOT, 'match_index')
+MATCH_INDEX_TABLES = 8
+MATCH_INDEX_BITS = 8
+# saved rows are appended to a log next to each index file, and the file is only written again (with the log folded
+# in) once the log has grown to this fraction of its size
+MATCH_INDEX_COMPACT_RATIO = 0.5
+# read-only, memory mapped copies of every stored vector that all worker processes on a machine share through the page
+# cache, written by `python manage.py write_vector_snapshot` (parsonsjobbot/snapshots.py). Readers look for a newer
+# snapshot at most this many seconds apart
+MATCH_SNAPSHOT_ROOT = os.path.join(MEDIA_ROOT, 'match_snapshots')
+MATCH_SNAPSHOT_CHECK_INTERVAL = 5
+
+# matching runs in two stages (parsonsjobbot/retrieval.py): a cheap retriever shortlists candidates or positions and
+# only the shortlist is scored with SIMILARITY_BACKEND. 'ann' uses the indexes above (vector backend only), 'skills'
+# the skill index and 'lexical' MATCH_RETRIEVER_WEIGHTING scores, None scores everything
+MATCH_RETRIEVER = 'ann'
+MATCH_RETRIEVER_WEIGHTING = 'bm25'
+# unless a view sets its own shortlist_size, the shortlist is this many times the number of matches a page shows
+MATCH_SHORTLIST_OVERSAMPLE = 4
+
+# the async match views (parsonsjobbot/async_matching.py) score cache misses on a thread pool of this many threads, shared
+# by every request in the process, split into a chunk per thread of at most this many rows
+MATCH_ASYNC_WORKERS = 4
+MATCH_ASYNC_CHUNK_SIZE = 200
+
+# a full rematch (`python manage.py rematch`, parsonsjobbot/rematch.py) scores on this many processes, None is one per
+# core, handing each of them about this many candidate/position pairs at a time
+SCORING_WORKERS = None
+SCORING_CHUNK_PAIRS = 20000
+# `python manage.py precompute_matches` notes the last candidate it finished here, so an interrupted run resumes
+MATCH_PRECOMPUTE_CHECKPOINT = os.path.join(MEDIA_ROOT, 'precompute_matches.json')
+
+# uploaded resumes are parsed once and the result kept with the file (parsonsjobbot/resumes.py), bump this when the
+# parser or its models change so every resume is parsed again the next time it is needed
+RESUME_PARSER_VERSION = '1'
+
+# bulk resume uploads (parsonsjobbot/bulk_resumes.py) are parsed on this many processes, None is one per core, and their
+# resumes and candidates saved this many to a transaction. One upload takes at most BULK_RESUME_MAX_FILES resumes, zip members
+# bigger than BULK_RESUME_MAX_FILE_SIZE bytes are skipped
+BULK_RESUME_WORKERS = None
+BULK_RESUME_BATCH_SIZE = 50
+BULK_RESUME_MAX_FILES = 500
+BULK_RESUME_MAX_FILE_SIZE = 10 * 1024 * 1024
+# Django only takes 100 files per request by default
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_RESUME_MAX_FILES
+
+# background jobs (see parsonsjobbot/tasks.py) are queued in the database and run by `python manage.py run_jobs`
+# eager runs them inside the request instead, which is handy for tests and debugging without a worker
+BACKGROUND_JOBS_EAGER = False
+BACKGROUND_JOB_WORKERS = 2
+BACKGROUND_JOB_POLL_INTERVAL = 1
+BACKGROUND_JOB_MAX_ATTEMPTS = 3
+# seconds before a failed job is retried, doubled on every further attempt
+BACKGROUND_JOB_RETRY_DELAY = 30
+# seconds a worker can go without reporting progress before its job is handed to another worker
+BACKGROUND_JOB_VISIBILITY_TIMEOUT = 600
+BACKGROUND_JOB_CHUNK_SIZE = 500
+
+# uploads are streamed to a temporary file and hashed and sniffed on the way (parsonsjobbot/upload_handlers.py). The
+# temporary files live inside MEDIA_ROOT so saving one to a FileField is a rename, not a copy across filesystems
 FILE_UPLOAD_HANDLERS = [
-    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+    'parsonsjobbot.upload_handlers.HashingUploadHandler',
 ]
+FILE_UPLOAD_TEMP_DIR = os.path.join(MEDIA_ROOT, 'uploads_in_progress')
 
 LOGIN_REDIRECT_URL = 'landing_page:landing_page'
 LOGOUT_REDIRECT_URL = 'landing_page:landing_page'
 
-CRISPY_TEMPLATE_PACK = 'bootstrap4'
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'parsonsjobbot': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UploadedFile, Candidate, JobSubmission, UploadedXlsx, XlsxJob, UploadedSOW, SOWPosition, SimilarityScoreMatcher
+from .models import UploadedFile, Candidate, JobSubmission, UploadedXlsx, XlsxJob, UploadedSOW, SOWPosition, SimilarityScoreMatcher, BackgroundJob, SkillPosting
 from django.utils.html import format_html
 
 # Register your models here.
@@ -7,7 +7,7 @@ from django.utils.html import format_html
 
 @admin.register(UploadedFile)
 class UploadedFileAdmin(admin.ModelAdmin):
-    list_display = ['id', 'file']
+    list_display = ['id', 'file', 'content_hash', 'parsed_with']
 
 @admin.register(Candidate)
 class CandidateAdmin(admin.ModelAdmin):
@@ -37,5 +37,16 @@ class SOWPositionsAdmin(admin.ModelAdmin):
 
 @admin.register(SimilarityScoreMatcher)
 class SimilarityScoreMatcherAdmin(admin.ModelAdmin):
-    list_display = ['candidate_name', 'candidate_info', 'sow_info', 'similarity_score']
-    list_filter = ['candidate_name']
\ No newline at end of file
+    list_display = ['candidate', 'similarity_score', 'scoring_model', 'scoring_version', 'candidate_hash', 'sow_hash']
+    list_filter = ['scoring_model', 'scoring_version']
+
+@admin.register(BackgroundJob)
+class BackgroundJobsAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'user', 'status', 'progress', 'total', 'attempts', 'locked_by', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+
+@admin.register(SkillPosting)
+class SkillPostingsAdmin(admin.ModelAdmin):
+    list_display = ['skill', 'kind', 'object_id']
+    list_filter = ['kind']
+    search_fields = ['skill']
@@ -0,0 +1,433 @@
+import os
+import pickle
+import tempfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .commit_batches import add_on_commit, pending_items
+from .models import Candidate, SOWPosition
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# one index file per kind of row, see index_path()
+INDEX_KINDS = {
+    'candidates': Candidate,
+    'positions': SOWPosition,
+}
+
+
+class VectorIndex:
+    """
+    Approximate nearest neighbour index over unit length vectors using random projection LSH.
+
+    Every table hashes a vector to a bucket by which side of `bits` random hyperplanes it falls on. Similar vectors
+    (small angle between them) tend to land in the same bucket, so looking only in the query's buckets gives a
+    shortlist without scanning everything. The shortlist is then ranked exactly with dot products.
+
+    Attributes:
+        tables (int): How many independent hash tables to use, more tables means better recall.
+        bits (int): Hyperplanes per table, more bits means smaller buckets.
+        planes (np.ndarray): (tables * bits x dimensions) random hyperplanes.
+
+    Usage:
+        add, add_many and remove change the index in place, so only use them on an index nobody is querying yet. A
+        shared index is changed with with_changes, which leaves the original alone.
+
+        index = VectorIndex(dimensions=300)
+        index.add(1, vector, match_hash)
+        index.query(other_vector, 10)
+        # Output: [(1, 0.83), ...]
+    """
+
+    def __init__(self, dimensions: int, tables: int = 8, bits: int = 8, seed: int = 0, planes: np.ndarray = None):
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+        if planes is None:
+            planes = np.random.default_rng(seed).standard_normal((tables * bits, dimensions)).astype(np.float32)
+        self.planes = planes
+        self._bit_values = 1 << np.arange(bits, dtype=np.int64)
+        self._vectors = {}
+        self._keys = {}
+        # id -> the match_hash of the row the vector was made from, '' when it was not given
+        self._hashes = {}
+        self._buckets = [{} for _ in range(tables)]
+
+    @property
+    def dimensions(self) -> int:
+        return self.planes.shape[1]
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def __contains__(self, item_id):
+        return item_id in self._vectors
+
+    def add(self, item_id: int, vector: np.ndarray, match_hash: str = ''):
+        """
+        Inserts the vector under the given id, replacing whatever was stored for that id before.
+        """
+        self.add_many([item_id], np.asarray(vector, dtype=np.float32)[np.newaxis, :], [match_hash])
+
+    def remove(self, item_id: int):
+        keys = self._keys.pop(item_id, None)
+        if keys is None:
+            return
+        del self._vectors[item_id]
+        del self._hashes[item_id]
+        for table, key in enumerate(keys):
+            bucket = self._buckets[table][int(key)]
+            bucket.discard(item_id)
+            if not bucket:
+                del self._buckets[table][int(key)]
+
+    def with_changes(self, changes: list) -> 'VectorIndex':
+        """
+        A copy of the index with the changes made to it. This index is left as it is, so queries other threads are
+        running on it never see it half changed. The id maps are copied but only the buckets the changes touch are.
+
+        Args:
+            changes (list): (id, vector, match_hash) tuples, a vector of None removes the id.
+
+        Example:
+            index = index.with_changes([(7, vector, match_hash), (8, None, '')])
+        """
+        index = VectorIndex(self.dimensions, tables=self.tables, bits=self.bits, seed=self.seed, planes=self.planes)
+        index._vectors = dict(self._vectors)
+        index._keys = dict(self._keys)
+        index._hashes = dict(self._hashes)
+        index._buckets = [dict(buckets) for buckets in self._buckets]
+
+        added = [(item_id, vector, match_hash) for item_id, vector, match_hash in changes if vector is not None]
+        touched = [keys for item_id, _, _ in changes for keys in [self._keys.get(item_id)] if keys is not None]
+        if added and self._vectors:
+            touched.extend(self._bucket_keys(np.vstack([np.asarray(vector, dtype=np.float32) for _, vector, _ in added])))
+        for keys in touched:
+            for table, key in enumerate(keys):
+                index._buckets[table][int(key)] = set(self._buckets[table].get(int(key), ()))
+
+        for item_id, vector, match_hash in changes:
+            if vector is None:
+                index.remove(item_id)
+            else:
+                index.add(item_id, vector, match_hash)
+        return index
+
+    def query(self, vector: np.ndarray, n: int, allowed_ids: set = None) -> list[(int, float)]:
+        """
+        The n (approximately) nearest stored vectors to the query, best first, scored with the exact cosine.
+
+        Looks in the query's own bucket in every table first, then in the buckets one bit away, and only falls back
+        to checking everything when that still does not give n results (so small indexes are always exact).
+
+        Args:
+            vector (np.ndarray): The unit length query vector.
+            n (int): How many results to return.
+            allowed_ids (set): Only return these ids, None allows everything.
+
+        Returns:
+            list: (id, cosine similarity) tuples, best first.
+        """
+        if not self._vectors:
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        keys = self._bucket_keys(vector[np.newaxis, :])[0]
+
+        shortlist = self._collect(keys, allowed_ids, probe_neighbours=False)
+        if len(shortlist) < n:
+            shortlist |= self._collect(keys, allowed_ids, probe_neighbours=True)
+        if len(shortlist) < n:
+            shortlist = set(self._vectors) if allowed_ids is None else set(self._vectors).intersection(allowed_ids)
+        if not shortlist:
+            return []
+
+        ids = list(shortlist)
+        scores = np.vstack([self._vectors[item_id] for item_id in ids]) @ vector
+        best = np.argsort(-scores, kind='stable')[:n]
+        return [(ids[row], float(scores[row])) for row in best]
+
+    def save(self, path: str):
+        """
+        Writes the index to a .npz file. The file is swapped in atomically so readers never see half of it.
+        """
+        ids = np.fromiter(self._vectors.keys(), dtype=np.int64, count=len(self._vectors))
+        vectors = np.vstack(list(self._vectors.values())) if self._vectors else np.zeros((0, self.dimensions), dtype=np.float32)
+        hashes = np.array([self._hashes[item_id] for item_id in self._vectors], dtype=str)
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        with os.fdopen(file_descriptor, 'wb') as temporary_file:
+            np.savez(temporary_file, ids=ids, vectors=vectors, hashes=hashes, planes=self.planes, shape=np.array([self.tables, self.bits]))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'VectorIndex':
+        with np.load(path) as data:
+            tables, bits = (int(value) for value in data['shape'])
+            index = cls(data['planes'].shape[1], tables=tables, bits=bits, planes=data['planes'])
+            # files written before the hashes were stored count every row as current
+            hashes = data['hashes'].tolist() if 'hashes' in data.files else None
+            index.add_many(data['ids'].tolist(), data['vectors'], hashes)
+        return index
+
+    def add_many(self, ids: list, vectors: np.ndarray, match_hashes: list = None):
+        """
+        Bulk version of add(), hashes all the vectors with one matrix multiply.
+        """
+        if not len(ids):
+            return
+        match_hashes = [''] * len(ids) if match_hashes is None else match_hashes
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not self._vectors and vectors.shape[1] != self.dimensions:
+            # an index built over an empty table does not know the vector size until the first insert
+            self.planes = np.random.default_rng(self.seed).standard_normal((self.tables * self.bits, vectors.shape[1])).astype(np.float32)
+        for item_id, vector, match_hash, keys in zip(ids, vectors, match_hashes, self._bucket_keys(vectors)):
+            self.remove(item_id)
+            self._vectors[item_id] = vector
+            self._hashes[item_id] = match_hash or ''
+            self._keys[item_id] = keys
+            for table, key in enumerate(keys):
+                self._buckets[table].setdefault(int(key), set()).add(item_id)
+
+    def _bucket_keys(self, vectors: np.ndarray) -> np.ndarray:
+        # (rows x tables) bucket numbers, each built from `bits` hyperplane signs
+        signs = (vectors @ self.planes.T >= 0).reshape(len(vectors), self.tables, self.bits)
+        return signs.astype(np.int64) @ self._bit_values
+
+    def _collect(self, keys, allowed_ids, probe_neighbours: bool) -> set:
+        found = set()
+        for table, key in enumerate(keys):
+            probes = [key ^ int(bit) for bit in self._bit_values] if probe_neighbours else [key]
+            for probe in probes:
+                found.update(self._buckets[table].get(int(probe), ()))
+        if allowed_ids is not None:
+            found.intersection_update(allowed_ids)
+        return found
+
+
+# the indexes loaded in this process, kind -> (index, version of the index file, bytes of its log applied), see
+# get_index(). A loaded index is never changed, catching up with the log makes a new one (VectorIndex.with_changes)
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# kind -> ids this process committed but could not write to the log, they stay in unindexed_ids until a later change
+# or rebuild_index gets them in
+_missed = defaultdict(set)
+
+
+def index_path(kind: str) -> str:
+    return os.path.join(settings.MATCH_INDEX_ROOT, f'{kind}.npz')
+
+
+def log_path(kind: str) -> str:
+    """
+    The append only log of the rows saved since the index file was last written, see _update_index.
+    """
+    return os.path.join(settings.MATCH_INDEX_ROOT, f'{kind}.log')
+
+
+def get_index(kind: str) -> VectorIndex:
+    """
+    The ANN index for 'candidates' or 'positions'.
+
+    It is loaded from disk once per process, brought up to date with the rows appended to the log since and reloaded
+    when another process has written a new index file. If there is no file yet it is built from the vectors stored in
+    the database (see rebuild_index). Rows saved in a transaction that has not committed yet are not in it, see
+    unindexed_ids.
+    """
+    path = index_path(kind)
+    loaded = _indexes.get(kind)
+    version = _file_version(path)
+    if loaded is not None and version is not None and loaded[1:] == (version, _log_size(kind)):
+        return loaded[0]
+
+    if version is None:
+        # only one process builds the missing file, the others wait for it and load it
+        with _file_lock(path):
+            if _file_version(path) is None:
+                _write_index(kind, _build_index(kind))
+    with _file_lock(path, shared=True):
+        return _catch_up(kind)
+
+
+def rebuild_index(kind: str) -> VectorIndex:
+    """
+    Throws away the index file and log for 'candidates' or 'positions' and builds the index again from the database.
+    """
+    with _file_lock(index_path(kind)):
+        index = _write_index(kind, _build_index(kind))
+    with _indexes_lock:
+        _missed[kind].clear()
+    return index
+
+
+def unindexed_ids(kind: str) -> set:
+    """
+    The ids of rows the index may be missing or have an old vector for, so retrieval can score them anyway: the rows
+    this thread's transaction saved (they only go in once it commits) and any this process failed to write.
+
+    Nothing is read from the database for this. Rows another process has committed are in the log by the time this
+    process can see them.
+
+    Example:
+        unindexed_ids('positions')
+        # Output: {7}
+    """
+    pending = {item_id for item_id, _, _ in pending_items(('ann_index', kind))}
+    with _indexes_lock:
+        return pending | _missed[kind]
+
+
+def index_vector(kind: str, item_id: int, vector: np.ndarray, match_hash: str = ''):
+    """
+    Inserts (or replaces) one row in the index.
+    """
+    _update_index(kind, [(item_id, vector, match_hash)])
+
+
+def unindex(kind: str, item_id: int):
+    """
+    Removes one row from the index.
+    """
+    _update_index(kind, [(item_id, None, '')])
+
+
+def index_on_commit(kind: str, item_id: int, vector: np.ndarray = None, match_hash: str = ''):
+    """
+    Inserts (or, without a vector, removes) a row once the current transaction commits.
+
+    Every change to the same index in one transaction goes into a single _update_index, so a batch of 50 candidates
+    saved in one transaction is one append to the log, not 50. A failure is logged, not raised.
+    """
+    add_on_commit(('ann_index', kind), (item_id, vector, match_hash), lambda changes: _apply_on_commit(kind, changes))
+
+
+def _apply_on_commit(kind: str, changes: list):
+    try:
+        _update_index(kind, changes)
+    except Exception:
+        # the rows are committed whatever happens here, retrieval keeps scoring them until they make it in
+        with _indexes_lock:
+            _missed[kind].update(item_id for item_id, _, _ in changes)
+        raise
+
+
+def _update_index(kind: str, changes: list):
+    # the changes are appended to the log, under a lock every process shares so two processes changing the index at
+    # the same time never lose each other's rows. Rewriting the whole index file is left until the log has grown to
+    # MATCH_INDEX_COMPACT_RATIO of it, so it costs about the same per change however big the index gets
+    path = index_path(kind)
+    get_index(kind)
+    changes = [
+        (item_id, None if vector is None else np.asarray(vector, dtype=np.float32), match_hash or '')
+        for item_id, vector, match_hash in changes
+    ]
+    record = pickle.dumps(changes, protocol=pickle.HIGHEST_PROTOCOL)
+    with _file_lock(path):
+        if _log_size(kind) + len(record) > settings.MATCH_INDEX_COMPACT_RATIO * os.path.getsize(path):
+            _write_index(kind, _catch_up(kind).with_changes(changes))
+        else:
+            with open(log_path(kind), 'ab') as log_file:
+                log_file.write(record)
+                log_file.flush()
+                os.fsync(log_file.fileno())
+    with _indexes_lock:
+        _missed[kind].difference_update(item_id for item_id, _, _ in changes)
+
+
+def _catch_up(kind: str) -> VectorIndex:
+    # the index as the file and log have it right now, the caller holds the file lock (shared is enough)
+    path = index_path(kind)
+    version = _file_version(path)
+    with _indexes_lock:
+        loaded = _indexes.get(kind)
+        if loaded is not None and loaded[1] == version:
+            index, applied = loaded[0], loaded[2]
+        else:
+            index, applied = VectorIndex.load(path), 0
+
+        changes = []
+        with open(log_path(kind), 'a+b') as log_file:
+            log_file.seek(applied)
+            while True:
+                try:
+                    changes.extend(pickle.load(log_file))
+                except EOFError:
+                    break
+            applied = log_file.tell()
+        if changes:
+            index = index.with_changes(changes)
+        _indexes[kind] = (index, version, applied)
+        return index
+
+
+def _write_index(kind: str, index: VectorIndex) -> VectorIndex:
+    # writes the whole index and starts an empty log, the caller holds the file lock
+    path = index_path(kind)
+    index.save(path)
+    open(log_path(kind), 'wb').close()
+    with _indexes_lock:
+        _indexes[kind] = (index, _file_version(path), 0)
+    return index
+
+
+def _log_size(kind: str) -> int:
+    try:
+        return os.path.getsize(log_path(kind))
+    except FileNotFoundError:
+        return 0
+
+
+def _file_version(path: str):
+    # every save swaps a new file in, so the inode tells two saves apart even when they land on the same mtime tick
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextmanager
+def _file_lock(path: str, shared: bool = False):
+    # a lock on a file next to the index: exclusive for writers, shared for readers catching up with the log. Windows
+    # only has the exclusive kind
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _build_index(kind: str) -> VectorIndex:
+    # imported here because vectors imports the NLP stack, which we only need if rows are missing vectors
+    from .vectors import candidate_vectors, position_vectors
+
+    model = INDEX_KINDS[kind]
+    rows = list(model.objects.all())
+    vectors = candidate_vectors(rows) if model is Candidate else position_vectors(rows)
+
+    dimensions = len(vectors[0]) if vectors else 0
+    index = VectorIndex(dimensions, tables=settings.MATCH_INDEX_TABLES, bits=settings.MATCH_INDEX_BITS)
+    if rows:
+        index.add_many([row.pk for row in rows], np.vstack(vectors), [row.match_hash for row in rows])
+    return index
@@ -1,6 +1,17 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ParsonsjobbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'parsonsjobbot'
+
+    def ready(self):
+        # hooks up the model signals (document vectors etc.)
+        from . import signals
+
+        # uploads are streamed into this folder (see upload_handlers.py), Django refuses to start if it is missing
+        if settings.FILE_UPLOAD_TEMP_DIR:
+            os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
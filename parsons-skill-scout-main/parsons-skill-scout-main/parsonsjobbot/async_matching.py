@@ -0,0 +1,66 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .matching import ScorePlan
+
+# the bounded pool cache misses are scored on, shared by every async request in the process, see scoring_executor()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def scoring_executor() -> ThreadPoolExecutor:
+    """
+    The thread pool async match views score cache misses on, settings.MATCH_ASYNC_WORKERS threads at most.
+
+    numpy and scipy let go of the GIL while they multiply, so that part of chunks on different threads really does run
+    at once. spaCy's lemmatising (the lexical backends' misses) mostly holds it.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.MATCH_ASYNC_WORKERS, thread_name_prefix='match-scoring')
+        return _executor
+
+
+async def ascore(candidates: list, positions: list) -> np.ndarray:
+    """
+    The async counterpart of MatchMatrix(candidates, positions, cached=True).scores, through the same ScorePlan.
+
+    The cached scores are read first (one query for a single candidate or position), the pairs that are not cached yet
+    are split into a chunk per settings.MATCH_ASYNC_WORKERS (of at most settings.MATCH_ASYNC_CHUNK_SIZE) and scored
+    concurrently on scoring_executor(), and the new scores are written back in one bulk_create. A page with many misses
+    takes about as long as its slowest chunk.
+
+    Everything that touches the database (the score cache, stored vectors, the preprocessing cache) runs on Django's
+    thread for synchronous code (sync_to_async). Each chunk's spaCy preprocessing and term weighting (the lexical
+    backends) and its matrix product run on the pool, see ScorePlan.score_chunk.
+
+    Args:
+        candidates (list): Candidate rows, the rows of the result.
+        positions (list): SOWPosition rows, the columns of the result.
+
+    Returns:
+        np.ndarray: (candidates x positions) similarity percentages.
+
+    Example:
+        scores = await ascore([candidate], list(open_sow_positions()))
+        # Output: array([[83.3, 41.2, ...]], dtype=float32)
+    """
+    plan = await sync_to_async(ScorePlan)(list(candidates), list(positions), settings.MATCH_ASYNC_CHUNK_SIZE, settings.MATCH_ASYNC_WORKERS)
+    if not plan.chunks:
+        return plan.scores
+
+    loop = asyncio.get_running_loop()
+    executor = scoring_executor()
+    blocks = await asyncio.gather(*(
+        loop.run_in_executor(executor, plan.score_chunk, chunk)
+        for chunk in plan.chunks
+    ))
+    plan.fill(blocks)
+    await sync_to_async(plan.save)()
+    return plan.scores
@@ -0,0 +1,260 @@
+# bulk resume intake (see BulkResumeView and the parse_resumes task): the request only stores the uploaded files as they
+# are, a background job unpacks them into UploadedFile rows, parses them on a pool of processes and makes the candidates
+# in batches
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .models import Candidate, UploadedFile
+from .resumes import cached_resume_data, candidate_fields, parse_resume_file, remember_resume_data, store_resume
+from .upload_handlers import matches_extension
+from .vectors import assign_vectors, candidate_match_text
+
+# what pyresparser can read, anything else in a zip is skipped
+RESUME_EXTENSIONS = ('.pdf', '.doc', '.docx')
+
+# where the uploads wait for the parse_resumes job, in the default storage
+BULK_UPLOAD_DIRECTORY = 'bulk_uploads'
+
+
+def resume_workers() -> int:
+    """
+    settings.BULK_RESUME_WORKERS, or one process per core when it is not set.
+    """
+    return settings.BULK_RESUME_WORKERS or os.cpu_count() or 1
+
+
+def store_uploads(files: list) -> list:
+    """
+    Saves the files of a bulk upload as they are, zips and all, for the parse_resumes job to unpack (see
+    unpack_uploads). The temporary files already live under MEDIA_ROOT, so this is a rename per file.
+
+    Args:
+        files (list): The uploaded files, resumes and/or zips of resumes (checked by BulkResumeUploadForm).
+
+    Returns:
+        list: {'path': where it is in the default storage, 'file': the name it was uploaded as} per file.
+
+    Example:
+        store_uploads(form.cleaned_data['resumes'])
+        # Output: [{'path': 'bulk_uploads/resumes.zip', 'file': 'resumes.zip'}, ...]
+    """
+    stored = []
+    try:
+        for upload in files:
+            stored.append({'path': default_storage.save(os.path.join(BULK_UPLOAD_DIRECTORY, upload.name), upload), 'file': upload.name})
+    except Exception:
+        remove_uploads(stored)
+        raise
+    return stored
+
+
+def remove_uploads(stored: list):
+    """
+    Deletes the files store_uploads saved, once their resumes are imported.
+    """
+    for upload in stored:
+        default_storage.delete(upload['path'])
+
+
+def unpack_uploads(stored: list) -> tuple[list, list]:
+    """
+    Makes an UploadedFile for every resume in the stored uploads, unpacking the zip files on the way.
+
+    The rows are made settings.BULK_RESUME_BATCH_SIZE at a time, each batch in one transaction, and zip members are read
+    one at a time. Resumes we already have reuse their UploadedFile (see store_resume), so a job that died half way
+    picks up where it stopped, and a file that is in the upload twice is only imported once.
+
+    Args:
+        stored (list): What store_uploads returned.
+
+    Returns:
+        tuple: (the UploadedFiles with the name each was uploaded as, summary entries for the skipped files)
+
+    Example:
+        unpack_uploads(job.payload['files'])
+        # Output: ([{'uploaded_file_id': 41, 'file': 'jane_doe.pdf'}, ...],
+        #          [{'file': 'notes.txt', 'status': 'skipped', 'error': 'Not a PDF, DOC or DOCX file'}])
+    """
+    uploads, skipped = [], []
+    # UploadedFile id -> the name it was first uploaded as
+    stored_ids = {}
+
+    def skip(name, error):
+        skipped.append({'file': name, 'status': 'skipped', 'error': error})
+
+    def store(name, content):
+        if len(uploads) >= settings.BULK_RESUME_MAX_FILES:
+            skip(name, f"More than {settings.BULK_RESUME_MAX_FILES} resumes in one upload")
+            return
+        uploaded_file = store_resume(content)
+        if uploaded_file.pk in stored_ids:
+            skip(name, f"Same file as {stored_ids[uploaded_file.pk]}")
+            return
+        stored_ids[uploaded_file.pk] = name
+        # the storage may rename the file, the summary should show the name it was uploaded as
+        uploads.append({'uploaded_file_id': uploaded_file.pk, 'file': name})
+
+    resumes = _resumes(stored, skip)
+    while True:
+        with transaction.atomic():
+            batch = 0
+            for name, content in islice(resumes, settings.BULK_RESUME_BATCH_SIZE):
+                store(name, content)
+                batch += 1
+        if batch < settings.BULK_RESUME_BATCH_SIZE:
+            return uploads, skipped
+
+
+def _resumes(stored: list, skip):
+    # (name, file) for every resume in the stored uploads, one at a time, skipping what is not a resume
+    for upload in stored:
+        name = upload['file']
+        if _extension(name) != '.zip':
+            with default_storage.open(upload['path']) as resume:
+                yield name, File(resume, name=name)
+            continue
+
+        with default_storage.open(upload['path']) as zip_file:
+            try:
+                archive = zipfile.ZipFile(zip_file)
+            except zipfile.BadZipFile:
+                skip(name, "Not a valid zip file")
+                continue
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                # folders, hidden files and the __MACOSX copies macOS puts in its zips
+                if member.is_dir() or not name or name.startswith('.') or '__MACOSX' in member.filename:
+                    continue
+                if _extension(name) not in RESUME_EXTENSIONS:
+                    skip(name, "Not a PDF, DOC or DOCX file")
+                elif member.file_size > settings.BULK_RESUME_MAX_FILE_SIZE:
+                    skip(name, "File is too big")
+                else:
+                    content = ContentFile(archive.read(member), name=name)
+                    if matches_extension(content):
+                        yield name, content
+                    else:
+                        skip(name, f"Does not look like a {_extension(name)[1:].upper()} file")
+
+
+def parse_resume_files(paths: list, workers: int = 1):
+    """
+    Parses resumes on a pool of worker processes, yielding each one as soon as it is done (so not in order).
+
+    Args:
+        paths (list): The resume files.
+        workers (int): How many processes to parse on, 1 parses in this process.
+
+    Yields:
+        tuple: (index into paths, the parsed data or None, the exception it failed with or None)
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for index, path in enumerate(paths):
+            try:
+                yield index, parse_resume_file(path), None
+            except Exception as error:
+                yield index, None, error
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(parse_resume_file, path): index for index, path in enumerate(paths)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as error:
+                yield futures[future], None, error
+
+
+def import_resumes(uploads: list, education: str = '', years_of_experience: int = 0, workers: int = None, progress=None) -> list:
+    """
+    Makes a Candidate for every uploaded resume, parsing them on a pool of processes (see parse_resume_files).
+
+    Resumes parsed before (the same file uploaded again, see resumes.py) are not parsed again. Candidates are
+    vectorised and saved settings.BULK_RESUME_BATCH_SIZE at a time, each batch in one transaction so the matches for
+    the whole batch are scored by a single background job (see signals.py). Resumes that already have a candidate are
+    left alone ('existing'), so running it again after an interruption only does what is left.
+
+    Args:
+        uploads (list): The UploadedFiles to import as {'uploaded_file_id': ..., 'file': name}, see unpack_uploads.
+        education (str): Used when the parser finds no degree.
+        years_of_experience (int): Used when the parser finds no experience.
+        workers (int): How many processes to parse on, defaults to resume_workers().
+        progress (function): Called with (resumes done, resumes in total) as the resumes come back.
+
+    Returns:
+        list: One summary entry per resume, in upload order, such as
+        {'file': 'jane_doe.pdf', 'status': 'created', 'candidate_id': 7} or
+        {'file': 'scan.pdf', 'status': 'failed', 'error': 'File is not a valid PDF'}.
+    """
+    stored = UploadedFile.objects.in_bulk([upload['uploaded_file_id'] for upload in uploads])
+    names = [upload['file'] for upload in uploads]
+    uploaded_files = [stored.get(upload['uploaded_file_id']) for upload in uploads]
+    summary = [None] * len(uploads)
+
+    imported = dict(Candidate.objects.filter(resume__in=stored.values()).values_list('resume_id', 'pk'))
+    to_parse = []
+    for index, uploaded_file in enumerate(uploaded_files):
+        if uploaded_file is None:
+            summary[index] = {'file': names[index], 'status': 'failed', 'error': "The uploaded file was deleted"}
+        elif uploaded_file.pk in imported:
+            summary[index] = {'file': names[index], 'status': 'existing', 'candidate_id': imported[uploaded_file.pk]}
+        else:
+            to_parse.append(index)
+
+    batch = []
+
+    def add(index, data):
+        name = data.get('name') or os.path.splitext(names[index])[0]
+        fields = candidate_fields(data, name, education, years_of_experience)
+        batch.append((index, Candidate(resume=uploaded_files[index], **fields)))
+        if len(batch) >= settings.BULK_RESUME_BATCH_SIZE:
+            save_batch()
+
+    def save_batch():
+        # one nlp.pipe call for the batch instead of one per candidate in pre_save
+        assign_vectors([candidate for _, candidate in batch], candidate_match_text)
+        with transaction.atomic():
+            for index, candidate in batch:
+                candidate.save()
+        for index, candidate in batch:
+            summary[index] = {'file': names[index], 'status': 'created', 'candidate_id': candidate.pk}
+        batch.clear()
+
+    # only files that were never parsed go to the pool
+    done = 0
+    unparsed = []
+    for index in to_parse:
+        data = cached_resume_data(uploaded_files[index])
+        if data is None:
+            unparsed.append(index)
+            continue
+        add(index, data)
+        done += 1
+        if progress is not None:
+            progress(done, len(to_parse))
+
+    paths = [uploaded_files[index].file.path for index in unparsed]
+    for position, data, error in parse_resume_files(paths, workers or resume_workers()):
+        index = unparsed[position]
+        if error is not None:
+            summary[index] = {'file': names[index], 'status': 'failed', 'error': str(error) or error.__class__.__name__}
+        else:
+            remember_resume_data(uploaded_files[index], data)
+            add(index, data)
+        done += 1
+        if progress is not None:
+            progress(done, len(to_parse))
+    if batch:
+        save_batch()
+    return summary
+
+
+def _extension(name: str) -> str:
+    return os.path.splitext(name)[1].lower()
@@ -0,0 +1,72 @@
+# work that piles up over a transaction and is done once when it commits, see add_on_commit. Used for the background
+# jobs that rescore what was saved (tasks.enqueue_on_commit) and for writing the ANN index files (ann_index.py)
+import threading
+import weakref
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+# the batches waiting on the transaction of each connection (connections are per thread, so this is too), by
+# (database alias, key). Django holds on to the on_commit callback until it runs or the transaction (or savepoint)
+# it was added in rolls back, so an entry goes away on its own once its batch can no longer run
+_batches = threading.local()
+
+
+def add_on_commit(key, item, apply, using: str = None):
+    """
+    Adds item to the batch for key in the current transaction. When the transaction commits apply is called once with
+    every item added to that batch, in the order they were added. Outside a transaction it is called right away.
+
+    Args:
+        key: What the batch is for, items with the same key in the same transaction go into one call.
+        item: Anything apply wants to know about.
+        apply (function): Called with the list of items once the transaction commits. A failure is logged, not raised.
+        using (str): The database alias, defaults to the default database.
+
+    Example:
+        add_on_commit(('score_candidates', 'candidate_ids'), candidate.pk, lambda ids: enqueue('score_candidates', candidate_ids=ids))
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = transaction.get_connection(using)
+    if not hasattr(_batches, 'pending'):
+        _batches.pending = weakref.WeakValueDictionary()
+
+    batch = _batches.pending.get((using, key)) if connection.in_atomic_block else None
+    if batch is None or batch.done:
+        batch = _Batch(key, apply)
+        batch.items.append(item)
+        if connection.in_atomic_block:
+            _batches.pending[(using, key)] = batch
+        transaction.on_commit(batch, using=using, robust=True)
+        return
+    batch.items.append(item)
+
+
+def pending_items(key, using: str = None) -> list:
+    """
+    The items added to the batch for key in this thread's current transaction, which has not committed yet. Nothing
+    outside of a transaction, since there apply has already run.
+
+    Example:
+        pending_items(('ann_index', 'positions'))
+        # Output: [(7, array([...], dtype=float32), '3f9a...')]
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if not transaction.get_connection(using).in_atomic_block:
+        return []
+    batch = getattr(_batches, 'pending', {}).get((using, key))
+    return [] if batch is None or batch.done else list(batch.items)
+
+
+class _Batch:
+    # the on_commit callback for one add_on_commit key
+
+    def __init__(self, key, apply):
+        self.apply = apply
+        # what Django calls the callback when it logs a failure
+        self.__qualname__ = f"{type(self).__qualname__}{key!r}"
+        self.items = []
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        self.apply(self.items)
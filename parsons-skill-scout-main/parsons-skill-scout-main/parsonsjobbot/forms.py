@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 import os
 from django.contrib.auth.models import User
+from .upload_handlers import matches_extension
 
 class ResumeUploadForm(forms.Form):
     """
@@ -24,9 +25,52 @@ class ResumeUploadForm(forms.Form):
         if ext not in allowed_extensions:
             raise ValidationError("Unsupported file extension. Please upload a PDF, DOC, or DOCX file.")
 
+        # the extension can be anything, the first bytes of the file tell what it really is
+        if not matches_extension(resume):
+            raise ValidationError(f"This does not look like a {ext[1:].upper()} file. Please upload a PDF, DOC, or DOCX file.")
+
 
         return resume
     
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+class MultipleFileField(forms.FileField):
+    """
+    A FileField that takes any number of files at once and cleans to a list of them.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput(attrs={'class': 'custom-file-input'}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(file, initial) for file in data]
+        return [single_file_clean(data, initial)]
+
+class BulkResumeUploadForm(forms.Form):
+    """
+    Many resumes (or zips of resumes) at once, see BulkResumeView. Education and years of experience are only used for
+    the resumes the parser could not find them in.
+    """
+    resumes = MultipleFileField(label='Upload Resumes')
+    years_of_experience = forms.IntegerField(label='Years of Experience', required=False)
+    education = forms.CharField(label='Education', max_length=255, required=False)
+
+    def clean_resumes(self):
+        resumes = self.cleaned_data['resumes']
+        allowed_extensions = ['.pdf', '.doc', '.docx', '.zip']
+        for resume in resumes:
+            ext = os.path.splitext(resume.name)[1].lower()
+            if ext not in allowed_extensions:
+                raise ValidationError(f"Unsupported file extension on {resume.name}. Please upload PDF, DOC, DOCX or ZIP files.")
+            if not matches_extension(resume):
+                raise ValidationError(f"{resume.name} does not look like a {ext[1:].upper()} file.")
+
+
+        return resumes
+
 class XlsxUploadForm(forms.Form):
     """
     If you want to make more fields to put in for the HTML for resume uploading put them here first and then use the variable name
@@ -44,6 +88,9 @@ class XlsxUploadForm(forms.Form):
         if ext not in allowed_extensions:
             raise ValidationError("Unsupported file extension. Please upload a XLSX file.")
 
+        if not matches_extension(xlsx):
+            raise ValidationError("This does not look like a XLSX file. Please upload a XLSX file.")
+
 
         return xlsx
 
@@ -64,6 +111,9 @@ class SOWUploadForm(forms.Form):
         if ext not in allowed_extensions:
             raise ValidationError("Unsupported file extension. Please upload a PDF or DOCX file.")
 
+        if not matches_extension(sow):
+            raise ValidationError(f"This does not look like a {ext[1:].upper()} file. Please upload a PDF or DOCX file.")
+
 
         return sow
 
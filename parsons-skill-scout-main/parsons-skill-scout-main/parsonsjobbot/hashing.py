@@ -0,0 +1,34 @@
+import hashlib
+
+# length of the hex digests we store, sha256 gives 64 hex characters
+CONTENT_HASH_LENGTH = 64
+
+
+def content_hash(text: str) -> str:
+    """
+    Fixed length fingerprint of a piece of text, used to key caches instead of comparing the (long) text itself.
+
+    Example:
+        content_hash("Python, Django, SQL")
+        # Output: 'c4f1b0...' (64 hex characters)
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def file_hash(file) -> str:
+    """
+    content_hash for the bytes of an uploaded (or any Django) file. Uploads come with the hash already worked out while
+    they streamed in (see upload_handlers.py), anything else is read a chunk at a time and left rewound.
+
+    Example:
+        file_hash(request.FILES['resume'])
+        # Output: '9b2d4e...' (64 hex characters)
+    """
+    if getattr(file, 'content_hash', None):
+        return file.content_hash
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
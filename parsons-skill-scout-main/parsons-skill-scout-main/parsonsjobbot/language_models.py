@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+import time
+
+import spacy
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# every spaCy pipeline we load lives here once per process, keyed by the name passed to spacy.load()
+_models = {}
+_model_stats = {}
+_models_lock = threading.Lock()
+
+
+def get_model(name: str):
+    """
+    Returns the spaCy pipeline for the given name, loading it the first time it is asked for.
+
+    Loading en_core_web_lg takes seconds and hundreds of MB so it should only ever happen once per process.
+    The lock makes sure two requests that come in at the same time do not both load the same model.
+
+    Args:
+        name (str): The name (or path) of the spaCy pipeline, the same thing you would pass to spacy.load().
+
+    Returns:
+        spacy.language.Language: The loaded pipeline, shared by everyone in this process.
+
+    Example:
+        nlp = get_model('en_core_web_sm')
+        doc = nlp("Python, Django, SQL")
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _models_lock:
+        # someone else may have loaded it while we were waiting on the lock
+        model = _models.get(name)
+        if model is None:
+            memory_before = _resident_memory()
+            start = time.perf_counter()
+            model = spacy.load(name)
+            load_seconds = time.perf_counter() - start
+            memory_after = _resident_memory()
+
+            memory_used = None
+            if memory_before is not None and memory_after is not None:
+                memory_used = memory_after - memory_before
+
+            _model_stats[name] = {
+                'load_seconds': load_seconds,
+                'resident_memory_bytes': memory_used,
+            }
+            logger.info(
+                "Loaded spaCy model %s in %.2fs (%s resident)",
+                name, load_seconds, _format_bytes(memory_used),
+            )
+            _models[name] = model
+
+    return model
+
+
+def get_preprocessing_model():
+    """
+    The small pipeline used for lemmatising and stop word removal (settings.NLP_PREPROCESSING_MODEL).
+    """
+    return get_model(settings.NLP_PREPROCESSING_MODEL)
+
+
+def get_similarity_model():
+    """
+    The large pipeline with word vectors used for similarity scores (settings.NLP_SIMILARITY_MODEL).
+    """
+    return get_model(settings.NLP_SIMILARITY_MODEL)
+
+
+def model_stats() -> dict:
+    """
+    Load time and resident memory for each model loaded in this process so far.
+
+    Example:
+        model_stats()
+        # Output: {'en_core_web_sm': {'load_seconds': 0.61, 'resident_memory_bytes': 48234496}, ...}
+    """
+    return {name: dict(stats) for name, stats in _model_stats.items()}
+
+
+def _resident_memory():
+    """
+    Current resident set size of this process in bytes, or None if we have no way of reading it here.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        # windows has neither /proc nor resource
+        return None
+    # ru_maxrss is the peak rather than the current size but it still grows by the model's footprint
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+
+def _format_bytes(size):
+    if size is None:
+        return "unknown memory"
+    return f"{size / (1024 * 1024):.1f} MB"
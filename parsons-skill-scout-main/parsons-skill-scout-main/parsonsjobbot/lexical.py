@@ -0,0 +1,336 @@
+import pickle
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from .hashing import content_hash
+from .match_cache import bump_data_version, data_version
+from .models import Candidate, LexicalModelFit, SimilarityScoreMatcher, SOWPosition
+from .preprocessing import pipeline_key, preprocess_texts
+from .vectors import candidate_match_text, position_match_text
+
+# the SIMILARITY_BACKEND values this module handles, 'vectors' is the spaCy document vector engine in vectors.py
+LEXICAL_BACKENDS = ('tfidf', 'bm25')
+
+# the rows term_rows() keeps for each kind, with the model and how to get their text
+TERM_ROW_KINDS = {
+    'candidates': (Candidate, candidate_match_text),
+    'positions': (SOWPosition, position_match_text),
+}
+
+# above this many ids an IN (...) list can hit SQLite's variable limit, so texts are read in chunks
+MAX_TERM_ROW_IDS = 500
+
+# the fitted models this process has loaded from LexicalModelFit, weighting -> model, see get_lexical_model()
+_lexical_models = {}
+_lexical_model_lock = threading.Lock()
+
+
+class LexicalModel:
+    """
+    TF-IDF or BM25 term weights fitted over a corpus of preprocessed texts, for scoring by word overlap.
+
+    Texts are turned into sparse, l2 normalised rows of term weights, so scoring a whole set of candidates against a
+    whole set of positions is a single sparse matrix product and the scores are cosines between 0 and 1, like the
+    document vector engine. Only the spaCy lemmatiser (the small model) is needed, never en_core_web_lg.
+
+    Attributes:
+        weighting (str): 'tfidf' (sublinear term frequency times idf) or 'bm25' (saturated term frequency with
+            document length normalisation, times the BM25 idf).
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 document length normalisation.
+        fingerprint (str): Hash of the corpus and settings it was fitted on, see corpus_fingerprint().
+        term_rows (dict): The transform() of every candidate and position as of a match data version, kept with the
+            model (and stored with the fit) so the lexical retriever does not weight them all on every call, see
+            term_rows().
+
+    Usage:
+        model = LexicalModel(preprocess_texts(corpus), weighting='bm25')
+        model.similarity(model.transform(["python sql"]), model.transform(["python developer"]))
+        # Output: array([[37.8]], dtype=float32)
+    """
+
+    def __init__(self, texts: list[str], weighting: str = 'tfidf', k1: float = 1.5, b: float = 0.75, fingerprint: str = ''):
+        if weighting not in LEXICAL_BACKENDS:
+            raise ValueError(f"Unknown lexical weighting: {weighting}")
+        self.weighting = weighting
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = fingerprint
+        self.term_rows = {}
+
+        # the texts are already lemmatised and space separated by preprocess_texts, so splitting is all that is left
+        if not any(text.split() for text in texts):
+            # nothing to learn weights from (no rows yet), every score is 0 until there is
+            self._vectorizer = None
+        elif weighting == 'tfidf':
+            self._vectorizer = TfidfVectorizer(analyzer=str.split, sublinear_tf=True, dtype=np.float32)
+            self._vectorizer.fit(texts)
+        else:
+            self._vectorizer = CountVectorizer(analyzer=str.split, dtype=np.float32)
+            counts = self._vectorizer.fit_transform(texts)
+            documents = max(counts.shape[0], 1)
+            document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+            self._idf = np.log1p((documents - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+            self._average_length = max(float(counts.sum()) / documents, 1.0)
+
+    def transform(self, texts: list[str]):
+        """
+        Sparse (texts x vocabulary) matrix of l2 normalised term weights. Words that were not in the corpus are ignored.
+
+        Args:
+            texts (list): Preprocessed texts (see preprocess_texts).
+        """
+        if self._vectorizer is None:
+            return sparse.csr_matrix((len(texts), 0), dtype=np.float32)
+        if self.weighting == 'tfidf':
+            return self._vectorizer.transform(texts)
+
+        counts = self._vectorizer.transform(texts).tocsr()
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        # BM25: tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average length)), worked out on the non zero entries only
+        row_of_entry = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        length_norm = self.k1 * (1 - self.b + self.b * lengths[row_of_entry] / self._average_length)
+        counts.data = (counts.data * (self.k1 + 1) / (counts.data + length_norm)) * self._idf[counts.indices]
+        return normalize(counts)
+
+    @staticmethod
+    def similarity(candidate_matrix, position_matrix) -> np.ndarray:
+        """
+        Dense (candidates x positions) similarity percentages from two transform() matrices.
+        """
+        return np.asarray((candidate_matrix @ position_matrix.T).todense(), dtype=np.float32) * 100
+
+
+def lexical_similarity_matrix(candidate_texts: list[str], position_texts: list[str], model: LexicalModel = None) -> np.ndarray:
+    """
+    The lexical counterpart of matching.similarity_matrix: scores every candidate text against every position text.
+
+    Args:
+        candidate_texts (list): Raw candidate texts (candidate_match_text).
+        position_texts (list): Raw position texts (position_match_text).
+        model (LexicalModel): The model to score with, defaults to get_lexical_model().
+
+    Returns:
+        np.ndarray: A (candidates x positions) matrix of similarity percentages.
+    """
+    if not candidate_texts or not position_texts:
+        return np.zeros((len(candidate_texts), len(position_texts)), dtype=np.float32)
+
+    model = model or get_lexical_model()
+    preprocessed = preprocess_texts(list(candidate_texts) + list(position_texts))
+    candidate_matrix = model.transform(preprocessed[:len(candidate_texts)])
+    position_matrix = model.transform(preprocessed[len(candidate_texts):])
+    return model.similarity(candidate_matrix, position_matrix)
+
+
+def term_rows(model: LexicalModel, kind: str) -> tuple:
+    """
+    The ids and transform() rows of every candidate ('candidates') or SOW position ('positions'), for ranking them all
+    against one text with a single sparse product.
+
+    They are kept on the model. While the match data version (see match_cache.py) stays the same that costs one small
+    query. Once it moves, only the ids and match_hashes are read and just the rows that are new or whose text changed
+    are preprocessed and weighted again.
+
+    Args:
+        model (LexicalModel): The fitted model.
+        kind (str): 'candidates' or 'positions'.
+
+    Returns:
+        tuple: (list of ids, sparse matrix with a row per id).
+
+    Example:
+        ids, matrix = term_rows(get_lexical_model('bm25'), 'candidates')
+    """
+    version = data_version()
+    kept = model.term_rows.get(kind)
+    if kept is not None and kept[0] == version:
+        return kept[1], kept[3]
+
+    row_model, match_text = TERM_ROW_KINDS[kind]
+    rows = list(row_model.objects.values_list('pk', 'match_hash'))
+    kept_rows = {} if kept is None else {item_id: (row, match_hash) for row, (item_id, match_hash) in enumerate(zip(kept[1], kept[2]))}
+    # rows saved before match_hash was kept have none, their text is weighted again every time to be safe
+    changed = [item_id for item_id, match_hash in rows if not match_hash or kept_rows.get(item_id, (None, None))[1] != match_hash]
+
+    texts = {}
+    for start in range(0, len(changed), MAX_TERM_ROW_IDS):
+        for instance in row_model.objects.filter(pk__in=changed[start:start + MAX_TERM_ROW_IDS]):
+            texts[instance.pk] = match_text(instance)
+    changed = [item_id for item_id in changed if item_id in texts]
+    changed_rows = {item_id: row for row, item_id in enumerate(changed)}
+    rows = [(item_id, match_hash) for item_id, match_hash in rows if item_id in texts or item_id in kept_rows]
+
+    # the kept rows first and the new ones after them, then put in the order the ids came in
+    blocks = [kept[3]] if kept_rows else []
+    if changed:
+        blocks.append(model.transform(preprocess_texts([texts[item_id] for item_id in changed])))
+    order = [changed_rows[item_id] + len(kept_rows) if item_id in changed_rows else kept_rows[item_id][0] for item_id, _ in rows]
+    if blocks:
+        matrix = sparse.vstack(blocks, format='csr')[order]
+    else:
+        # sklearn will not transform no texts at all
+        matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+
+    ids = [item_id for item_id, _ in rows]
+    model.term_rows[kind] = (version, ids, [match_hash for _, match_hash in rows], matrix)
+    return ids, matrix
+
+
+def lexical_scoring_version(fingerprint: str) -> str:
+    """
+    The scoring_version lexical scores are cached under: settings.SIMILARITY_SCORING_VERSION plus the fingerprint of
+    the fit, so scores from an older fit never get ranked against scores from the current one.
+
+    Example:
+        lexical_scoring_version(get_lexical_model().fingerprint)
+        # Output: '1-3f9a0c2e7b1d4a66'
+    """
+    return f"{settings.SIMILARITY_SCORING_VERSION}-{fingerprint[:16]}"
+
+
+def lexical_weightings() -> list[str]:
+    """
+    The weightings the settings use: the SIMILARITY_BACKEND when it is lexical and MATCH_RETRIEVER_WEIGHTING when the
+    'lexical' retriever is on. These are the models the fit_lexical_model job keeps fitted.
+    """
+    weightings = []
+    if settings.SIMILARITY_BACKEND in LEXICAL_BACKENDS:
+        weightings.append(settings.SIMILARITY_BACKEND)
+    if settings.MATCH_RETRIEVER == 'lexical' and settings.MATCH_RETRIEVER_WEIGHTING not in weightings:
+        weightings.append(settings.MATCH_RETRIEVER_WEIGHTING)
+    return weightings
+
+
+def corpus_texts() -> list[str]:
+    """
+    Every candidate text and SOWPosition.posdesc, what the lexical models are fitted over.
+    """
+    corpus = [candidate_match_text(candidate) for candidate in Candidate.objects.only('skills', 'education')]
+    corpus += list(SOWPosition.objects.values_list('posdesc', flat=True))
+    return corpus
+
+
+def corpus_fingerprint(weighting: str, texts: list[str]) -> str:
+    """
+    Hash of everything a fit depends on: the texts (in any order), the weighting, the BM25 parameters and the
+    preprocessing pipeline.
+    """
+    settings_key = [weighting, str(settings.SIMILARITY_BM25_K1), str(settings.SIMILARITY_BM25_B), pipeline_key()]
+    return content_hash('\n'.join(settings_key + sorted(content_hash(text) for text in texts)))
+
+
+def corpus_size() -> int:
+    """
+    How many texts corpus_texts() has, in two counts rather than reading them.
+    """
+    return Candidate.objects.count() + SOWPosition.objects.count()
+
+
+def corpus_drifted(fitted_size: int, size: int) -> bool:
+    """
+    Whether the corpus has grown or shrunk by more than settings.LEXICAL_REFIT_DRIFT since it was fitted over
+    fitted_size texts.
+
+    Example:
+        corpus_drifted(1000, 1050)
+        # Output: False
+    """
+    return abs(size - fitted_size) > settings.LEXICAL_REFIT_DRIFT * max(fitted_size, 1)
+
+
+def fit_lexical_model(weighting: str = None, force: bool = False) -> LexicalModel:
+    """
+    Fits the LexicalModel for a weighting over corpus_texts() and stores it in LexicalModelFit for every process.
+
+    Term weights only shift a little as candidates and positions come and go, and every fit starts a new set of
+    cached scores (see lexical_scoring_version), so a stored model is only fitted again once the corpus size has
+    drifted by more than settings.LEXICAL_REFIT_DRIFT, or with force. New words count from the next fit. The scores
+    cached under the fit before are kept for the processes that still have it loaded, older ones are dropped. Run it
+    through `manage.py fit_lexical_model` (from cron) or the fit_lexical_model job, never from a request.
+
+    Args:
+        weighting (str): 'tfidf' or 'bm25', defaults to settings.SIMILARITY_BACKEND.
+        force (bool): Fit even when the corpus has not drifted.
+
+    Returns:
+        LexicalModel: The stored model.
+
+    Example:
+        fit_lexical_model('bm25').fingerprint
+        # Output: '3f9a0c2e7b1d4a66...'
+    """
+    weighting = weighting or settings.SIMILARITY_BACKEND
+    stored = LexicalModelFit.objects.filter(weighting=weighting).values('fingerprint', 'corpus_size').first()
+    if stored is not None and not force and not corpus_drifted(stored['corpus_size'], corpus_size()):
+        return get_lexical_model(weighting)
+
+    texts = corpus_texts()
+    fingerprint = corpus_fingerprint(weighting, texts)
+    if stored is not None and stored['fingerprint'] == fingerprint:
+        return get_lexical_model(weighting)
+
+    model = LexicalModel(
+        preprocess_texts(texts),
+        weighting=weighting,
+        k1=settings.SIMILARITY_BM25_K1,
+        b=settings.SIMILARITY_BM25_B,
+        fingerprint=fingerprint,
+    )
+    # stored with the fit, so no process has to weight every row the first time the lexical retriever asks
+    for kind in TERM_ROW_KINDS:
+        term_rows(model, kind)
+    previous_fingerprint = stored['fingerprint'] if stored is not None else ''
+    try:
+        with transaction.atomic():
+            LexicalModelFit.objects.update_or_create(weighting=weighting, defaults={
+                'fingerprint': fingerprint,
+                'previous_fingerprint': previous_fingerprint,
+                'corpus_size': len(texts),
+                'model': pickle.dumps(model),
+            })
+            # nobody reads scores from two fits back any more
+            current_versions = [lexical_scoring_version(fingerprint), lexical_scoring_version(previous_fingerprint)]
+            SimilarityScoreMatcher.objects.filter(scoring_model=weighting).exclude(scoring_version__in=current_versions).delete()
+            bump_data_version()
+    except IntegrityError:
+        # another process stored its first fit at the same time, theirs is just as good
+        return get_lexical_model(weighting)
+
+    with _lexical_model_lock:
+        _lexical_models[weighting] = model
+    return model
+
+
+def get_lexical_model(weighting: str = None) -> LexicalModel:
+    """
+    The stored LexicalModel for settings.SIMILARITY_BACKEND (see fit_lexical_model).
+
+    It is loaded once per process and loaded again when another process stores a new fit, which costs one small
+    query per call. It is never fitted here, fitting is a pass of spaCy over every text and has no place in a request.
+
+    Args:
+        weighting (str): 'tfidf' or 'bm25' when something other than the scoring backend needs a model (such as the
+            lexical retriever in retrieval.py), defaults to settings.SIMILARITY_BACKEND.
+
+    Raises:
+        ImproperlyConfigured: Nothing has been fitted yet, run `manage.py fit_lexical_model`.
+    """
+    weighting = weighting or settings.SIMILARITY_BACKEND
+    fingerprint = LexicalModelFit.objects.filter(weighting=weighting).values_list('fingerprint', flat=True).first()
+    if fingerprint is None:
+        raise ImproperlyConfigured(f"There is no {weighting} model yet, run `manage.py fit_lexical_model --weighting {weighting}`")
+
+    with _lexical_model_lock:
+        model = _lexical_models.get(weighting)
+        if model is None or model.fingerprint != fingerprint:
+            model = pickle.loads(LexicalModelFit.objects.get(weighting=weighting).model)
+            _lexical_models[weighting] = model
+        return model
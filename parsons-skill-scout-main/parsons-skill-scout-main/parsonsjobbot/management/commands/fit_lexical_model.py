@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from parsonsjobbot.lexical import LEXICAL_BACKENDS, fit_lexical_model, lexical_weightings
+
+
+class Command(BaseCommand):
+    """
+    Fits the TF-IDF/BM25 models over the current candidates and positions and stores them for every process, see
+    parsonsjobbot/lexical.py. Run it once after deploying with a lexical SIMILARITY_BACKEND or MATCH_RETRIEVER (the
+    pages need a model and never fit one themselves) and then from cron: a model is only fitted again once the number
+    of candidates and positions has drifted by more than settings.LEXICAL_REFIT_DRIFT, or with --force.
+
+    Usage:
+        python manage.py fit_lexical_model
+        python manage.py fit_lexical_model --weighting bm25 --force
+    """
+    help = "Fits the TF-IDF/BM25 models the lexical backends score with"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weighting', choices=list(LEXICAL_BACKENDS), action='append', help="Only fit these, defaults to the ones the settings use")
+        parser.add_argument('--force', action='store_true', help="Fit even when the corpus has not drifted")
+
+    def handle(self, *args, **options):
+        for weighting in options['weighting'] or lexical_weightings():
+            model = fit_lexical_model(weighting, force=options['force'])
+            self.stdout.write(f"{weighting} model is {model.fingerprint[:12]}")
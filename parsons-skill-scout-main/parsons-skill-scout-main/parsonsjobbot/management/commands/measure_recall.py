@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from parsonsjobbot.retrieval import RETRIEVERS, measure_recall
+
+
+class Command(BaseCommand):
+    """
+    Measures how many of the full scan's top k matches a retriever's shortlist keeps, see parsonsjobbot/retrieval.py.
+
+    Usage:
+        python manage.py measure_recall --retriever skills --n 100 --k 25 --sample 50
+        python manage.py measure_recall --direction candidates --retriever lexical
+    """
+    help = "Measures the recall@k of the match shortlist against scoring everything"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--direction', choices=['positions', 'candidates'], default='positions', help="Positions for candidates or candidates for positions")
+        parser.add_argument('--retriever', choices=RETRIEVERS, action='append', help="The retrievers to measure, defaults to settings.MATCH_RETRIEVER")
+        parser.add_argument('--n', type=int, default=100, help="Shortlist size")
+        parser.add_argument('--k', type=int, default=25, help="How many matches are shown")
+        parser.add_argument('--sample', type=int, help="Only measure this many random candidates (positions)")
+
+    def handle(self, *args, **options):
+        for retriever in options['retriever'] or [None]:
+            result = measure_recall(options['direction'], retriever, n=options['n'], k=options['k'], sample=options['sample'])
+            self.stdout.write(
+                f"{result['retriever']}: recall@{options['k']} {result['recall']:.3f} (min {result['min_recall']:.3f}) "
+                f"over {result['queries']} queries with n={options['n']}, "
+                f"retrieval {result['retrieve_seconds']:.2f}s vs full scan {result['full_scan_seconds']:.2f}s"
+            )
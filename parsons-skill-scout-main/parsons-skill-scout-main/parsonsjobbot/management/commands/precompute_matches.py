@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from parsonsjobbot.rematch import precompute_matches, scoring_workers
+
+
+class Command(BaseCommand):
+    """
+    Scores every candidate against every open position that is not in the SimilarityScoreMatcher cache yet, so the
+    match pages are warm before people log in. See precompute_matches in parsonsjobbot/rematch.py.
+
+    An interrupted run carries on from its checkpoint the next time, --restart looks at every candidate again.
+
+    Usage:
+        python manage.py precompute_matches
+        python manage.py precompute_matches --workers 8
+        python manage.py precompute_matches --restart
+    """
+    help = "Scores the candidate/open position pairs that are not cached yet, resuming an interrupted run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="How many processes to score on, defaults to one per core")
+        parser.add_argument('--checkpoint', default=None, help="Checkpoint file, defaults to settings.MATCH_PRECOMPUTE_CHECKPOINT")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of an earlier run")
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or scoring_workers()
+        started = time.perf_counter()
+
+        def progress(done, total):
+            elapsed = time.perf_counter() - started
+            rate = done / elapsed if elapsed else 0
+            eta = (total - done) / rate if rate else 0
+            self.stdout.write(f"Scored {done}/{total} pairs, {rate:.0f} pairs/s, ETA {eta:.0f}s")
+
+        result = precompute_matches(workers=workers, checkpoint=options['checkpoint'], restart=options['restart'], progress=progress)
+        if result['resumed_after'] is not None:
+            self.stdout.write(f"Resumed after candidate {result['resumed_after']}")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Scored {result['scored']} pairs ({result['cached']} already cached) on {workers} workers in {elapsed:.1f}s, "
+            f"{result['scored'] / elapsed if elapsed else 0:.0f} pairs/s"
+        )
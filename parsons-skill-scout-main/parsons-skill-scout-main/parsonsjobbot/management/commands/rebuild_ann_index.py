@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from parsonsjobbot.ann_index import INDEX_KINDS, rebuild_index
+
+
+class Command(BaseCommand):
+    """
+    Builds the ANN index files again from the vectors stored in the database, see parsonsjobbot/ann_index.py. Saves
+    keep them up to date, so this is for rows that went in without the signals (loaddata, bulk imports).
+
+    Usage:
+        python manage.py rebuild_ann_index
+        python manage.py rebuild_ann_index --kind positions
+    """
+    help = "Rebuilds the candidate and position ANN indexes from the stored vectors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(INDEX_KINDS), action='append', help="Only rebuild these kinds, defaults to both")
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or list(INDEX_KINDS):
+            index = rebuild_index(kind)
+            self.stdout.write(f"Rebuilt the {kind} index with {len(index)} vectors")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from parsonsjobbot.skill_index import KINDS, rebuild_skill_index
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the inverted skill index (SkillPosting) from the candidates, positions and job submissions, see
+    parsonsjobbot/skill_index.py. Saves keep it up to date, so this is for rows saved before the index existed.
+
+    Usage:
+        python manage.py rebuild_skill_index
+        python manage.py rebuild_skill_index --kind candidates
+    """
+    help = "Rebuilds the skill -> candidate/position/job submission index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=KINDS, action='append', help="Only rebuild these kinds, defaults to all of them")
+
+    def handle(self, *args, **options):
+        changed = rebuild_skill_index(options['kind'] or KINDS)
+        for kind, count in changed.items():
+            self.stdout.write(f"Reindexed {count} {kind.replace('_', ' ')}")
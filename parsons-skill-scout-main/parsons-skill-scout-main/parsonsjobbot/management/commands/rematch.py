@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from parsonsjobbot.rematch import rematch, scoring_workers
+
+
+class Command(BaseCommand):
+    """
+    Scores every candidate against every open position on a pool of processes and fills the SimilarityScoreMatcher
+    cache, see parsonsjobbot/rematch.py.
+
+    Usage:
+        python manage.py rematch
+        python manage.py rematch --workers 8
+    """
+    help = "Scores every candidate against every open position on a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="How many processes to score on, defaults to one per core")
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or scoring_workers()
+        started = time.perf_counter()
+        scored = rematch(workers=workers, progress=lambda done, total: self.stdout.write(f"Scored {done}/{total} candidates"))
+        self.stdout.write(f"Rematched {scored} scores on {workers} workers in {time.perf_counter() - started:.1f}s")
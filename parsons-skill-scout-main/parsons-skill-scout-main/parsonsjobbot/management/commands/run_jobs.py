@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def run_worker(worker: str, burst: bool, poll_interval: float):
+    # spawned processes (the default outside of linux) start without django set up, forked ones already have it
+    import django
+    django.setup()
+
+    from parsonsjobbot.tasks import work
+    work(worker, burst=burst, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    """
+    Runs background jobs (parsing uploads, precomputing match scores) from the database queue, see parsonsjobbot/tasks.py.
+
+    Usage:
+        python manage.py run_jobs --workers 4
+        python manage.py run_jobs --burst  # work through what is queued and exit, handy from cron
+    """
+    help = "Runs queued background jobs in one or more worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.BACKGROUND_JOB_WORKERS, help="How many worker processes to run")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is empty instead of waiting for more jobs")
+        parser.add_argument('--poll-interval', type=float, default=settings.BACKGROUND_JOB_POLL_INTERVAL, help="Seconds between looks at an empty queue")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        name = f'{socket.gethostname()}:{os.getpid()}'
+
+        if workers <= 1:
+            from parsonsjobbot.tasks import work
+            ran = work(f'{name}-1', burst=options['burst'], poll_interval=options['poll_interval'])
+            self.stdout.write(f"Ran {ran} background jobs")
+            return
+
+        # the database connection must not be shared with the forked workers
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(f'{name}-{number}', options['burst'], options['poll_interval']), name=f'{name}-{number}')
+            for number in range(1, workers + 1)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {workers} background job workers")
+
+        def stop(signum, frame):
+            # pass the signal on, every worker finishes its current job and exits
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for process in processes:
+            process.join()
+        self.stdout.write("All background job workers stopped")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from parsonsjobbot.ann_index import INDEX_KINDS
+from parsonsjobbot.snapshots import write_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Writes a new memory mapped snapshot of the stored candidate and position vectors and publishes it to every worker
+    process, see parsonsjobbot/snapshots.py. Run it after big imports or from cron, rows saved since the last snapshot
+    are read from the database until the next one.
+
+    Usage:
+        python manage.py write_vector_snapshot
+        python manage.py write_vector_snapshot --kind positions
+    """
+    help = "Writes a shared, memory mapped snapshot of the candidate and position vectors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(INDEX_KINDS), action='append', help="Only snapshot these kinds, defaults to both")
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or list(INDEX_KINDS):
+            snapshot = write_snapshot(kind)
+            self.stdout.write(f"Wrote {kind} snapshot version {snapshot.version} with {len(snapshot)} vectors")
@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError
+from django.db.models import F
+
+from .models import MatchDataVersion
+
+# the CACHES alias match lists are kept in, see settings.CACHES for the backend and how many entries it keeps
+MATCH_CACHE_ALIAS = 'matches'
+
+# there is only ever one MatchDataVersion row
+DATA_VERSION_PK = 1
+
+
+def data_version() -> int:
+    """
+    The current match data version, 0 until something has changed.
+    """
+    return MatchDataVersion.objects.filter(pk=DATA_VERSION_PK).values_list('version', flat=True).first() or 0
+
+
+def bump_data_version():
+    """
+    Retires every cached match list. Called by signals.py whenever a candidate, a position or the open/closed state of
+    the XLSX changes, call it yourself after bulk operations that skip the signals.
+
+    The bump is part of the current transaction, so nobody sees the new version before the data that goes with it.
+    """
+    if MatchDataVersion.objects.filter(pk=DATA_VERSION_PK).update(version=F('version') + 1):
+        return
+    try:
+        MatchDataVersion.objects.create(pk=DATA_VERSION_PK, version=1)
+    except IntegrityError:
+        # another process created the row first, bumping theirs is just as good
+        MatchDataVersion.objects.filter(pk=DATA_VERSION_PK).update(version=F('version') + 1)
+
+
+def cached_matches(model, kind: str, object_id: int, compute, **parameters) -> list:
+    """
+    The final, sorted match list for a candidate or position, from the match cache when it is there.
+
+    Only (pk, score) pairs are cached, so a hit costs the data version lookup, one cache read and one query for the
+    matched rows, however long the list is. The key holds the data version and the scoring settings, so anything
+    that changes the list (or how it is scored) makes a new key and the old entries age out of the cache.
+
+    Args:
+        model (Model): SOWPosition or Candidate, what the list is made of.
+        kind (str): Which list this is, such as 'positions_for_candidate'.
+        object_id (int): The candidate or position the list is for.
+        compute (function): Works the list out on a miss, returns [(instance, score), ...].
+        **parameters: Anything else the list depends on, such as k.
+
+    Returns:
+        list: (instance, score) tuples, best first.
+
+    Example:
+        cached_matches(SOWPosition, 'positions_for_candidate', candidate.pk, lambda: get_open_positions_for_candidate(candidate, k=25), k=25)
+        # Output: [(<SOWPosition: ...>, 83.32475812503635), ...]
+    """
+    cache = caches[MATCH_CACHE_ALIAS]
+    key = match_cache_key(data_version(), kind, object_id, **parameters)
+
+    matches = cache.get(key)
+    if matches is not None:
+        instances = model.objects.defer('vector').in_bulk([pk for pk, _ in matches])
+        # a row deleted since the version was read is simply left out
+        return [(instances[pk], score) for pk, score in matches if pk in instances]
+
+    matches = compute()
+    cache.set(key, [(instance.pk, score) for instance, score in matches])
+    return matches
+
+
+async def acached_matches(model, kind: str, object_id: int, compute, **parameters) -> list:
+    """
+    cached_matches for async views, compute is a coroutine function here (see async_matching.py).
+    """
+    cache = caches[MATCH_CACHE_ALIAS]
+    version = await MatchDataVersion.objects.filter(pk=DATA_VERSION_PK).values_list('version', flat=True).afirst()
+    key = match_cache_key(version or 0, kind, object_id, **parameters)
+
+    matches = await cache.aget(key)
+    if matches is not None:
+        instances = await model.objects.defer('vector').ain_bulk([pk for pk, _ in matches])
+        return [(instances[pk], score) for pk, score in matches if pk in instances]
+
+    matches = await compute()
+    await cache.aset(key, [(instance.pk, score) for instance, score in matches])
+    return matches
+
+
+def match_cache_key(version: int, kind: str, object_id: int, **parameters) -> str:
+    settings_key = (settings.SIMILARITY_BACKEND, settings.SIMILARITY_SCORING_VERSION, settings.MATCH_RETRIEVER)
+    parameters_key = ':'.join(f'{name}={value}' for name, value in sorted(parameters.items()))
+    return f"matches:{version}:{':'.join(map(str, settings_key))}:{kind}:{object_id}:{parameters_key}"
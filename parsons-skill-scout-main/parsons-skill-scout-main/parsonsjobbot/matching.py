@@ -0,0 +1,474 @@
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import QuerySet
+
+from .hashing import content_hash
+from .lexical import LEXICAL_BACKENDS, get_lexical_model, lexical_scoring_version, lexical_similarity_matrix
+from .match_cache import bump_data_version
+from .models import Candidate, SOWPosition, XlsxJob, SimilarityScoreMatcher
+from .preprocessing import cached_preprocessed_texts, preprocess_texts, preprocess_uncached, store_preprocessed_texts
+from .score_pool import score_matrices
+from .vectors import VECTOR_BACKEND, candidate_match_text, position_match_text, candidate_vectors, position_vectors
+
+# at most this many ids go in one IN (...) list, longer ones can hit SQLite's variable limit, so reads are chunked
+MAX_CACHE_FILTER_IDS = 500
+
+
+def open_sow_positions():
+    """
+    All SOWPositions that line up (by tonum and posnum) with an XlsxJob that is marked open.
+
+    The XlsxJob.sow_positions links are kept up to date in signals.py, so this is one query that joins through the link
+    table, however many positions the NEE sheet has open.
+
+    Returns:
+        QuerySet: The open SOWPositions, empty if there are no open XlsxJobs.
+    """
+    open_links = XlsxJob.sow_positions.through.objects.filter(xlsxjob__open_or_closed='open')
+    return SOWPosition.objects.filter(pk__in=open_links.values('sowposition_id'))
+
+
+def link_xlsx_jobs(xlsx_jobs: list, created: bool = False):
+    """
+    (Re)links XlsxJob rows to the SOWPositions on the same tonum and posnum, in a fixed number of queries.
+
+    signals.py does this for every save, call it yourself after a bulk_create (which skips the signals).
+
+    Args:
+        xlsx_jobs (list): Saved XlsxJob instances.
+        created (bool): The rows were only just created, so they have no links to drop yet.
+    """
+    Link = XlsxJob.sow_positions.through
+    xlsx_jobs = list(xlsx_jobs)
+    if not xlsx_jobs:
+        return
+
+    positions = defaultdict(list)
+    tonums = {xlsx_job.tonum for xlsx_job in xlsx_jobs}
+    for position_id, tonum, posnum in SOWPosition.objects.filter(tonum__in=tonums).values_list('pk', 'tonum', 'posnum'):
+        positions[(tonum, posnum)].append(position_id)
+
+    if not created:
+        Link.objects.filter(xlsxjob__in=[xlsx_job.pk for xlsx_job in xlsx_jobs]).delete()
+    Link.objects.bulk_create([
+        Link(xlsxjob_id=xlsx_job.pk, sowposition_id=position_id)
+        for xlsx_job in xlsx_jobs
+        for position_id in positions[(xlsx_job.tonum, xlsx_job.posnum)]
+    ], ignore_conflicts=True)
+    # which positions are open may have changed, retire the cached match lists
+    bump_data_version()
+
+
+def link_sow_position(sow_position: SOWPosition):
+    """
+    (Re)links a SOWPosition to the XlsxJob rows on the same tonum and posnum.
+    """
+    sow_position.xlsx_jobs.set(XlsxJob.objects.filter(tonum=sow_position.tonum, posnum=sow_position.posnum))
+    bump_data_version()
+
+
+def similarity_backend() -> str:
+    """
+    settings.SIMILARITY_BACKEND: 'vectors' (spaCy document vectors), 'tfidf' or 'bm25' (sparse word overlap, lexical.py).
+    """
+    backend = settings.SIMILARITY_BACKEND
+    if backend != VECTOR_BACKEND and backend not in LEXICAL_BACKENDS:
+        raise ImproperlyConfigured(f"SIMILARITY_BACKEND must be one of {(VECTOR_BACKEND,) + LEXICAL_BACKENDS}, not {backend!r}")
+    return backend
+
+
+def scoring_key(lexical_model=None) -> tuple[str, str]:
+    """
+    The (scoring_model, scoring_version) that cached SimilarityScoreMatcher rows are stored under.
+
+    The scoring_model is the spaCy model for the vector backend and the backend name otherwise, so switching backends
+    never serves scores from the other one. Bump settings.SIMILARITY_SCORING_VERSION whenever the way scores are
+    computed changes so old rows stop matching. Lexical scores also carry the fingerprint of the fitted model, so a
+    refit starts a new set (see lexical.lexical_scoring_version).
+
+    Args:
+        lexical_model (LexicalModel): The model the scores were computed with, defaults to get_lexical_model().
+    """
+    backend = similarity_backend()
+    if backend == VECTOR_BACKEND:
+        return settings.NLP_SIMILARITY_MODEL, settings.SIMILARITY_SCORING_VERSION
+    return backend, lexical_scoring_version((lexical_model or get_lexical_model()).fingerprint)
+
+
+def vector_matrix(vectors: list) -> np.ndarray:
+    """
+    Stacks unit length document vectors into one (rows x dimensions) float32 matrix.
+    """
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(vectors).astype(np.float32, copy=False)
+
+
+def similarity_matrix(candidate_matrix: np.ndarray, position_matrix: np.ndarray) -> np.ndarray:
+    """
+    Scores every candidate against every position with one matrix multiply.
+
+    The stored vectors are already normalised so the dot product is the cosine similarity, the same number
+    compute_similarity_percentage gives for a single pair.
+
+    Args:
+        candidate_matrix (np.ndarray): (candidates x dimensions) matrix from vector_matrix().
+        position_matrix (np.ndarray): (positions x dimensions) matrix from vector_matrix().
+
+    Returns:
+        np.ndarray: A (candidates x positions) matrix of similarity percentages.
+    """
+    if not candidate_matrix.size or not position_matrix.size:
+        return np.zeros((len(candidate_matrix), len(position_matrix)), dtype=np.float32)
+    return (candidate_matrix @ position_matrix.T) * 100
+
+
+def scoring_inputs(candidates: list, positions: list, lexical_model=None) -> tuple:
+    """
+    The candidate and position matrices settings.SIMILARITY_BACKEND scores with, for when the scoring itself happens
+    somewhere else (a process pool, an executor). score_pool.score_matrices turns any rows of them into scores.
+
+    Args:
+        candidates (list): The Candidate rows.
+        positions (list): The SOWPosition rows.
+        lexical_model (LexicalModel): The model for the lexical backends, defaults to get_lexical_model(). Pass the
+            one scoring_key() was given so the scores are cached under the model that computed them.
+
+    Returns:
+        tuple: (candidate matrix, position matrix), dense unit vectors or sparse l2 normalised term weights.
+    """
+    if similarity_backend() == VECTOR_BACKEND:
+        return vector_matrix(candidate_vectors(candidates)), vector_matrix(position_vectors(positions))
+
+    model = lexical_model or get_lexical_model()
+    preprocessed = preprocess_texts([candidate_match_text(candidate) for candidate in candidates] + [position_match_text(position) for position in positions])
+    return model.transform(preprocessed[:len(candidates)]), model.transform(preprocessed[len(candidates):])
+
+
+def top_k(scores: np.ndarray, k: int = None) -> np.ndarray:
+    """
+    Indices of the k highest scores in every row, best first.
+
+    argpartition pulls the k best out of each row in linear time so only those k get sorted, which matters when
+    there are thousands of columns but we only want to show the top few.
+
+    Args:
+        scores (np.ndarray): A 2d score matrix, pass scores.T to rank down the columns instead.
+        k (int): How many to keep per row, None keeps (and sorts) everything.
+
+    Returns:
+        np.ndarray: A (rows x k) matrix of column indices.
+
+    Example:
+        top_k(np.array([[10., 80., 40.]]), 2)
+        # Output: array([[1, 2]])
+    """
+    scores = np.atleast_2d(scores)
+    columns = scores.shape[1]
+    if k is None or k >= columns:
+        return np.argsort(-scores, axis=1, kind='stable')
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.intp)
+
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    return np.take_along_axis(best, np.argsort(-best_scores, axis=1, kind='stable'), axis=1)
+
+
+class MatchMatrix:
+    """
+    Similarity scores for a set of candidates against a set of SOW positions, computed in one go with the
+    settings.SIMILARITY_BACKEND engine (a dense matrix multiply of document vectors or a sparse TF-IDF/BM25 product).
+
+    Attributes:
+        candidates (list): The Candidate rows, in the order of the score matrix rows.
+        positions (list): The SOWPosition rows, in the order of the score matrix columns.
+        scores (np.ndarray): (candidates x positions) similarity percentages.
+
+    Usage:
+        Build it with the candidates and positions you care about (defaults to every candidate against every open
+        position) and then ask it for the best positions for a candidate or the best candidates for a position. With
+        cached=True the SimilarityScoreMatcher cache is read first and only the pairs it does not have are scored (and
+        stored), see ScorePlan.
+
+        match = MatchMatrix(cached=True)
+        match.positions_for_candidate(0, k=10)
+        # Output: [(<SOWPosition: ...>, 83.32475812503635), ...]
+    """
+
+    def __init__(self, candidates=None, positions=None, cached: bool = False):
+        candidates = Candidate.objects.all() if candidates is None else candidates
+        positions = open_sow_positions() if positions is None else positions
+        # the vectors come from the shared snapshot where it has them, no need to pull them out of every row
+        self.candidates = list(candidates.defer('vector') if isinstance(candidates, QuerySet) else candidates)
+        self.positions = list(positions.defer('vector') if isinstance(positions, QuerySet) else positions)
+        if cached:
+            self.scores = ScorePlan(self.candidates, self.positions).score()
+        elif similarity_backend() == VECTOR_BACKEND:
+            self.scores = similarity_matrix(
+                vector_matrix(candidate_vectors(self.candidates)),
+                vector_matrix(position_vectors(self.positions)),
+            )
+        else:
+            self.scores = lexical_similarity_matrix(
+                [candidate_match_text(candidate) for candidate in self.candidates],
+                [position_match_text(position) for position in self.positions],
+            )
+
+    def positions_for_candidate(self, row: int, k: int = None) -> list[(SOWPosition, float)]:
+        """
+        The k best positions for the candidate in the given row, best first.
+        """
+        return [(self.positions[column], float(self.scores[row, column])) for column in top_k(self.scores[row], k)[0]]
+
+    def candidates_for_position(self, column: int, k: int = None) -> list[(Candidate, float)]:
+        """
+        The k best candidates for the position in the given column, best first.
+        """
+        return [(self.candidates[row], float(self.scores[row, column])) for row in top_k(self.scores[:, column], k)[0]]
+
+    def top_positions(self, k: int = None) -> np.ndarray:
+        """
+        (candidates x k) column indices of the best positions for every candidate.
+        """
+        return top_k(self.scores, k)
+
+    def top_candidates(self, k: int = None) -> np.ndarray:
+        """
+        (positions x k) row indices of the best candidates for every position.
+        """
+        return top_k(self.scores.T, k)
+
+
+def read_cached_scores(candidates: list, candidate_hashes: list, sow_hashes: list, key: tuple = None) -> dict:
+    """
+    Every cached score there is for these candidates against these position texts.
+
+    The read is narrowed down by whichever side is smaller, the candidates or the distinct position texts, in one query
+    per MAX_CACHE_FILTER_IDS of them. A single candidate or position is the usual case and costs one query.
+
+    Args:
+        key (tuple): The (scoring_model, scoring_version) to read, defaults to scoring_key().
+
+    Returns:
+        dict: (candidate id, candidate hash, sow hash) -> similarity score.
+    """
+    scoring_model, scoring_version = key or scoring_key()
+    cached_rows = SimilarityScoreMatcher.objects.filter(scoring_model=scoring_model, scoring_version=scoring_version)
+    candidate_ids = list(dict.fromkeys(candidate.pk for candidate in candidates))
+    unique_hashes = list(dict.fromkeys(sow_hashes))
+    field, values = ('candidate__in', candidate_ids) if len(candidate_ids) <= len(unique_hashes) else ('sow_hash__in', unique_hashes)
+
+    cached_scores = {}
+    for start in range(0, len(values), MAX_CACHE_FILTER_IDS):
+        chunk = cached_rows.filter(**{field: values[start:start + MAX_CACHE_FILTER_IDS]})
+        cached_scores.update(
+            ((candidate_id, candidate_hash, sow_hash), similarity_score)
+            for candidate_id, candidate_hash, sow_hash, similarity_score
+            in chunk.values_list('candidate_id', 'candidate_hash', 'sow_hash', 'similarity_score')
+        )
+    return cached_scores
+
+
+def cached_score_matrix(candidates: list, candidate_hashes: list, sow_hashes: list, cached_scores: dict) -> tuple:
+    """
+    Lays the read_cached_scores of these candidates and position texts out as a (candidates x positions) matrix.
+
+    Every distinct (candidate, text) row and position text gets a number, the cached scores go into a small table of
+    those, and one fancy index spreads the table over the whole matrix (repeated rows and columns included).
+
+    Returns:
+        tuple: (scores, missing), float32 scores with 0 for the pairs that were not cached and which pairs those are.
+    """
+    row_codes = {}
+    rows = np.array([row_codes.setdefault((candidate.pk, candidate_hash), len(row_codes)) for candidate, candidate_hash in zip(candidates, candidate_hashes)], dtype=np.int64)
+    column_codes = {}
+    columns = np.array([column_codes.setdefault(sow_hash, len(column_codes)) for sow_hash in sow_hashes], dtype=np.int64)
+
+    table = np.full((len(row_codes), len(column_codes)), np.nan, dtype=np.float32)
+    # the read may bring back scores for texts these rows no longer have, those are left out
+    found = [
+        (row_codes[(candidate_id, candidate_hash)], column_codes[sow_hash], score)
+        for (candidate_id, candidate_hash, sow_hash), score in cached_scores.items()
+        if (candidate_id, candidate_hash) in row_codes and sow_hash in column_codes
+    ]
+    if found:
+        found_rows, found_columns, found_scores = zip(*found)
+        table[list(found_rows), list(found_columns)] = found_scores
+
+    scores = table[np.ix_(rows, columns)]
+    missing = np.isnan(scores)
+    scores[missing] = 0
+    return scores, missing
+
+
+def write_cached_scores(candidates: list, candidate_hashes: list, sow_hashes: list, scores: np.ndarray, missing: np.ndarray, key: tuple = None):
+    """
+    Writes the freshly computed scores of the pairs marked missing to the cache with one bulk_create, under key
+    (scoring_key() by default).
+    """
+    scoring_model, scoring_version = key or scoring_key()
+    new_scores = {}
+    for row, column in zip(*np.nonzero(missing)):
+        cache_key = (candidates[row].pk, candidate_hashes[row], sow_hashes[column])
+        if cache_key not in new_scores:
+            new_scores[cache_key] = SimilarityScoreMatcher(
+                candidate=candidates[row],
+                candidate_hash=candidate_hashes[row],
+                sow_hash=sow_hashes[column],
+                scoring_model=scoring_model,
+                scoring_version=scoring_version,
+                similarity_score=float(scores[row, column]),
+            )
+
+    # another request may have scored the same pair in the meantime, the unique constraint keeps the first one
+    SimilarityScoreMatcher.objects.bulk_create(new_scores.values(), ignore_conflicts=True)
+
+
+class ScorePlan:
+    """
+    Scores candidates against positions through the SimilarityScoreMatcher cache, scoring only what it does not have.
+
+    Building the plan does the database reads: the cached scores (see read_cached_scores), then for the candidate rows and position
+    columns with at least one missing pair their stored vectors (the vector backend) or whatever the preprocessing
+    cache has for their texts (the lexical backends). The missing rows and columns are split along the longer side into
+    as many chunks as there are workers (none longer than chunk_size). score_chunk turns a chunk into scores without
+    touching the database, lemmatising and weighting its texts on the way for the lexical backends, and save() writes
+    the new scores and preprocessed texts back. MatchMatrix(cached=True) scores the chunks here and now, ascore
+    (async_matching.py) runs score_chunk for every chunk concurrently on a thread pool.
+
+    Attributes:
+        scores (np.ndarray): (candidates x positions) similarity percentages, the cached ones filled in already.
+        missing (np.ndarray): Which pairs were not cached.
+        chunks (list): (rows, columns, candidate inputs, position inputs) for every block that still has to be scored,
+            the inputs are vector matrices or raw texts.
+
+    Usage:
+        plan = ScorePlan([candidate], positions)
+        plan.score()
+        # Output: array([[83.3, 41.2, ...]], dtype=float32)
+    """
+
+    def __init__(self, candidates: list, positions: list, chunk_size: int = None, workers: int = 1):
+        self.candidates = candidates
+        self.candidate_hashes = [content_hash(candidate_match_text(candidate)) for candidate in candidates]
+        self.sow_hashes = [content_hash(position_match_text(position)) for position in positions]
+        self.scores = np.zeros((len(candidates), len(positions)), dtype=np.float32)
+        self.missing = np.ones(self.scores.shape, dtype=bool)
+        self.chunks = []
+        # texts the chunks had to run through spaCy, save() caches them
+        self.preprocessed = {}
+        self._preprocessed_lock = threading.Lock()
+        if not candidates or not positions:
+            return
+
+        # one model for the whole plan, so a refit half way through cannot mix two fits up under one key
+        self.lexical_model = None if similarity_backend() == VECTOR_BACKEND else get_lexical_model()
+        self.key = scoring_key(self.lexical_model)
+        cached_scores = read_cached_scores(candidates, self.candidate_hashes, self.sow_hashes, self.key)
+        self.scores, self.missing = cached_score_matrix(candidates, self.candidate_hashes, self.sow_hashes, cached_scores)
+
+        rows = np.flatnonzero(self.missing.any(axis=1))
+        columns = np.flatnonzero(self.missing.any(axis=0))
+        if not len(rows):
+            return
+        if self.lexical_model is None:
+            # rows are vectorised when they are saved, so this is normally just reading the stored vectors
+            candidate_inputs = vector_matrix(candidate_vectors([candidates[row] for row in rows]))
+            position_inputs = vector_matrix(position_vectors([positions[column] for column in columns]))
+        else:
+            candidate_inputs = [candidate_match_text(candidates[row]) for row in rows]
+            position_inputs = [position_match_text(positions[column]) for column in columns]
+            self._cached_texts = cached_preprocessed_texts(candidate_inputs + position_inputs)
+
+        # split along whichever side is longer, a candidate page is one row and a position page one column, so that
+        # every worker gets a chunk even when there are only a few misses
+        longer = max(len(rows), len(columns))
+        size = max(min(chunk_size or longer, math.ceil(longer / workers)), 1)
+        if len(columns) >= len(rows):
+            for start in range(0, len(columns), size):
+                self.chunks.append((rows, columns[start:start + size], candidate_inputs, position_inputs[start:start + size]))
+        else:
+            for start in range(0, len(rows), size):
+                self.chunks.append((rows[start:start + size], columns, candidate_inputs[start:start + size], position_inputs))
+
+    def score(self) -> np.ndarray:
+        """
+        Scores the chunks in this thread, stores the new scores and returns the whole matrix.
+        """
+        self.fill([self.score_chunk(chunk) for chunk in self.chunks])
+        self.save()
+        return self.scores
+
+    def score_chunk(self, chunk: tuple) -> np.ndarray:
+        """
+        Scores one of the chunks, safe to run on any thread since it never touches the database.
+
+        Returns:
+            np.ndarray: (chunk rows x chunk columns) similarity percentages.
+        """
+        _, _, candidate_inputs, position_inputs = chunk
+        if self.lexical_model is not None:
+            candidate_inputs, position_inputs = self._term_weights(candidate_inputs), self._term_weights(position_inputs)
+        return score_matrices(candidate_inputs, position_inputs)
+
+    def fill(self, blocks: list):
+        """
+        Puts the scored chunks (score_chunk of each chunk, in chunk order) into the matrix.
+        """
+        for (rows, columns, _, _), block in zip(self.chunks, blocks):
+            cells = np.ix_(rows, columns)
+            # a cached score still wins over a fresh one
+            self.scores[cells] = np.where(self.missing[cells], block, self.scores[cells])
+
+    def save(self):
+        """
+        Writes the scores of the pairs that were missing, and any texts the chunks preprocessed, to the caches.
+        """
+        store_preprocessed_texts(self.preprocessed)
+        if self.chunks:
+            write_cached_scores(self.candidates, self.candidate_hashes, self.sow_hashes, self.scores, self.missing, self.key)
+
+    def _term_weights(self, texts: list):
+        computed = preprocess_uncached(texts, self._cached_texts)
+        with self._preprocessed_lock:
+            self.preprocessed.update(computed)
+        known = {**self._cached_texts, **computed}
+        return self.lexical_model.transform([known[content_hash(text)] for text in texts])
+
+
+def invalidate_candidate_scores(candidate: Candidate) -> int:
+    """
+    Drops the cached scores a candidate got for older versions of their skills and education.
+
+    Scores against every position for the current version (if any) are left alone, so are everybody else's.
+
+    Returns:
+        int: How many cached scores were removed.
+    """
+    deleted, _ = SimilarityScoreMatcher.objects.filter(candidate=candidate).exclude(candidate_hash=candidate.match_hash).delete()
+    return deleted
+
+
+def invalidate_position_scores(sow_hash: str) -> int:
+    """
+    Drops the cached scores for a version of a position description nobody has any more.
+
+    Scores are keyed by the description's hash rather than the position, so they are kept while another position still
+    has the exact same description.
+
+    Args:
+        sow_hash (str): The match_hash the position had before it was edited (or deleted).
+
+    Returns:
+        int: How many cached scores were removed.
+    """
+    if not sow_hash or SOWPosition.objects.filter(match_hash=sow_hash).exists():
+        return 0
+    deleted, _ = SimilarityScoreMatcher.objects.filter(sow_hash=sow_hash).delete()
+    return deleted
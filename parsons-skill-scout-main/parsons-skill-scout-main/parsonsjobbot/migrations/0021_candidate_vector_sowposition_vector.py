@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsonsjobbot', '0020_remove_similarityscorematcher_sow_pos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='candidate',
+            name='vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sowposition',
+            name='vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
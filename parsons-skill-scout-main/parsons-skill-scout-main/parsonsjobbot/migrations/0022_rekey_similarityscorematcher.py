@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """
+    The score cache used to be keyed by the full candidate and SOW texts, it is now keyed by content hashes.
+    The old rows cannot be rekeyed (they have no link to a candidate) and are only a cache, so the table is rebuilt.
+    """
+
+    dependencies = [
+        ('parsonsjobbot', '0021_candidate_vector_sowposition_vector'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='SimilarityScoreMatcher',
+        ),
+        migrations.CreateModel(
+            name='SimilarityScoreMatcher',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('candidate_hash', models.CharField(max_length=64)),
+                ('sow_hash', models.CharField(max_length=64)),
+                ('scoring_model', models.CharField(max_length=100)),
+                ('scoring_version', models.CharField(max_length=50)),
+                ('similarity_score', models.FloatField()),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarity_scores', to='parsonsjobbot.candidate')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sow_hash', 'scoring_model', 'scoring_version'], name='similarity_score_sow_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarityscorematcher',
+            constraint=models.UniqueConstraint(fields=('candidate', 'candidate_hash', 'sow_hash', 'scoring_model', 'scoring_version'), name='unique_similarity_score'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:58
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_match_texts(apps, schema_editor):
+    # same text and hash as vectors.candidate_match_text / position_match_text and hashing.content_hash
+    def content_hash(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    Candidate = apps.get_model('parsonsjobbot', 'Candidate')
+    candidates = list(Candidate.objects.only('skills', 'education'))
+    for candidate in candidates:
+        candidate.match_hash = content_hash(candidate.skills + ', ' + candidate.education)
+    Candidate.objects.bulk_update(candidates, ['match_hash'], batch_size=500)
+
+    SOWPosition = apps.get_model('parsonsjobbot', 'SOWPosition')
+    positions = list(SOWPosition.objects.only('posdesc'))
+    for position in positions:
+        position.match_hash = content_hash(position.posdesc)
+    SOWPosition.objects.bulk_update(positions, ['match_hash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    """
+    Records which version of its text every candidate and position was last vectorised and scored from, so an edit
+    knows which cached similarity scores it made stale.
+    """
+
+    dependencies = [
+        ('parsonsjobbot', '0024_backgroundjob_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='candidate',
+            name='match_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='sowposition',
+            name='match_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.RunPython(hash_match_texts, migrations.RunPython.noop),
+    ]
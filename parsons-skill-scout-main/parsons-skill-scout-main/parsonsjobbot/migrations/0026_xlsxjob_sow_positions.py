@@ -0,0 +1,56 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:01
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def link_existing_rows(apps, schema_editor):
+    # every XlsxJob gets linked to the SOW positions on its tonum and posnum, same as matching.link_xlsx_jobs
+    XlsxJob = apps.get_model('parsonsjobbot', 'XlsxJob')
+    SOWPosition = apps.get_model('parsonsjobbot', 'SOWPosition')
+    Link = XlsxJob.sow_positions.through
+
+    positions = defaultdict(list)
+    for position_id, tonum, posnum in SOWPosition.objects.values_list('pk', 'tonum', 'posnum'):
+        positions[(tonum, posnum)].append(position_id)
+
+    links = [
+        Link(xlsxjob_id=xlsx_job_id, sowposition_id=position_id)
+        for xlsx_job_id, tonum, posnum in XlsxJob.objects.values_list('pk', 'tonum', 'posnum')
+        for position_id in positions[(tonum, posnum)]
+    ]
+    Link.objects.bulk_create(links, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    """
+    Links XlsxJob rows to the SOW positions they line up with so the open positions can be found with a join instead
+    of one OR'd condition per open XlsxJob.
+    """
+
+    dependencies = [
+        ('parsonsjobbot', '0025_match_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xlsxjob',
+            name='sow_positions',
+            field=models.ManyToManyField(blank=True, related_name='xlsx_jobs', to='parsonsjobbot.sowposition'),
+        ),
+        migrations.AlterField(
+            model_name='xlsxjob',
+            name='open_or_closed',
+            field=models.CharField(db_index=True, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='sowposition',
+            index=models.Index(fields=['tonum', 'posnum'], name='sow_position_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xlsxjob',
+            index=models.Index(fields=['tonum', 'posnum'], name='xlsx_job_position_idx'),
+        ),
+        migrations.RunPython(link_existing_rows, migrations.RunPython.noop),
+    ]
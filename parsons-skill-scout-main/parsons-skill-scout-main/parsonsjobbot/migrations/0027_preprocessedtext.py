@@ -0,0 +1,26 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsonsjobbot', '0026_xlsxjob_sow_positions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreprocessedText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_hash', models.CharField(max_length=64)),
+                ('pipeline', models.CharField(max_length=100)),
+                ('preprocessed_text', models.TextField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='preprocessedtext',
+            constraint=models.UniqueConstraint(fields=('text_hash', 'pipeline'), name='unique_preprocessed_text'),
+        ),
+    ]
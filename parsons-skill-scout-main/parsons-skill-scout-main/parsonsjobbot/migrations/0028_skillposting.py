@@ -0,0 +1,29 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsonsjobbot', '0027_preprocessedtext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SkillPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('skill', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('candidates', 'Candidate'), ('positions', 'SOW Position'), ('job_submissions', 'Job Submission')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='skill_posting_object_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='skillposting',
+            constraint=models.UniqueConstraint(fields=('kind', 'skill', 'object_id'), name='unique_skill_posting'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsonsjobbot', '0029_matchdataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='result',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
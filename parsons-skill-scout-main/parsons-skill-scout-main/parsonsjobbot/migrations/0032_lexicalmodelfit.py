@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsonsjobbot', '0031_uploadedfile_parse_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LexicalModelFit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weighting', models.CharField(max_length=10, unique=True)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('model', models.BinaryField()),
+                ('fitted_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parsonsjobbot', '0032_lexicalmodelfit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lexicalmodelfit',
+            name='corpus_size',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lexicalmodelfit',
+            name='previous_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from django.contrib.auth.models import Group, User
 
@@ -32,6 +33,10 @@ class Candidate(models.Model):
     years_of_experience = models.IntegerField()
     education = models.CharField(max_length=255)
     resume = models.ForeignKey('UploadedFile', on_delete=models.CASCADE, null=True)
+    # normalised float32 document vector of skills + education, kept up to date in signals.py
+    vector = models.BinaryField(null=True, blank=True)
+    # content hash of the text the vector was made from, the candidate_hash its cached similarity scores are stored under
+    match_hash = models.CharField(max_length=64, blank=True, db_index=True)
     # add more fields as per your requirements
 
 
@@ -43,6 +48,11 @@ class UploadedFile(models.Model):
     This class (not sure If we technically need it for now but I think its good to keep on file in case) maintains all files uploaded to the database
     """
     file = models.FileField(upload_to='resumes/')
+    # sha256 of the file's bytes, the same resume uploaded again reuses this row and its file (see resumes.py)
+    content_hash = models.CharField(max_length=64, null=True, blank=True, unique=True)
+    # what pyresparser got out of the file and settings.RESUME_PARSER_VERSION at the time, so it is only parsed once
+    parsed_data = models.JSONField(null=True, blank=True)
+    parsed_with = models.CharField(max_length=50, blank=True)
 
     def __str__(self):
         return self.file.name
@@ -86,11 +96,18 @@ class XlsxJob(models.Model):
     clin = models.CharField(max_length=100)
     location = models.CharField(max_length=100)
     release_date = models.CharField(max_length=100)
-    open_or_closed = models.CharField(max_length=100, null=True)
+    open_or_closed = models.CharField(max_length=100, null=True, db_index=True)
+    # the SOW positions on the same tonum and posnum, kept up to date in signals.py so finding the open ones is a join
+    sow_positions = models.ManyToManyField('SOWPosition', related_name='xlsx_jobs', blank=True)
 
     def __str__(self):
         return f"This is Position can be found on TONum: {self.tonum} (Position: {self.posnum}) and this position is {self.open_or_closed}."
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['tonum', 'posnum'], name='xlsx_job_position_idx'),
+        ]
+
 class UploadedSOW(models.Model):
     """
     This class maintains all SOW files uploaded to the database
@@ -112,7 +129,11 @@ class SOWPosition(models.Model):
     level = models.CharField(max_length=100)
     service_cat = models.CharField(max_length=100)
     job_title = models.CharField(max_length=100)
-    #xlsx_job = models.ForeignKey(XlsxJob, on_delete=models.CASCADE, related_name='sow_positions', null=True)
+    # normalised float32 document vector of posdesc, kept up to date in signals.py
+    vector = models.BinaryField(null=True, blank=True)
+    # content hash of the text the vector was made from, the sow_hash its cached similarity scores are stored under
+    match_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # the XlsxJob rows for this position are on XlsxJob.sow_positions (related_name xlsx_jobs)
 
     def __str__(self):
         return f"This is SOW Position {self.pos_id} found on Task Order {self.tonum}"
@@ -126,27 +147,175 @@ class SOWPosition(models.Model):
 
     class Meta:
         verbose_name_plural = 'SOW Positions'
+        indexes = [
+            models.Index(fields=['tonum', 'posnum'], name='sow_position_position_idx'),
+        ]
 
 class SimilarityScoreMatcher(models.Model):
-    candidate_name = models.CharField(max_length=255)
-    candidate_info = models.TextField()
-    #sow_pos = models.CharField(max_length=255)
-    sow_info = models.TextField()
+    """
+    Cache of similarity scores so a candidate/position pair is only scored once.
+
+    Rows are keyed by fixed length content hashes of both sides (see hashing.py) instead of the texts themselves,
+    plus the scoring model and version so changing how we score never serves a stale number. The candidate is part
+    of the key too so two candidates who happen to share a name never share scores.
+    """
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='similarity_scores')
+    candidate_hash = models.CharField(max_length=64)
+    sow_hash = models.CharField(max_length=64)
+    scoring_model = models.CharField(max_length=100)
+    scoring_version = models.CharField(max_length=50)
     similarity_score = models.FloatField()
 
     def __str__(self):
-        return f"Candidate {self.candidate_name} has a similarity score of {self.similarity_score} for the position"
-    
-    @property
-    def candidate_info_preview(self):
-        preview_length = 100  # Adjust the desired length
-        if len(self.candidate_info) > preview_length:
-            return self.candidate_info[:preview_length] + "..."
-        return self.candidate_info
+        return f"Candidate {self.candidate} has a similarity score of {self.similarity_score} for the position"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['candidate', 'candidate_hash', 'sow_hash', 'scoring_model', 'scoring_version'],
+                name='unique_similarity_score',
+            ),
+        ]
+        indexes = [
+            # the unique constraint covers lookups by candidate, this one covers lookups by position
+            models.Index(fields=['sow_hash', 'scoring_model', 'scoring_version'], name='similarity_score_sow_idx'),
+        ]
+
+class SkillPosting(models.Model):
+    """
+    One entry of the inverted skill index: this normalised skill is held by this candidate, position or job submission.
+
+    All the postings for a skill, ordered by object_id, are its posting list. See skill_index.py for how the index is
+    kept up to date and how posting lists are merged to rank by skill overlap.
+    """
+    CANDIDATES = 'candidates'
+    POSITIONS = 'positions'
+    JOB_SUBMISSIONS = 'job_submissions'
+    KIND_CHOICES = [
+        (CANDIDATES, 'Candidate'),
+        (POSITIONS, 'SOW Position'),
+        (JOB_SUBMISSIONS, 'Job Submission'),
+    ]
+
+    skill = models.CharField(max_length=255)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            # also the index the posting list lookups (kind, skill) read in object_id order
+            models.UniqueConstraint(fields=['kind', 'skill', 'object_id'], name='unique_skill_posting'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'object_id'], name='skill_posting_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.skill} -> {self.kind} {self.object_id}"
+
+class MatchDataVersion(models.Model):
+    """
+    A single counter that goes up whenever something a match list depends on changes: a candidate's or position's
+    text, a position's link to the XLSX, or whether an XLSX job is open. Cached match lists are keyed by it (see
+    match_cache.py), so bumping it retires every one of them at once, in every process.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Match data version {self.version}"
+
+class LexicalModelFit(models.Model):
+    """
+    The fitted TF-IDF or BM25 model (lexical.LexicalModel) for a weighting, shared by every process. It is fitted by
+    `manage.py fit_lexical_model` or the fit_lexical_model background job, never inside a request that needs it.
+    """
+    weighting = models.CharField(max_length=10, unique=True)
+    # hash of the texts and settings it was fitted on, lexical scores are cached under it (see lexical.lexical_scoring_version)
+    fingerprint = models.CharField(max_length=64)
+    # the fit before this one, its cached scores are kept for the processes that still have it loaded
+    previous_fingerprint = models.CharField(max_length=64, blank=True)
+    # how many texts it was fitted over, it is fitted again once the corpus has grown or shrunk enough (LEXICAL_REFIT_DRIFT)
+    corpus_size = models.IntegerField(default=0)
+    model = models.BinaryField()
+    fitted_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.weighting} model {self.fingerprint[:12]}"
+
+class PreprocessedText(models.Model):
+    """
+    Persistent cache of preprocess_text output (the lemmatised text), keyed by a content hash of the raw text and the
+    pipeline that produced it, so a restarted process does not run spaCy over texts it has already seen. See
+    preprocessing.py for the in-process layer in front of it.
+    """
+    text_hash = models.CharField(max_length=64)
+    # spaCy model name and version plus settings.NLP_PREPROCESSING_VERSION, see preprocessing.pipeline_key()
+    pipeline = models.CharField(max_length=100)
+    preprocessed_text = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['text_hash', 'pipeline'], name='unique_preprocessed_text'),
+        ]
+
+    def __str__(self):
+        return f"{self.pipeline} {self.text_hash}"
+
+class BackgroundJob(models.Model):
+    """
+    A unit of work (like parsing an uploaded SOW or scoring new positions against every candidate) that runs outside of
+    the request, see tasks.py. This table is the queue: `manage.py run_jobs` workers claim queued rows, lock them for
+    settings.BACKGROUND_JOB_VISIBILITY_TIMEOUT seconds and retry failures up to max_attempts times.
+    The status and progress are kept here so pages can ask how far along a job is.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # who queued the job (nobody for the ones the app queues itself), only they and staff can look it up
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='background_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    # what the job has to say for itself when it is done, such as the per file summary of a bulk resume upload
+    result = models.JSONField(default=dict, blank=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # queued jobs are not picked up before this, retries get pushed back a little further every time
+    available_at = models.DateTimeField(default=timezone.now)
+    # the worker running the job and when its claim runs out, after that another worker may take the job over
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='background_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} is {self.status} ({self.progress}/{self.total})"
 
     @property
-    def sow_info_preview(self):
-        preview_length = 100  # Adjust the desired length
-        if len(self.sow_info) > preview_length:
-            return self.sow_info[:preview_length] + "..."
-        return self.sow_info
\ No newline at end of file
+    def short_error(self) -> str:
+        """
+        The last line of the error's traceback, the exception itself, for showing outside of the admin.
+
+        Example:
+            job.short_error
+            # Output: "ValueError: Field 'id' expected a number but got 'n'."
+        """
+        lines = self.error.strip().splitlines()
+        return lines[-1] if lines else ''
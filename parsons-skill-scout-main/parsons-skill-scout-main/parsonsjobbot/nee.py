@@ -0,0 +1,253 @@
+# the NEE xlsx reader behind extract_positions_from_excel (views.py). The first sheet's XML is streamed straight out of
+# the xlsx with lxml, keeping only the ten position columns (openpyxl spends most of its time building a cell object
+# for every cell), then the open/closed sections, the TONum / PosNum split and the dates are worked out a column at a
+# time instead of building a pandas Series for every row. store_nee_positions then stores the rows we do not have yet
+# with one bulk_create, see the parse_xlsx task
+import posixpath
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from lxml import etree
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+
+from .matching import link_xlsx_jobs
+from .models import XlsxJob
+
+# the NEE columns, in sheet order
+POSITION_HEADERS = ["tonum", "pdnum", "previous_names", "project", "status", "labor_cat", "level", "clin", "location", "release_date"]
+
+# the sheet columns POSITION_HEADERS are read from
+COLUMN_LETTERS = {letter: column for column, letter in enumerate('ABCDEFGHIJ')}
+
+SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+OFFICE_RELATIONSHIPS_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_T = f'{SPREADSHEET_NS}t'
+_V = f'{SPREADSHEET_NS}v'
+
+# the XlsxJob columns a position is stored in, a stored row is the same position when all of them match
+XLSX_JOB_FIELDS = POSITION_HEADERS[:1] + ['posnum'] + POSITION_HEADERS[1:] + ['open_or_closed']
+
+
+def read_nee_sheet(path) -> pd.DataFrame:
+    """
+    The first sheet of a NEE xlsx as a DataFrame of POSITION_HEADERS columns, one row per (non empty) sheet row.
+
+    The sheet is parsed as a stream, each row is dropped from the XML tree once it is read, and only columns A to J
+    are kept, so memory stays at the ten columns we use however wide or long the workbook is. Cells come out the way
+    pd.read_excel gives them (empty cells and errors are NaN, whole numbers are ints, date formatted numbers are
+    datetimes) so the positions are the same as before.
+
+    Args:
+        path (str): The NEE xlsx file (or an open file).
+
+    Returns:
+        pd.DataFrame: object columns named after POSITION_HEADERS.
+    """
+    with zipfile.ZipFile(path) as xlsx:
+        workbook_path, sheet_path = _first_sheet(xlsx)
+        shared_strings = _shared_strings(xlsx, posixpath.join(posixpath.dirname(workbook_path), 'sharedStrings.xml'))
+        date_styles = _date_styles(xlsx, posixpath.join(posixpath.dirname(workbook_path), 'styles.xml'))
+        workbook_properties = etree.fromstring(xlsx.read(workbook_path)).find(f'{SPREADSHEET_NS}workbookPr')
+        date1904 = workbook_properties is not None and workbook_properties.get('date1904') in ('1', 'true')
+        epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+
+        rows = []
+        with xlsx.open(sheet_path) as sheet:
+            for _, row in etree.iterparse(sheet, tag=f'{SPREADSHEET_NS}row'):
+                values = [np.nan] * len(POSITION_HEADERS)
+                filled = False
+                for position, cell in enumerate(row):
+                    # cells are named like 'D12', only single letter columns up to J are ours
+                    reference = cell.get('r')
+                    column = COLUMN_LETTERS.get(reference[:1]) if reference and reference[1:2].isdigit() else None
+                    if reference is None and position < len(POSITION_HEADERS):
+                        column = position
+                    if column is None:
+                        continue
+                    value = _cell_value(cell, shared_strings, date_styles, epoch)
+                    if value == value:
+                        values[column] = value
+                        filled = True
+                if filled:
+                    rows.append(values)
+                # the rows before this one are done with, so is this one
+                row.clear()
+                while row.getprevious() is not None:
+                    del row.getparent()[0]
+
+    return pd.DataFrame(rows, columns=POSITION_HEADERS, dtype=object)
+
+
+def nee_positions(frame: pd.DataFrame) -> list[dict]:
+    """
+    The open and then the closed positions of a read_nee_sheet frame, see extract_positions_from_excel.
+
+    Rows below an "Open Positions" banner (apart from the header row) are open, rows with a project below a "Closed
+    Positions" banner (or above the first banner) are closed. TONum cells look like "1 / 34 ..." and are split into
+    tonum '1' and posnum '34', release dates are formatted as YYYY-MM-DD.
+    """
+    section = frame["project"].fillna('').astype(str).str.lower()
+    opens = section.str.contains("open positions", regex=False).to_numpy()
+    closes = section.str.contains("closed positions", regex=False).to_numpy() & ~opens
+    banner = opens | closes
+
+    # which section every row is in: the last banner at or above it, closed until the first one
+    in_open = pd.Series(np.where(opens, 1.0, np.where(closes, 0.0, np.nan))).ffill().fillna(0).to_numpy().astype(bool)
+    is_header = section.str.contains("project", regex=False).to_numpy()
+
+    open_rows = frame[~banner & in_open & ~is_header]
+    closed_rows = frame[~banner & ~in_open & frame["project"].notna().to_numpy()]
+    return _positions(open_rows, 'open') + _positions(closed_rows, 'closed')
+
+
+def _positions(rows: pd.DataFrame, open_or_closed: str) -> list[dict]:
+    if rows.empty:
+        return []
+    rows = rows.copy()
+
+    tonum_parts = rows["tonum"].astype(str).str.split(' / ')
+    if tonum_parts.str.len().lt(2).any():
+        bad = rows["tonum"][tonum_parts.str.len().lt(2)].iloc[0]
+        raise ValueError(f"TONum {bad!r} is not of the form 'TONum / PosNum'")
+    rows["tonum"] = tonum_parts.str[0].str.strip()
+    rows["posnum"] = tonum_parts.str[1].str.strip().str.replace('\n', ' ', regex=False).str.split(' ').str[0]
+
+    release_dates = pd.to_datetime(rows["release_date"], errors='coerce')
+    rows["release_date"] = release_dates.dt.strftime('%Y-%m-%d').where(release_dates.notna(), rows["release_date"])
+    rows["open_or_closed"] = open_or_closed
+    return rows.astype(object).to_dict('records')
+
+
+def store_nee_positions(positions: list) -> tuple[dict, list]:
+    """
+    Stores the positions of a NEE upload (see extract_positions_from_excel) that are not stored yet, with a handful of
+    queries rather than a few per row.
+
+    The rows already stored for the upload's task orders are loaded with one query and the upload is compared against
+    them in memory. A position that matches a stored row in every column is unchanged. A position whose tonum and
+    posnum are stored with other values is changed, and is stored as a new row next to the old one (as it always
+    was). Everything new is written with one bulk_create and linked to its SOW positions in the same transaction.
+    bulk_create still sends one INSERT per batch the database takes (about 80 rows on SQLite, which allows 999
+    parameters a query), so a long upload costs an INSERT per batch.
+
+    Args:
+        positions (list): The positions as extract_positions_from_excel returns them.
+
+    Returns:
+        tuple: ({'inserted': ..., 'unchanged': ..., 'changed': ...}, the XlsxJob rows that were stored)
+
+    Example:
+        store_nee_positions(extract_positions_from_excel('NEE.xlsx'))
+        # Output: ({'inserted': 3, 'unchanged': 1840, 'changed': 12}, [<XlsxJob: ...>, ...])
+    """
+    fields = [XlsxJob._meta.get_field(name) for name in XLSX_JOB_FIELDS]
+    # the values as they end up in the database, so NaN is 'nan' and 9 is '9' just like in the stored rows
+    rows = [tuple(field.get_prep_value(position.get(field.name)) for field in fields) for position in positions]
+
+    tonums = {row[0] for row in rows}
+    stored = set(XlsxJob.objects.filter(tonum__in=tonums).values_list(*XLSX_JOB_FIELDS))
+    stored_positions = {row[:2] for row in stored}
+
+    counts = {'inserted': 0, 'unchanged': 0, 'changed': 0}
+    new_jobs = []
+    for row in rows:
+        if row in stored:
+            counts['unchanged'] += 1
+            continue
+        counts['changed' if row[:2] in stored_positions else 'inserted'] += 1
+        # a position that is in the upload twice is only stored once
+        stored.add(row)
+        stored_positions.add(row[:2])
+        new_jobs.append(XlsxJob(**dict(zip(XLSX_JOB_FIELDS, row))))
+
+    with transaction.atomic():
+        # bulk_create skips the signals, so the links (and the match data version) are done here
+        new_jobs = XlsxJob.objects.bulk_create(new_jobs)
+        link_xlsx_jobs(new_jobs, created=True)
+    return counts, new_jobs
+
+
+def _first_sheet(xlsx: zipfile.ZipFile) -> tuple[str, str]:
+    # the workbook part and the first sheet in it, found through the relationships like any xlsx reader does
+    package_relationships = etree.fromstring(xlsx.read('_rels/.rels'))
+    workbook_path = next(
+        relationship.get('Target').lstrip('/') for relationship in package_relationships
+        if relationship.get('Type', '').endswith('/officeDocument')
+    )
+    workbook_directory, workbook_name = posixpath.split(workbook_path)
+    relationships = etree.fromstring(xlsx.read(posixpath.join(workbook_directory, '_rels', workbook_name + '.rels')))
+    targets = {relationship.get('Id'): relationship.get('Target') for relationship in relationships}
+
+    first_sheet = etree.fromstring(xlsx.read(workbook_path)).find(f'{SPREADSHEET_NS}sheets')[0]
+    target = targets[first_sheet.get(f'{OFFICE_RELATIONSHIPS_NS}id')]
+    sheet_path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(workbook_directory, target))
+    return workbook_path, sheet_path
+
+
+def _shared_strings(xlsx: zipfile.ZipFile, path: str) -> list:
+    if path not in xlsx.namelist():
+        return []
+    strings = []
+    with xlsx.open(path) as shared_strings:
+        for _, item in etree.iterparse(shared_strings, tag=f'{SPREADSHEET_NS}si'):
+            strings.append(_text(item))
+            item.clear()
+    return strings
+
+
+def _date_styles(xlsx: zipfile.ZipFile, path: str) -> set:
+    # the cell style indexes whose number format is a date, a number with one of them is a date
+    if path not in xlsx.namelist():
+        return set()
+    styles = etree.fromstring(xlsx.read(path))
+    formats = dict(BUILTIN_FORMATS)
+    for number_format in styles.iterfind(f'{SPREADSHEET_NS}numFmts/{SPREADSHEET_NS}numFmt'):
+        formats[int(number_format.get('numFmtId'))] = number_format.get('formatCode')
+    cell_formats = styles.iterfind(f'{SPREADSHEET_NS}cellXfs/{SPREADSHEET_NS}xf')
+    return {
+        style for style, cell_format in enumerate(cell_formats)
+        if is_date_format(formats.get(int(cell_format.get('numFmtId', 0)), 'General'))
+    }
+
+
+def _text(element) -> str:
+    # the text of a string item, rich text runs joined up and phonetic hints left out
+    return ''.join(
+        text.text or '' for text in element.iter(_T)
+        if text.getparent().tag != f'{SPREADSHEET_NS}rPh'
+    )
+
+
+def _cell_value(cell, shared_strings: list, date_styles: set, epoch):
+    # what read_excel makes of a cell: empty and errors are NaN, a whole number is an int, date formatted a datetime
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        element = cell.find(f'{SPREADSHEET_NS}is')
+        if element is None:
+            return np.nan
+        # a plain <is><t>...</t></is> is by far the most common, rich text goes the long way round
+        value = element[0].text if len(element) == 1 and element[0].tag == _T else _text(element)
+        return value if value else np.nan
+
+    # <v> is the last child, after the formula (if any)
+    raw = cell[-1].text if len(cell) and cell[-1].tag == _V else None
+    if raw is None or raw == '' or cell_type == 'e':
+        return np.nan
+    if cell_type == 's':
+        value = shared_strings[int(raw)]
+        return value if value != '' else np.nan
+    if cell_type == 'str':
+        return raw
+    if cell_type == 'b':
+        return raw == '1'
+    if cell_type == 'd':
+        return datetime.fromisoformat(raw)
+
+    number = float(raw)
+    if int(cell.get('s', 0)) in date_styles:
+        return from_excel(number, epoch)
+    return int(number) if number.is_integer() else number
@@ -0,0 +1,234 @@
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
+
+from django.conf import settings
+from spacy.lang.en.stop_words import STOP_WORDS
+from spacy.util import get_model_meta
+
+from .hashing import content_hash
+from .language_models import get_preprocessing_model
+from .models import PreprocessedText
+
+# above this many hashes an IN (...) list can hit SQLite's variable limit, so lookups are done in chunks
+MAX_CACHE_LOOKUP_HASHES = 500
+
+# in-process layer of the preprocessing cache: (pipeline, text hash) -> preprocessed text, least recently used first
+_cache = OrderedDict()
+_cache_stats = {'memory_hits': 0, 'database_hits': 0, 'misses': 0}
+_cache_lock = threading.Lock()
+
+
+def preprocess_text(text: str) -> str:
+    """
+    Lemmatises the text and strips out stop words and punctuation so only the meaningful words are compared.
+
+    Args:
+        text (str): The raw text, such as a candidate's skills and education or a position description.
+
+    Returns:
+        str: The lower cased lemmas joined by spaces.
+
+    Example:
+        preprocess_text("Built databases with Python and SQL.")
+        # Output: 'build database python sql'
+    """
+    return preprocess_texts([text])[0]
+
+
+def preprocess_texts(texts: list[str], batch_size: int = None, n_process: int = None) -> list[str]:
+    """
+    Same as preprocess_text but for many texts at once, streamed through nlp.pipe in batches.
+
+    Use this whenever there is more than one text to preprocess: spaCy batches the work and, with n_process above 1,
+    spreads it over that many worker processes. The results always come back in the same order as the texts.
+
+    Every result is cached by the text's content hash, first in a bounded in-process LRU and then in the
+    PreprocessedText table, so each distinct text only goes through spaCy once per pipeline (see pipeline_key).
+
+    Args:
+        texts (list): The raw texts to preprocess.
+        batch_size (int): How many texts spaCy works on at a time, defaults to settings.NLP_BATCH_SIZE.
+        n_process (int): How many processes to spread the work over, defaults to settings.NLP_N_PROCESS.
+
+    Returns:
+        list: The preprocessed texts, in input order.
+
+    Example:
+        preprocess_texts(["Python, Django, SQL", "Built databases with Python and SQL."])
+        # Output: ['python django sql', 'build database python sql']
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+
+    found = cached_preprocessed_texts(texts)
+    computed = preprocess_uncached(texts, found, batch_size, n_process)
+    store_preprocessed_texts(computed)
+    found.update(computed)
+    return [found[content_hash(text)] for text in texts]
+
+
+def cached_preprocessed_texts(texts: list[str]) -> dict:
+    """
+    The cache lookup half of preprocess_texts: whatever the in-process LRU or the PreprocessedText table already has
+    for these texts, without going near spaCy.
+
+    Returns:
+        dict: text hash -> preprocessed text, for the texts that were cached.
+    """
+    pipeline = pipeline_key()
+    text_hashes = [content_hash(text) for text in texts]
+    found = _from_memory(pipeline, text_hashes)
+
+    missing = [text_hash for text_hash in dict.fromkeys(text_hashes) if text_hash not in found]
+    if missing and settings.NLP_PREPROCESS_CACHE_DATABASE:
+        from_database = _from_database(pipeline, missing)
+        _to_memory(pipeline, from_database)
+        found.update(from_database)
+    return found
+
+
+def preprocess_uncached(texts: list[str], cached: dict, batch_size: int = None, n_process: int = None) -> dict:
+    """
+    The spaCy half of preprocess_texts: runs every text cached_preprocessed_texts did not find through the pipeline.
+
+    Nothing here touches the database, so it can run on any thread. Hand the result to store_preprocessed_texts
+    (on a thread that may use the database) to cache it.
+
+    Args:
+        texts (list): The raw texts.
+        cached (dict): What cached_preprocessed_texts found for them.
+
+    Returns:
+        dict: text hash -> preprocessed text, for the texts that were not cached.
+    """
+    missing = {}
+    for text in texts:
+        text_hash = content_hash(text)
+        if text_hash not in cached:
+            missing.setdefault(text_hash, text)
+    if not missing:
+        return {}
+
+    with _cache_lock:
+        _cache_stats['misses'] += len(missing)
+    return dict(zip(missing, _run_pipeline(list(missing.values()), batch_size, n_process)))
+
+
+def store_preprocessed_texts(preprocessed_texts: dict):
+    """
+    Caches what preprocess_uncached computed, in memory and (with NLP_PREPROCESS_CACHE_DATABASE) in PreprocessedText.
+    """
+    if not preprocessed_texts:
+        return
+    pipeline = pipeline_key()
+    _to_memory(pipeline, preprocessed_texts)
+    if settings.NLP_PREPROCESS_CACHE_DATABASE:
+        _to_database(pipeline, preprocessed_texts)
+
+
+def pipeline_key() -> str:
+    """
+    Identifies the preprocessing pipeline in cache keys: the spaCy model, its version and
+    settings.NLP_PREPROCESSING_VERSION. Anything cached under an older key is simply never looked up again.
+
+    The version comes from the installed model package (or the meta.json of a model directory), so a warm cache
+    never has to load the spaCy pipeline just to work out its own key.
+
+    Example:
+        pipeline_key()
+        # Output: 'en_core_web_sm-3.8.0/1'
+    """
+    return f"{_model_name_and_version(settings.NLP_PREPROCESSING_MODEL)}/{settings.NLP_PREPROCESSING_VERSION}"
+
+
+@lru_cache(maxsize=None)
+def _model_name_and_version(model: str) -> str:
+    if os.path.isdir(model):
+        # a model loaded from a directory rather than an installed package
+        meta = get_model_meta(model)
+        return f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}"
+    try:
+        return f"{model}-{version(model)}"
+    except PackageNotFoundError:
+        # the package names its distribution with dashes on some installs
+        return f"{model}-{version(model.replace('_', '-'))}"
+
+
+def preprocessing_cache_stats() -> dict:
+    """
+    Hit and miss counters for the preprocessing cache since the process started (or clear_preprocessing_cache).
+
+    Returns:
+        dict: memory_hits, database_hits, misses (texts that went through spaCy) and memory_size (texts held in memory).
+    """
+    with _cache_lock:
+        return dict(_cache_stats, memory_size=len(_cache))
+
+
+def clear_preprocessing_cache():
+    """
+    Empties the in-process layer and resets the counters, the PreprocessedText table is left alone.
+    """
+    with _cache_lock:
+        _cache.clear()
+        for counter in _cache_stats:
+            _cache_stats[counter] = 0
+
+
+def _run_pipeline(texts: list[str], batch_size: int = None, n_process: int = None) -> list[str]:
+    batch_size = batch_size or settings.NLP_BATCH_SIZE
+    n_process = n_process or settings.NLP_N_PROCESS
+    # spinning up worker processes costs more than it saves for a handful of texts
+    if len(texts) <= batch_size:
+        n_process = 1
+
+    nlp = get_preprocessing_model()
+    return [_filtered_lemmas(doc) for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process)]
+
+
+def _from_memory(pipeline, text_hashes) -> dict:
+    found = {}
+    with _cache_lock:
+        for text_hash in text_hashes:
+            preprocessed_text = _cache.get((pipeline, text_hash))
+            if preprocessed_text is not None:
+                _cache.move_to_end((pipeline, text_hash))
+                found[text_hash] = preprocessed_text
+        _cache_stats['memory_hits'] += sum(1 for text_hash in text_hashes if text_hash in found)
+    return found
+
+
+def _to_memory(pipeline, preprocessed_texts: dict):
+    with _cache_lock:
+        for text_hash, preprocessed_text in preprocessed_texts.items():
+            _cache[(pipeline, text_hash)] = preprocessed_text
+            _cache.move_to_end((pipeline, text_hash))
+        while len(_cache) > settings.NLP_PREPROCESS_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _from_database(pipeline, text_hashes) -> dict:
+    found = {}
+    for start in range(0, len(text_hashes), MAX_CACHE_LOOKUP_HASHES):
+        rows = PreprocessedText.objects.filter(pipeline=pipeline, text_hash__in=text_hashes[start:start + MAX_CACHE_LOOKUP_HASHES])
+        found.update(rows.values_list('text_hash', 'preprocessed_text'))
+    with _cache_lock:
+        _cache_stats['database_hits'] += len(found)
+    return found
+
+
+def _to_database(pipeline, preprocessed_texts: dict):
+    # another process may have preprocessed the same text in the meantime, the unique constraint keeps the first one
+    PreprocessedText.objects.bulk_create([
+        PreprocessedText(text_hash=text_hash, pipeline=pipeline, preprocessed_text=preprocessed_text)
+        for text_hash, preprocessed_text in preprocessed_texts.items()
+    ], ignore_conflicts=True, batch_size=MAX_CACHE_LOOKUP_HASHES)
+
+
+def _filtered_lemmas(doc) -> str:
+    tokens = [token.lemma_.lower() for token in doc if not token.is_stop and not token.is_punct and token.text.lower() not in STOP_WORDS]
+    return ' '.join(tokens)
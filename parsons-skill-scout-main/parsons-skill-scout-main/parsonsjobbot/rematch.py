@@ -0,0 +1,188 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+from .hashing import content_hash
+from .lexical import get_lexical_model
+from .matching import cached_score_matrix, open_sow_positions, read_cached_scores, scoring_inputs, scoring_key, similarity_backend, write_cached_scores
+from .models import Candidate, SimilarityScoreMatcher
+from .score_pool import score_chunks
+from .vectors import VECTOR_BACKEND, candidate_match_text, position_match_text
+
+
+def scoring_workers() -> int:
+    """
+    settings.SCORING_WORKERS, or one worker per core when it is not set.
+    """
+    return settings.SCORING_WORKERS or os.cpu_count() or 1
+
+
+def rematch(candidates=None, positions=None, workers: int = None, progress=None) -> int:
+    """
+    Scores every candidate against every open position and writes the scores to SimilarityScoreMatcher, spreading
+    the scoring over a pool of processes (see score_pool.py).
+
+    The vectors (or term weights) are worked out once up front in this process, positions sharing a description are
+    scored once, and each chunk of scores is bulk written as soon as it comes back. Pairs that are cached already
+    keep their score, the same as MatchMatrix(cached=True).
+
+    Args:
+        candidates (QuerySet): Who to score, defaults to every candidate.
+        positions (QuerySet): What to score them against, defaults to open_sow_positions().
+        workers (int): How many processes to score on, defaults to scoring_workers().
+        progress (function): Called with (candidates done, candidates in total) after every chunk.
+
+    Returns:
+        int: How many candidate/position scores were computed.
+
+    Example:
+        rematch(workers=8)
+        # Output: 1250000
+    """
+    candidates = list((Candidate.objects.all() if candidates is None else candidates).defer('vector').order_by('pk'))
+    positions = list((open_sow_positions() if positions is None else positions).defer('vector').order_by('pk'))
+
+    # positions with the same description score the same, each distinct description is a single column
+    sow_hashes = {}
+    for position in positions:
+        sow_hashes.setdefault(content_hash(position_match_text(position)), position)
+    unique_positions = list(sow_hashes.values())
+    if not candidates or not unique_positions:
+        return 0
+
+    lexical_model = _lexical_model()
+    candidate_matrix, position_matrix = scoring_inputs(candidates, unique_positions, lexical_model)
+    candidate_hashes = [content_hash(candidate_match_text(candidate)) for candidate in candidates]
+    sow_hashes = list(sow_hashes)
+    scoring_model, scoring_version = scoring_key(lexical_model)
+
+    # each chunk is about SCORING_CHUNK_PAIRS scores, small enough to write in one go
+    chunk_rows = max(settings.SCORING_CHUNK_PAIRS // len(sow_hashes), 1)
+    scored = 0
+    for start, scores in score_chunks(candidate_matrix, position_matrix, chunk_rows, workers or scoring_workers()):
+        SimilarityScoreMatcher.objects.bulk_create([
+            SimilarityScoreMatcher(
+                candidate=candidate,
+                candidate_hash=candidate_hash,
+                sow_hash=sow_hash,
+                scoring_model=scoring_model,
+                scoring_version=scoring_version,
+                similarity_score=float(score),
+            )
+            for candidate, candidate_hash, row in zip(candidates[start:], candidate_hashes[start:], scores)
+            for sow_hash, score in zip(sow_hashes, row)
+        ], ignore_conflicts=True, batch_size=500)
+        scored += scores.size
+        if progress is not None:
+            progress(start + len(scores), len(candidates))
+    return scored
+
+
+def precompute_matches(workers: int = None, checkpoint: str = None, restart: bool = False, progress=None) -> dict:
+    """
+    Warms the SimilarityScoreMatcher cache for every candidate against every open position, scoring only the pairs
+    that are not cached yet, so the match pages are quick from the first visit after a big NEE/SOW refresh.
+
+    The pairs go through the same cache and scoring inputs as get_open_positions_for_candidate (ScorePlan),
+    spread over a pool of processes like rematch. Candidates are worked through in pk order and the last one finished
+    is written to a checkpoint file after every chunk, so an interrupted run picks up where it stopped. The
+    checkpoint only counts for the same positions and scoring settings, anything else starts over (which is still
+    cheap, the pairs done last time are cached).
+
+    Args:
+        workers (int): How many processes to score on, defaults to scoring_workers().
+        checkpoint (str): Where to keep the checkpoint, defaults to settings.MATCH_PRECOMPUTE_CHECKPOINT.
+        restart (bool): Ignore the checkpoint and look at every candidate again.
+        progress (function): Called with (pairs scored, pairs to score) after every chunk.
+
+    Returns:
+        dict: 'scored' pairs computed, 'cached' pairs that were already there and 'resumed_after', the candidate
+        id the run picked up after (None for a fresh run).
+
+    Example:
+        precompute_matches(workers=8)
+        # Output: {'scored': 1180000, 'cached': 70000, 'resumed_after': None}
+    """
+    checkpoint = checkpoint or settings.MATCH_PRECOMPUTE_CHECKPOINT
+    positions = list(open_sow_positions().defer('vector').order_by('pk'))
+    unique_positions = {}
+    for position in positions:
+        unique_positions.setdefault(content_hash(position_match_text(position)), position)
+    sow_hashes = list(unique_positions)
+    unique_positions = list(unique_positions.values())
+
+    lexical_model = _lexical_model()
+    key = scoring_key(lexical_model)
+    run_key = list(key) + [content_hash(' '.join(sorted(sow_hashes)))]
+    resumed_after = None if restart else _read_checkpoint(checkpoint, run_key)
+    candidates = Candidate.objects.defer('vector').order_by('pk')
+    if resumed_after is not None:
+        candidates = candidates.filter(pk__gt=resumed_after)
+    candidates = list(candidates)
+    result = {'scored': 0, 'cached': 0, 'resumed_after': resumed_after}
+    if not candidates or not unique_positions:
+        _remove_checkpoint(checkpoint)
+        return result
+
+    # which pairs are cached already, read a chunk of candidates at a time
+    candidate_hashes = [content_hash(candidate_match_text(candidate)) for candidate in candidates]
+    missing = np.ones((len(candidates), len(sow_hashes)), dtype=bool)
+    chunk_rows = max(settings.SCORING_CHUNK_PAIRS // len(sow_hashes), 1)
+    for start in range(0, len(candidates), chunk_rows):
+        stop = start + chunk_rows
+        cached_scores = read_cached_scores(candidates[start:stop], candidate_hashes[start:stop], sow_hashes, key)
+        _, missing[start:stop] = cached_score_matrix(candidates[start:stop], candidate_hashes[start:stop], sow_hashes, cached_scores)
+    result['cached'] = int(missing.size - missing.sum())
+
+    # only candidates with something left to score get vectorised and sent to the pool
+    rows = np.flatnonzero(missing.any(axis=1))
+    total = int(missing.sum())
+    if len(rows):
+        work = [candidates[row] for row in rows]
+        work_hashes = [candidate_hashes[row] for row in rows]
+        candidate_matrix, position_matrix = scoring_inputs(work, unique_positions, lexical_model)
+        for start, scores in score_chunks(candidate_matrix, position_matrix, chunk_rows, workers or scoring_workers()):
+            chunk = rows[start:start + len(scores)]
+            write_cached_scores(work[start:], work_hashes[start:], sow_hashes, scores, missing[chunk], key)
+            result['scored'] += int(missing[chunk].sum())
+            _write_checkpoint(checkpoint, run_key, work[start + len(scores) - 1].pk)
+            if progress is not None:
+                progress(result['scored'], total)
+
+    _remove_checkpoint(checkpoint)
+    return result
+
+
+def _lexical_model():
+    # the one fitted model a whole run scores with, None for the vector backend
+    return None if similarity_backend() == VECTOR_BACKEND else get_lexical_model()
+
+
+def _read_checkpoint(path: str, run_key: list):
+    # the candidate id an earlier run got up to, None when there is no checkpoint for this run
+    try:
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (FileNotFoundError, ValueError):
+        return None
+    return checkpoint.get('candidate_id') if checkpoint.get('run') == run_key else None
+
+
+def _write_checkpoint(path: str, run_key: list, candidate_id: int):
+    # written next to the checkpoint and swapped in, so a run killed half way through a write leaves the old one
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.json')
+    with os.fdopen(file_descriptor, 'w') as temporary_file:
+        json.dump({'run': run_key, 'candidate_id': candidate_id}, temporary_file)
+    os.replace(temporary_path, path)
+
+
+def _remove_checkpoint(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,101 @@
+# resumes are stored and parsed once per distinct file: an upload is hashed, a file we already have reuses its
+# UploadedFile (and the blob under media/resumes/) and the parsed data is kept on that row for the next time
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from pyresparser import ResumeParser
+
+from .hashing import file_hash
+from .models import UploadedFile
+
+
+def store_resume(file) -> UploadedFile:
+    """
+    The UploadedFile for a resume, the existing one when a file with the same bytes was uploaded before.
+
+    Args:
+        file (File): The uploaded resume.
+
+    Returns:
+        UploadedFile: A new row with the file saved, or the row the same resume was saved under before.
+
+    Example:
+        store_resume(form.cleaned_data['resume'])
+        # Output: <UploadedFile: resumes/jane_doe.pdf>
+    """
+    content_hash = file_hash(file)
+    existing = UploadedFile.objects.filter(content_hash=content_hash).first()
+    if existing is not None and existing.file and existing.file.storage.exists(existing.file.name):
+        return existing
+
+    uploaded_file = existing or UploadedFile(content_hash=content_hash)
+    uploaded_file.file = file
+    try:
+        with transaction.atomic():
+            uploaded_file.save()
+    except IntegrityError:
+        # the same resume came in on another request at the same time, keep theirs
+        uploaded_file.file.delete(save=False)
+        return UploadedFile.objects.get(content_hash=content_hash)
+    return uploaded_file
+
+
+def cached_resume_data(uploaded_file: UploadedFile):
+    """
+    What pyresparser got out of this file before, or None when it has not been parsed with the current
+    settings.RESUME_PARSER_VERSION.
+    """
+    if uploaded_file.parsed_data is not None and uploaded_file.parsed_with == settings.RESUME_PARSER_VERSION:
+        return uploaded_file.parsed_data
+    return None
+
+
+def remember_resume_data(uploaded_file: UploadedFile, data: dict):
+    """
+    Keeps the parsed data with the file so the next upload of the same resume skips the parser.
+    """
+    uploaded_file.parsed_data = data
+    uploaded_file.parsed_with = settings.RESUME_PARSER_VERSION
+    UploadedFile.objects.filter(pk=uploaded_file.pk).update(parsed_data=data, parsed_with=uploaded_file.parsed_with)
+
+
+def extract_resume_data(uploaded_file: UploadedFile) -> dict:
+    """
+    pyresparser's extracted data for an uploaded resume, parsed only if the same file was not parsed before.
+
+    Example:
+        extract_resume_data(uploaded_file)
+        # Output: {'name': 'Jane Doe', 'skills': ['Python', 'SQL'], 'degree': None, 'total_experience': 3.0, ...}
+    """
+    data = cached_resume_data(uploaded_file)
+    if data is None:
+        data = parse_resume_file(uploaded_file.file.path)
+        remember_resume_data(uploaded_file, data)
+    return data
+
+
+def parse_resume_file(path: str) -> dict:
+    """
+    Runs pyresparser over one resume. Kept at module level so the worker processes of parse_resume_files
+    (bulk_resumes.py) can call it.
+    """
+    return ResumeParser(path).get_extracted_data()
+
+
+def candidate_fields(data: dict, name: str, education: str, years_of_experience: int) -> dict:
+    """
+    The Candidate fields for what pyresparser got out of a resume, the given education and years of experience fill in
+    whatever the parser could not find.
+    """
+    skills = ', '.join(data.get('skills', []))
+    try:
+        parsed_education = ', '.join(data.get('degree', []))
+    except TypeError:
+        parsed_education = None
+    parsed_years_of_experience = data.get('total_experience', 0)
+
+    return {
+        'name': name,
+        'skills': skills,
+        'years_of_experience': parsed_years_of_experience or years_of_experience,
+        'education': parsed_education or education,
+    }
@@ -0,0 +1,196 @@
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .ann_index import get_index, unindexed_ids
+from .lexical import LEXICAL_BACKENDS, get_lexical_model, term_rows
+from .matching import MatchMatrix, open_sow_positions, similarity_backend, top_k
+from .models import Candidate, SkillPosting, SOWPosition
+from .preprocessing import preprocess_texts
+from .skill_index import candidate_skills, position_skills, rank_by_skill_overlap
+from .vectors import VECTOR_BACKEND, candidate_match_text, candidate_vector, position_match_text, position_vector
+
+# the first, cheap stage of matching (see settings.MATCH_RETRIEVER), the shortlist it picks is then scored by MatchMatrix:
+# 'ann' asks the vector index for the nearest neighbours, 'skills' merges posting lists of the skill index and
+# 'lexical' ranks by sparse MATCH_RETRIEVER_WEIGHTING scores
+RETRIEVERS = ('ann', 'skills', 'lexical')
+
+
+def match_retriever(retriever: str = None):
+    """
+    The retriever to shortlist with, or None to score every candidate or position.
+
+    Args:
+        retriever (str): One of RETRIEVERS, defaults to settings.MATCH_RETRIEVER.
+
+    Returns:
+        str: The retriever, None when there is nothing to retrieve with ('ann' needs the vector backend).
+    """
+    retriever = retriever or settings.MATCH_RETRIEVER
+    if not retriever:
+        return None
+    if retriever not in RETRIEVERS:
+        raise ImproperlyConfigured(f"MATCH_RETRIEVER must be one of {RETRIEVERS} or None, not {retriever!r}")
+    if settings.MATCH_RETRIEVER_WEIGHTING not in LEXICAL_BACKENDS:
+        raise ImproperlyConfigured(f"MATCH_RETRIEVER_WEIGHTING must be one of {LEXICAL_BACKENDS}, not {settings.MATCH_RETRIEVER_WEIGHTING!r}")
+    # only the vector backend stores the vectors the ANN index is built from
+    if retriever == 'ann' and similarity_backend() != VECTOR_BACKEND:
+        return None
+    return retriever
+
+
+def shortlist_positions(candidate: Candidate, positions, n: int, retriever: str = None):
+    """
+    The first stage of matching a candidate: narrows `positions` down to the n most promising ones, cheaply, so only
+    those get scored by MatchMatrix.
+
+    Args:
+        candidate (Candidate): The candidate to find positions for.
+        positions (QuerySet): The SOWPositions to choose from, usually open_sow_positions().
+        n (int): How many positions to shortlist.
+        retriever (str): One of RETRIEVERS, defaults to settings.MATCH_RETRIEVER.
+
+    Returns:
+        QuerySet: The shortlisted SOWPositions, `positions` itself when there is no retriever.
+
+    Example:
+        shortlist_positions(candidate, open_sow_positions(), 100, retriever='skills')
+        # Output: <QuerySet [<SOWPosition: ...>, ...]>
+    """
+    retriever = match_retriever(retriever)
+    if retriever is None:
+        return positions
+
+    allowed_ids = set(positions.values_list('pk', flat=True))
+    if retriever == 'ann':
+        nearest = get_index('positions').query(candidate_vector(candidate), n, allowed_ids)
+        # positions the index does not have yet are scored as well rather than left out
+        position_ids = [position_id for position_id, _ in nearest] + list(unindexed_ids('positions') & allowed_ids)
+    elif retriever == 'skills':
+        # positions sharing no skill with the candidate never make the shortlist
+        ranked = rank_by_skill_overlap(SkillPosting.POSITIONS, candidate_skills(candidate))
+        position_ids = [position_id for position_id, _ in ranked if position_id in allowed_ids][:n]
+    else:
+        position_ids = _lexical_shortlist(candidate_match_text(candidate), 'positions', n, allowed_ids)
+    return SOWPosition.objects.filter(pk__in=position_ids)
+
+
+def shortlist_candidates(sow_position: SOWPosition, n: int, retriever: str = None):
+    """
+    The first stage of matching a position: picks the n most promising candidates, cheaply, so only those get scored
+    by MatchMatrix.
+
+    Args:
+        sow_position (SOWPosition): The position to find candidates for.
+        n (int): How many candidates to shortlist.
+        retriever (str): One of RETRIEVERS, defaults to settings.MATCH_RETRIEVER.
+
+    Returns:
+        QuerySet: The shortlisted Candidates, every candidate when there is no retriever.
+    """
+    retriever = match_retriever(retriever)
+    if retriever is None:
+        return Candidate.objects.all()
+
+    if retriever == 'ann':
+        nearest = get_index('candidates').query(position_vector(sow_position), n)
+        # candidates the index does not have yet are scored as well rather than left out
+        candidate_ids = [candidate_id for candidate_id, _ in nearest] + list(unindexed_ids('candidates'))
+    elif retriever == 'skills':
+        candidate_ids = [candidate_id for candidate_id, _ in rank_by_skill_overlap(SkillPosting.CANDIDATES, position_skills(sow_position), n)]
+    else:
+        candidate_ids = _lexical_shortlist(position_match_text(sow_position), 'candidates', n)
+    return Candidate.objects.filter(pk__in=candidate_ids)
+
+
+def shortlist_size(k: int, n: int = None) -> int:
+    """
+    How big a shortlist to retrieve to show the k best matches: n when a view asks for a size, otherwise
+    settings.MATCH_SHORTLIST_OVERSAMPLE times k. Never smaller than k.
+    """
+    return max(n or k * settings.MATCH_SHORTLIST_OVERSAMPLE, k)
+
+
+def measure_recall(direction: str = 'positions', retriever: str = None, n: int = 100, k: int = 25, sample: int = None, seed: int = 0) -> dict:
+    """
+    How much of the full scan's top k a retriever's shortlist of n keeps, to tune the retriever and n
+    (see manage.py measure_recall).
+
+    For every sampled candidate (or position) the full scan scores it against every open position (candidate), and
+    recall@k is the share of the full scan's k best that made the shortlist. Since the shortlist is reranked with the
+    same scores, whatever made it in ends up in the same place as in the full scan.
+
+    Args:
+        direction (str): 'positions' measures get_open_positions_for_candidate, 'candidates' get_candidate_for_position.
+        retriever (str): One of RETRIEVERS, defaults to settings.MATCH_RETRIEVER.
+        n (int): The shortlist size.
+        k (int): How many matches are shown.
+        sample (int): Only measure this many random candidates (positions), defaults to all of them.
+        seed (int): Seed for picking the sample.
+
+    Returns:
+        dict: retriever, queries, recall (mean recall@k), min_recall, retrieve_seconds and full_scan_seconds (totals).
+
+    Example:
+        measure_recall('positions', retriever='skills', n=100, k=25, sample=50)
+        # Output: {'retriever': 'skills', 'queries': 50, 'recall': 0.93, 'min_recall': 0.6, ...}
+    """
+    retriever = match_retriever(retriever)
+    if direction == 'positions':
+        queries, targets = Candidate.objects.all(), open_sow_positions()
+    elif direction == 'candidates':
+        queries, targets = open_sow_positions(), Candidate.objects.all()
+    else:
+        raise ValueError(f"Unknown recall direction: {direction}")
+
+    queries = list(queries)
+    if sample is not None and sample < len(queries):
+        queries = random.Random(seed).sample(queries, sample)
+
+    # the full scan is one matrix (cached scores are used where there are some) for every query at once
+    started = time.perf_counter()
+    if direction == 'positions':
+        match = MatchMatrix(queries, targets, cached=True)
+        best = [{match.positions[column].pk for column in columns} for columns in match.top_positions(k)]
+    else:
+        match = MatchMatrix(targets, queries, cached=True)
+        best = [{match.candidates[row].pk for row in rows} for rows in match.top_candidates(k)]
+    full_scan_seconds = time.perf_counter() - started
+
+    recalls = []
+    started = time.perf_counter()
+    for query, expected in zip(queries, best):
+        if direction == 'positions':
+            shortlist = shortlist_positions(query, targets, n, retriever)
+        else:
+            shortlist = shortlist_candidates(query, n, retriever)
+        found = set(shortlist.values_list('pk', flat=True))
+        if expected:
+            recalls.append(len(expected & found) / len(expected))
+    retrieve_seconds = time.perf_counter() - started
+
+    return {
+        'retriever': retriever or 'full',
+        'queries': len(recalls),
+        'recall': float(np.mean(recalls)) if recalls else 1.0,
+        'min_recall': min(recalls, default=1.0),
+        'retrieve_seconds': retrieve_seconds,
+        'full_scan_seconds': full_scan_seconds,
+    }
+
+
+def _lexical_shortlist(query_text: str, kind: str, n: int, allowed_ids: set = None) -> list:
+    # every row of the kind is ranked against the query by its sparse term weights in a single sparse product, the
+    # rows' weights are kept with the model (see lexical.term_rows) so only the query is weighted here
+    model = get_lexical_model(settings.MATCH_RETRIEVER_WEIGHTING)
+    ids, matrix = term_rows(model, kind)
+    if allowed_ids is not None:
+        rows = [row for row, item_id in enumerate(ids) if item_id in allowed_ids]
+        ids, matrix = [ids[row] for row in rows], matrix[rows]
+    if not ids:
+        return []
+    scores = model.similarity(model.transform(preprocess_texts([query_text])), matrix)
+    return [ids[column] for column in top_k(scores, n)[0]]
@@ -0,0 +1,118 @@
+# the number crunching half of a full rematch (see rematch.py), run on a ProcessPoolExecutor. Nothing in here imports
+# Django or spaCy: the parent works out every vector (or term weight row) once and puts the matrices in shared memory,
+# the workers only multiply slices of them, so they are cheap to start and never get a pickled copy of the inputs
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import sparse
+
+# the shared inputs as seen from inside a worker, attached once by _attach_inputs
+_inputs = {}
+_blocks = []
+
+
+def score_chunks(candidate_matrix, position_matrix, chunk_rows: int, workers: int = 1):
+    """
+    Scores every candidate row against every position row, chunk_rows candidates at a time, yielding the chunks in
+    order as they finish.
+
+    With more than one worker the chunks are spread over a process pool that reads both matrices from shared memory.
+    Only a couple of chunks per worker are in flight at once, so a slow consumer (writing the scores to the database)
+    never has the whole score matrix piling up in memory.
+
+    Args:
+        candidate_matrix: (candidates x features) dense np.ndarray of unit vectors or scipy sparse matrix of l2
+            normalised term weights.
+        position_matrix: (positions x features) matrix of the same kind.
+        chunk_rows (int): How many candidates go in one chunk.
+        workers (int): How many processes to score on, 1 scores in this process.
+
+    Yields:
+        tuple: (first candidate row, np.ndarray of (chunk candidates x positions) similarity percentages).
+
+    Example:
+        for start, scores in score_chunks(candidates, positions, chunk_rows=100, workers=4):
+            save(start, scores)
+    """
+    rows = candidate_matrix.shape[0]
+    starts = range(0, rows, max(chunk_rows, 1))
+    if workers <= 1 or len(starts) <= 1:
+        for start in starts:
+            yield start, score_matrices(candidate_matrix[start:start + chunk_rows], position_matrix)
+        return
+
+    blocks = []
+    try:
+        descriptors = {
+            'candidates': _share(candidate_matrix, blocks),
+            'positions': _share(position_matrix, blocks),
+        }
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_inputs, initargs=(descriptors,)) as executor:
+            pending = deque()
+            for start in starts:
+                pending.append((start, executor.submit(_score_rows, start, min(start + chunk_rows, rows))))
+                if len(pending) >= 2 * workers:
+                    start, future = pending.popleft()
+                    yield start, future.result()
+            while pending:
+                start, future = pending.popleft()
+                yield start, future.result()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def score_matrices(candidate_matrix, position_matrix) -> np.ndarray:
+    """
+    (candidates x positions) similarity percentages from two scoring_inputs matrices, the same numbers
+    matching.similarity_matrix and LexicalModel.similarity give.
+    """
+    scores = candidate_matrix @ position_matrix.T
+    if sparse.issparse(scores):
+        scores = scores.toarray()
+    return np.asarray(scores, dtype=np.float32) * 100
+
+
+def _share(matrix, blocks: list) -> dict:
+    # copies the matrix (or the three arrays of a sparse one) into shared memory, returns how to find it again
+    if sparse.issparse(matrix):
+        matrix = sparse.csr_matrix(matrix)
+        return {
+            'shape': matrix.shape,
+            'data': _share_array(matrix.data, blocks),
+            'indices': _share_array(matrix.indices, blocks),
+            'indptr': _share_array(matrix.indptr, blocks),
+        }
+    return {'shape': matrix.shape, 'dense': _share_array(np.ascontiguousarray(matrix, dtype=np.float32), blocks)}
+
+
+def _share_array(array: np.ndarray, blocks: list) -> tuple:
+    # shared memory blocks can not be empty, a zero length array still gets a byte
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block.name, array.shape, array.dtype.str
+
+
+def _attach_inputs(descriptors: dict):
+    for name, descriptor in descriptors.items():
+        if 'dense' in descriptor:
+            _inputs[name] = _attach_array(descriptor['dense'])
+        else:
+            parts = (_attach_array(descriptor[part]) for part in ('data', 'indices', 'indptr'))
+            _inputs[name] = sparse.csr_matrix(tuple(parts), shape=descriptor['shape'], copy=False)
+
+
+def _attach_array(descriptor: tuple) -> np.ndarray:
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    # the block has to outlive the arrays looking into it, so it stays open for the life of the worker
+    _blocks.append(block)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _score_rows(start: int, stop: int) -> np.ndarray:
+    return score_matrices(_inputs['candidates'][start:stop], _inputs['positions'])
@@ -0,0 +1,303 @@
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .ann_index import index_on_commit
+from .match_cache import bump_data_version
+from .matching import invalidate_candidate_scores, invalidate_position_scores, link_sow_position, link_xlsx_jobs
+from .models import Candidate, JobSubmission, Skill, SkillPosting, SOWPosition, XlsxJob
+from .skill_index import clear_skill_vocabulary, index_candidate, index_job_submission, index_position, unindex_skills
+from .tasks import enqueue_on_commit
+from .vectors import candidate_match_text, position_match_text, assign_vectors, vector_from_bytes
+
+
+@receiver(post_init, sender=Candidate)
+def remember_candidate_text(sender, instance, **kwargs):
+    # the stored vector belongs to the text as it was loaded, so we only re-vectorise real edits
+    instance._vector_text = _loaded_text(candidate_match_text, instance, ['skills', 'education'])
+    instance._saved_match_hash = _loaded_match_hash(instance)
+    instance._skill_text = _loaded_field(instance, 'skills')
+
+
+@receiver(post_init, sender=SOWPosition)
+def remember_position_text(sender, instance, **kwargs):
+    instance._vector_text = _loaded_text(position_match_text, instance, ['posdesc'])
+    instance._saved_match_hash = _loaded_match_hash(instance)
+    instance._link_key = _loaded_link_key(instance)
+    instance._skill_text = _loaded_field(instance, 'posdesc')
+
+
+@receiver(post_init, sender=Skill)
+def remember_skill_name(sender, instance, **kwargs):
+    instance._skill_text = _loaded_field(instance, 'name')
+
+
+@receiver(post_init, sender=XlsxJob)
+def remember_xlsx_job_position(sender, instance, **kwargs):
+    instance._link_key = _loaded_link_key(instance)
+    instance._open_or_closed = _loaded_field(instance, 'open_or_closed')
+
+
+# loaddata saves rows with raw=True, exactly as the fixture has them, so the pre_save and post_save receivers below
+# leave them alone: no vectorising, no jobs and no index writes. Run `manage.py rebuild_skill_index`,
+# `manage.py rebuild_ann_index` and `manage.py rematch` after loading a fixture
+@receiver(pre_save, sender=Candidate)
+def store_candidate_vector(sender, instance, **kwargs):
+    """
+    Writes the candidate's document vector onto the row whenever their skills or education change.
+    """
+    if kwargs.get('raw'):
+        return
+    instance._vector_changed = _assign_vector(instance, candidate_match_text)
+
+
+@receiver(pre_save, sender=SOWPosition)
+def store_position_vector(sender, instance, **kwargs):
+    """
+    Writes the position's document vector onto the row whenever its position description changes.
+    """
+    if kwargs.get('raw'):
+        return
+    instance._vector_changed = _assign_vector(instance, position_match_text)
+
+
+@receiver(post_save, sender=Candidate)
+def candidate_text_changed(sender, instance, created, **kwargs):
+    """
+    After a candidate's skills or education change: drops the scores cached for their old text, updates the ANN index
+    and queues their row of the match matrix (and only that row) to be scored again.
+    """
+    if kwargs.get('raw') or not _take_vector_change(instance):
+        return
+    if not created:
+        invalidate_candidate_scores(instance)
+    bump_data_version()
+    _index_vector('candidates', instance)
+    enqueue_on_commit('score_candidates', 'candidate_ids', instance.pk)
+
+
+@receiver(post_save, sender=SOWPosition)
+def position_text_changed(sender, instance, created, **kwargs):
+    """
+    After a position description changes: drops the scores cached for the old description, updates the ANN index and
+    queues the position's column of the match matrix (and only that column) to be scored again.
+    """
+    if kwargs.get('raw'):
+        return
+    stale_hash = instance._saved_match_hash
+    if not _take_vector_change(instance):
+        return
+    if stale_hash != instance.match_hash:
+        invalidate_position_scores(stale_hash)
+    bump_data_version()
+    _index_vector('positions', instance)
+    enqueue_on_commit('score_positions', 'position_ids', instance.pk)
+
+
+@receiver(post_save, sender=SOWPosition)
+def link_position(sender, instance, created, **kwargs):
+    """
+    Links a new position, or one that moved to another tonum or posnum, to the XlsxJob rows it lines up with.
+    """
+    if kwargs.get('raw'):
+        return
+    if _take_link_change(instance, created):
+        link_sow_position(instance)
+
+
+@receiver(post_save, sender=XlsxJob)
+def link_xlsx_job(sender, instance, created, **kwargs):
+    """
+    Links a new XlsxJob, or one that moved to another tonum or posnum, to the SOW positions it lines up with.
+    """
+    if kwargs.get('raw'):
+        return
+    if _take_link_change(instance, created):
+        link_xlsx_jobs([instance], created=created)
+
+
+@receiver(post_save, sender=XlsxJob)
+def xlsx_job_opened_or_closed(sender, instance, created, **kwargs):
+    """
+    Opening or closing an XLSX job changes which positions are matched, so the cached match lists are retired.
+    """
+    if kwargs.get('raw'):
+        return
+    if not created and instance.open_or_closed != instance._open_or_closed:
+        bump_data_version()
+    instance._open_or_closed = instance.open_or_closed
+
+
+@receiver(post_save, sender=Candidate)
+def index_candidate_skills(sender, instance, created, **kwargs):
+    """
+    Keeps the candidate's postings in the skill index in step with their skills.
+    """
+    if kwargs.get('raw'):
+        return
+    if _take_skill_change(instance, instance.skills, created):
+        index_candidate(instance)
+
+
+@receiver(post_save, sender=SOWPosition)
+def index_position_skills(sender, instance, created, **kwargs):
+    """
+    Keeps the position's postings in the skill index in step with the skills its description mentions.
+    """
+    if kwargs.get('raw'):
+        return
+    if _take_skill_change(instance, instance.posdesc, created):
+        index_position(instance)
+
+
+@receiver(m2m_changed, sender=JobSubmission.skills.through)
+def index_job_submission_skills(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the job submissions' postings in the skill index in step with their required skills, from either side of
+    the relation (job_submission.skills.add(...) or skill.jobsubmission_set.add(...)).
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_job_submission(instance)
+        return
+    # the instance is a Skill, after a clear pk_set is None so the jobs it had are noted down beforehand
+    if action == 'pre_clear':
+        instance._cleared_job_ids = list(instance.jobsubmission_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        job_ids = pk_set if action != 'post_clear' else instance._cleared_job_ids
+        for job_submission in JobSubmission.objects.filter(pk__in=job_ids):
+            index_job_submission(job_submission)
+
+
+@receiver(post_save, sender=Skill)
+def skill_renamed(sender, instance, created, **kwargs):
+    """
+    A new or renamed skill changes what can be found in position descriptions and what the job submissions that
+    require it are indexed under.
+    """
+    if kwargs.get('raw'):
+        return
+    old_name = instance._skill_text
+    if not _take_skill_change(instance, instance.name, created):
+        return
+    clear_skill_vocabulary()
+    for job_submission in instance.jobsubmission_set.all():
+        index_job_submission(job_submission)
+    _reindex_positions_mentioning(instance.name, old_name)
+
+
+@receiver(pre_delete, sender=Skill)
+def remember_skill_jobs(sender, instance, **kwargs):
+    # the through rows are gone (without an m2m_changed) by the time post_delete runs
+    instance._deleted_job_ids = list(instance.jobsubmission_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Skill)
+def skill_deleted(sender, instance, **kwargs):
+    clear_skill_vocabulary()
+    for job_submission in JobSubmission.objects.filter(pk__in=instance._deleted_job_ids):
+        index_job_submission(job_submission)
+    _reindex_positions_mentioning(instance.name)
+
+
+@receiver(post_delete, sender=Candidate)
+def unindex_candidate(sender, instance, **kwargs):
+    # the cached scores go with the candidate through the foreign key
+    unindex_skills(SkillPosting.CANDIDATES, instance.pk)
+    bump_data_version()
+    index_on_commit('candidates', instance.pk)
+
+
+@receiver(post_delete, sender=SOWPosition)
+def unindex_position(sender, instance, **kwargs):
+    invalidate_position_scores(instance.match_hash)
+    unindex_skills(SkillPosting.POSITIONS, instance.pk)
+    bump_data_version()
+    index_on_commit('positions', instance.pk)
+
+
+@receiver(post_delete, sender=XlsxJob)
+def xlsx_job_deleted(sender, instance, **kwargs):
+    # its links to positions go with it (no m2m_changed for that), and those positions may not be open any more
+    bump_data_version()
+
+
+@receiver(post_delete, sender=JobSubmission)
+def unindex_job_submission(sender, instance, **kwargs):
+    unindex_skills(SkillPosting.JOB_SUBMISSIONS, instance.pk)
+
+
+def _assign_vector(instance, match_text) -> bool:
+    if assign_vectors([instance], match_text):
+        return True
+    # batch imports (parse_sow, parse_resumes) vectorise everything in one go before saving, that is a change as well
+    return 'match_hash' not in instance.get_deferred_fields() and instance.match_hash != instance._saved_match_hash
+
+
+def _take_vector_change(instance) -> bool:
+    # the instance may be saved again, only the save that changed the text should act on it
+    changed = getattr(instance, '_vector_changed', False)
+    instance._vector_changed = False
+    if changed:
+        instance._saved_match_hash = instance.match_hash
+    return changed
+
+
+def _take_link_change(instance, created) -> bool:
+    link_key = (instance.tonum, instance.posnum)
+    changed = created or link_key != instance._link_key
+    instance._link_key = link_key
+    return changed
+
+
+def _take_skill_change(instance, text, created) -> bool:
+    changed = created or text != instance._skill_text
+    instance._skill_text = text
+    return changed
+
+
+def _reindex_positions_mentioning(*names):
+    # a cheap text filter first, index_position works out whether the skill is really mentioned as a whole phrase
+    names = [name for name in names if name and name.strip()]
+    if not names:
+        return
+    mentions = Q()
+    for name in names:
+        mentions |= Q(posdesc__icontains=name.strip())
+    for position in SOWPosition.objects.filter(mentions).only('posdesc'):
+        index_position(position)
+
+
+def _index_vector(kind, instance):
+    if not instance.vector:
+        return
+    # only touch the index file once the row is really in the database, once for the whole transaction
+    index_on_commit(kind, instance.pk, vector_from_bytes(instance.vector), instance.match_hash)
+
+
+def _loaded_text(match_text, instance, field_names):
+    # reading a deferred field would cost a query per row, and a half filled instance has no text yet
+    if instance.get_deferred_fields().intersection(field_names):
+        return None
+    try:
+        return match_text(instance)
+    except TypeError:
+        return None
+
+
+def _loaded_field(instance, field_name):
+    if field_name in instance.get_deferred_fields():
+        return None
+    return getattr(instance, field_name)
+
+
+def _loaded_match_hash(instance):
+    if 'match_hash' in instance.get_deferred_fields():
+        return None
+    return instance.match_hash
+
+
+def _loaded_link_key(instance):
+    if instance.get_deferred_fields().intersection(['tonum', 'posnum']):
+        return None
+    return instance.tonum, instance.posnum
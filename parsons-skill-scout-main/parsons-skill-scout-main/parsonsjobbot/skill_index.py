@@ -0,0 +1,260 @@
+import csv
+import heapq
+import os
+import re
+import threading
+from itertools import groupby
+
+import pyresparser
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Candidate, JobSubmission, Skill, SkillPosting, SOWPosition
+
+# the SkillPosting kinds, one set of posting lists each
+KINDS = (SkillPosting.CANDIDATES, SkillPosting.POSITIONS, SkillPosting.JOB_SUBMISSIONS)
+
+# skill names are matched in position descriptions word by word, these are the "words" (c++, c#, node.js, scikit-learn)
+SKILL_TOKEN = re.compile(r"[a-z0-9][a-z0-9+#.\-]*")
+
+# pyresparser's list of known skills, the same one it picks skills out of resumes with
+SKILLS_CSV = os.path.join(os.path.dirname(pyresparser.__file__), 'skills.csv')
+
+# the skills we look for in position descriptions: SKILLS_CSV plus every Skill name, see skill_vocabulary()
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+def normalise_skill(name: str) -> str:
+    """
+    The form every skill is indexed and looked up under: lower cased with the whitespace collapsed.
+
+    Example:
+        normalise_skill("  Machine   Learning ")
+        # Output: 'machine learning'
+    """
+    return ' '.join(str(name).lower().split())
+
+
+def candidate_skills(candidate: Candidate) -> set:
+    """
+    The candidate's normalised skills, from the comma separated Candidate.skills text.
+    """
+    return {skill for skill in map(normalise_skill, (candidate.skills or '').split(',')) if skill}
+
+
+def position_skills(position: SOWPosition) -> set:
+    """
+    The known skills (see skill_vocabulary) mentioned in the position description.
+
+    Example:
+        position_skills(SOWPosition(posdesc="Builds Machine Learning services in Python and SQL."))
+        # Output: {'machine learning', 'python', 'sql'}
+    """
+    vocabulary, longest = skill_vocabulary()
+    words = [word.rstrip('.-') for word in SKILL_TOKEN.findall((position.posdesc or '').lower())]
+    found = set()
+    for size in range(1, longest + 1):
+        for start in range(len(words) - size + 1):
+            phrase = ' '.join(words[start:start + size])
+            if phrase in vocabulary:
+                found.add(phrase)
+    return found
+
+
+def job_submission_skills(job_submission: JobSubmission) -> set:
+    """
+    The normalised names of the job submission's required skills.
+    """
+    return {skill for skill in map(normalise_skill, job_submission.skills.values_list('name', flat=True)) if skill}
+
+
+def skill_vocabulary() -> tuple:
+    """
+    The set of normalised skill names looked for in position descriptions and the most words any of them has.
+
+    Built once per process from pyresparser's skills.csv and the Skill table, clear_skill_vocabulary() throws it away
+    when a Skill changes.
+    """
+    global _vocabulary
+    with _vocabulary_lock:
+        if _vocabulary is None:
+            names = set(Skill.objects.values_list('name', flat=True))
+            with open(SKILLS_CSV, newline='', encoding='utf-8') as skills_file:
+                for row in csv.reader(skills_file):
+                    names.update(row)
+            vocabulary = frozenset(skill for skill in map(normalise_skill, names) if skill)
+            _vocabulary = (vocabulary, max((len(skill.split()) for skill in vocabulary), default=1))
+        return _vocabulary
+
+
+def clear_skill_vocabulary():
+    global _vocabulary
+    with _vocabulary_lock:
+        _vocabulary = None
+
+
+def index_skills(kind: str, object_id: int, skills) -> bool:
+    """
+    Makes the object's postings match the given skills, only adding and removing the ones that changed.
+
+    Args:
+        kind (str): One of KINDS.
+        object_id (int): The candidate, position or job submission pk.
+        skills (iterable): Its skills, normalised or not.
+
+    Returns:
+        bool: Whether any posting was added or removed.
+    """
+    skills = {skill for skill in map(normalise_skill, skills) if skill}
+    postings = SkillPosting.objects.filter(kind=kind, object_id=object_id)
+    indexed = set(postings.values_list('skill', flat=True))
+    if indexed == skills:
+        return False
+    with transaction.atomic():
+        if indexed - skills:
+            postings.filter(skill__in=indexed - skills).delete()
+        # ignore_conflicts: a concurrent save of the same object may have added some of them already
+        SkillPosting.objects.bulk_create([
+            SkillPosting(skill=skill, kind=kind, object_id=object_id) for skill in skills - indexed
+        ], ignore_conflicts=True)
+    return True
+
+
+def unindex_skills(kind: str, object_id: int):
+    SkillPosting.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def index_candidate(candidate: Candidate) -> bool:
+    return index_skills(SkillPosting.CANDIDATES, candidate.pk, candidate_skills(candidate))
+
+
+def index_position(position: SOWPosition) -> bool:
+    return index_skills(SkillPosting.POSITIONS, position.pk, position_skills(position))
+
+
+def index_job_submission(job_submission: JobSubmission) -> bool:
+    return index_skills(SkillPosting.JOB_SUBMISSIONS, job_submission.pk, job_submission_skills(job_submission))
+
+
+def rebuild_skill_index(kinds=KINDS) -> dict:
+    """
+    Indexes every candidate, position and job submission from scratch, for the rows that were saved before the index
+    existed (see manage.py rebuild_skill_index). Postings of deleted rows are dropped along the way.
+
+    Returns:
+        dict: How many objects of each kind had their postings changed.
+    """
+    clear_skill_vocabulary()
+    sources = {
+        SkillPosting.CANDIDATES: (Candidate.objects.only('skills'), index_candidate),
+        SkillPosting.POSITIONS: (SOWPosition.objects.only('posdesc'), index_position),
+        SkillPosting.JOB_SUBMISSIONS: (JobSubmission.objects.prefetch_related('skills'), index_job_submission),
+    }
+    changed = {}
+    for kind in kinds:
+        queryset, index = sources[kind]
+        SkillPosting.objects.filter(kind=kind).exclude(object_id__in=queryset.model.objects.values('pk')).delete()
+        changed[kind] = sum(index(instance) for instance in queryset.iterator(chunk_size=500))
+    return changed
+
+
+def skill_postings(kind: str, skills) -> dict:
+    """
+    The posting list of every given skill, in one query on the (kind, skill, object_id) index.
+
+    Returns:
+        dict: normalised skill -> sorted list of object ids, skills nobody has map to an empty list.
+
+    Example:
+        skill_postings('candidates', ["Python", "SQL"])
+        # Output: {'python': [1, 4, 9], 'sql': [4, 7]}
+    """
+    skills = {skill for skill in map(normalise_skill, skills) if skill}
+    postings = {skill: [] for skill in skills}
+    rows = SkillPosting.objects.filter(kind=kind, skill__in=skills).order_by('skill', 'object_id')
+    for skill, object_ids in groupby(rows.values_list('skill', 'object_id'), key=lambda row: row[0]):
+        postings[skill] = [object_id for _, object_id in object_ids]
+    return postings
+
+
+def having_all_skills(kind: str, skills) -> list:
+    """
+    Answers "who has skill X and Y" by intersecting posting lists, shortest first, without reading any skills text.
+
+    Returns:
+        list: The sorted ids of the candidates (positions, job submissions) with every one of the skills.
+
+    Example:
+        having_all_skills('candidates', ["python", "sql"])
+        # Output: [4]
+    """
+    posting_lists = sorted(skill_postings(kind, skills).values(), key=len)
+    if not posting_lists:
+        return []
+    matches = posting_lists[0]
+    for posting_list in posting_lists[1:]:
+        if not matches:
+            break
+        matches = _intersect_sorted(matches, posting_list)
+    return matches
+
+
+def rank_by_skill_overlap(kind: str, skills, limit: int = None) -> list:
+    """
+    Ranks objects by how many of the given skills they have, by merging the skills' posting lists.
+
+    Args:
+        kind (str): One of KINDS.
+        skills (iterable): The skills to look for, e.g. a candidate's skills when ranking positions for them.
+        limit (int): Only return the best this many, defaults to every object with at least one of the skills.
+
+    Returns:
+        list: (object id, number of the skills it has) tuples, most shared skills first and then by id.
+
+    Example:
+        rank_by_skill_overlap('candidates', ["python", "sql", "django"], limit=2)
+        # Output: [(4, 3), (1, 2)]
+    """
+    merged = heapq.merge(*skill_postings(kind, skills).values())
+    overlaps = ((object_id, sum(1 for _ in group)) for object_id, group in groupby(merged))
+    key = lambda overlap: (-overlap[1], overlap[0])
+    if limit is not None:
+        return heapq.nsmallest(limit, overlaps, key=key)
+    return sorted(overlaps, key=key)
+
+
+def skill_match_percentages(kind: str, skills, object_ids=None) -> dict:
+    """
+    For each object, the percentage of its skills that are among the given ones, e.g. how much of each job
+    submission's required skills a candidate covers.
+
+    Args:
+        kind (str): One of KINDS.
+        skills (iterable): The skills on offer.
+        object_ids (iterable): Only work these out, defaults to every object sharing at least one skill.
+
+    Returns:
+        dict: object id -> percentage, objects with no indexed skills are left out.
+    """
+    matched = dict(rank_by_skill_overlap(kind, skills))
+    if object_ids is None:
+        object_ids = list(matched)
+    totals = SkillPosting.objects.filter(kind=kind, object_id__in=list(object_ids)).values('object_id').annotate(total=Count('pk'))
+    return {row['object_id']: matched.get(row['object_id'], 0) / row['total'] * 100 for row in totals}
+
+
+def _intersect_sorted(left: list, right: list) -> list:
+    # both lists are sorted object ids, walk them side by side
+    common = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] == right[j]:
+            common.append(left[i])
+            i += 1
+            j += 1
+        elif left[i] < right[j]:
+            i += 1
+        else:
+            j += 1
+    return common
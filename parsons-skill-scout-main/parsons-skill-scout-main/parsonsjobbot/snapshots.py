@@ -0,0 +1,207 @@
+import glob
+import os
+import re
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .ann_index import INDEX_KINDS
+from .hashing import CONTENT_HASH_LENGTH
+from .models import Candidate
+
+# rows are read from the database and written into the snapshot this many at a time
+SNAPSHOT_CHUNK_SIZE = 1000
+
+# the snapshots opened in this process: pointer file path -> (snapshot or None, version, when the pointer was checked)
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def snapshot_dtype(dimensions: int) -> np.dtype:
+    """
+    One record of a snapshot file: the row id, the match_hash of the text its vector was made from and the vector.
+    """
+    return np.dtype([('id', '<i8'), ('match_hash', f'S{CONTENT_HASH_LENGTH}'), ('vector', '<f4', (dimensions,))])
+
+
+class VectorSnapshot:
+    """
+    A read-only, memory mapped copy of every stored candidate (or position) vector, see write_snapshot.
+
+    The records live in a single .npy file that is opened with np.memmap rather than read, so every worker process
+    on a machine shares the same pages through the OS page cache instead of keeping its own copy of the vectors.
+    Rows saved since the snapshot was written have a different match_hash and are simply not served from it.
+
+    Attributes:
+        kind (str): 'candidates' or 'positions'.
+        version (int): Which snapshot this is, newer snapshots have higher versions.
+        ids (np.ndarray): The row ids in ascending order, read into memory (8 bytes a row) for the lookups.
+        match_hashes (np.ndarray): Memory mapped match_hash of every row.
+        vectors (np.ndarray): Memory mapped (rows x dimensions) vectors.
+
+    Usage:
+        snapshot = get_snapshot('candidates')
+        snapshot.vectors_for(Candidate.objects.defer('vector'))
+        # Output: [array([0.01, ...], dtype=float32), None, ...]
+    """
+
+    def __init__(self, kind: str, version: int, records: np.ndarray):
+        self.kind = kind
+        self.version = version
+        self.ids = np.array(records['id'])
+        self.match_hashes = records['match_hash']
+        self.vectors = records['vector']
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, kind: str, version: int) -> 'VectorSnapshot':
+        return cls(kind, version, np.load(snapshot_path(kind, version), mmap_mode='r'))
+
+    def vectors_for(self, instances: list) -> list:
+        """
+        The snapshot vector of every instance, or None for the ones that are not in it or were edited since.
+
+        Args:
+            instances (list): Candidate or SOWPosition instances, only their pk and match_hash are read.
+        """
+        if not len(self.ids) or not instances:
+            return [None] * len(instances)
+        ids = np.fromiter((instance.pk for instance in instances), dtype=np.int64, count=len(instances))
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        vectors = []
+        for instance, row, found in zip(instances, rows, self.ids[rows] == ids):
+            fresh = found and instance.match_hash and self.match_hashes[row] == instance.match_hash.encode()
+            vectors.append(self.vectors[row] if fresh else None)
+        return vectors
+
+
+def snapshot_path(kind: str, version: int) -> str:
+    return os.path.join(settings.MATCH_SNAPSHOT_ROOT, f'{kind}-{version}.npy')
+
+
+def pointer_path(kind: str) -> str:
+    # holds the version readers should use, replacing it is how a new snapshot is published
+    return os.path.join(settings.MATCH_SNAPSHOT_ROOT, f'{kind}.current')
+
+
+def current_version(kind: str):
+    """
+    The published snapshot version for 'candidates' or 'positions', None when no snapshot has been written.
+    """
+    try:
+        with open(pointer_path(kind)) as pointer_file:
+            return int(pointer_file.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def get_snapshot(kind: str):
+    """
+    The current VectorSnapshot for 'candidates' or 'positions', or None when there is none.
+
+    The pointer file is looked at again at most every settings.MATCH_SNAPSHOT_CHECK_INTERVAL seconds, so a snapshot
+    written by another process is picked up without a restart. Requests already holding the old one keep using it
+    until they finish.
+    """
+    path = pointer_path(kind)
+    now = time.monotonic()
+    with _snapshots_lock:
+        loaded = _snapshots.get(path)
+        if loaded is not None and now - loaded[2] < settings.MATCH_SNAPSHOT_CHECK_INTERVAL:
+            return loaded[0]
+
+        version = current_version(kind)
+        if loaded is not None and loaded[1] == version:
+            snapshot = loaded[0]
+        elif version is None:
+            snapshot = None
+        else:
+            try:
+                snapshot = VectorSnapshot.load(kind, version)
+            except FileNotFoundError:
+                # the pointer got ahead of a snapshot that was cleaned up, fall back to the database until the next one
+                snapshot = None
+        _snapshots[path] = (snapshot, version, now)
+        return snapshot
+
+
+def write_snapshot(kind: str) -> VectorSnapshot:
+    """
+    Writes every stored vector of 'candidates' or 'positions' to a new snapshot file and publishes it.
+
+    Rows are streamed into the file in chunks so the whole matrix is never held in memory, and any row still missing
+    a vector gets one on the way (see candidate_vectors). The pointer file is swapped in atomically once the snapshot
+    is complete, and snapshots older than the one it replaces are removed.
+
+    Returns:
+        VectorSnapshot: The snapshot that was just published.
+    """
+    # imported here because vectors imports this module
+    from .vectors import candidate_vectors, position_vectors, vectors_enabled
+
+    if not vectors_enabled():
+        raise ImproperlyConfigured("Vector snapshots need SIMILARITY_BACKEND = 'vectors'")
+
+    model = INDEX_KINDS[kind]
+    stored_vectors = candidate_vectors if model is Candidate else position_vectors
+    ids = np.fromiter(model.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+
+    os.makedirs(settings.MATCH_SNAPSHOT_ROOT, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=settings.MATCH_SNAPSHOT_ROOT, suffix='.npy')
+    os.close(file_descriptor)
+    try:
+        records = None
+        for start in range(0, len(ids), SNAPSHOT_CHUNK_SIZE):
+            # rows deleted in the meantime keep an empty match_hash and are never served
+            rows = list(model.objects.filter(pk__in=ids[start:start + SNAPSHOT_CHUNK_SIZE].tolist()).order_by('pk'))
+            if not rows:
+                continue
+            vectors = stored_vectors(rows)
+            if records is None:
+                records = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=snapshot_dtype(len(vectors[0])), shape=(len(ids),))
+            positions = np.searchsorted(ids, [row.pk for row in rows])
+            records['match_hash'][positions] = [row.match_hash for row in rows]
+            records['vector'][positions] = np.vstack(vectors)
+        if records is None:
+            records = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=snapshot_dtype(0), shape=(len(ids),))
+        records['id'] = ids
+        records.flush()
+        del records
+
+        version = max(_written_versions(kind) + [current_version(kind) or 0]) + 1
+        os.replace(temporary_path, snapshot_path(kind, version))
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    _publish(kind, version)
+    return VectorSnapshot.load(kind, version)
+
+
+def _publish(kind: str, version: int):
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=settings.MATCH_SNAPSHOT_ROOT, suffix='.current')
+    with os.fdopen(file_descriptor, 'w') as temporary_file:
+        temporary_file.write(str(version))
+    os.replace(temporary_path, pointer_path(kind))
+
+    # the previous snapshot is kept for readers that have not looked at the pointer again yet, older ones can go
+    # (open memory maps of a removed file stay readable until they are closed)
+    for old_version in _written_versions(kind):
+        if old_version < version - 1:
+            try:
+                os.remove(snapshot_path(kind, old_version))
+            except OSError:
+                pass
+
+
+def _written_versions(kind: str) -> list:
+    pattern = re.compile(rf'{re.escape(kind)}-(\d+)\.npy$')
+    paths = glob.glob(os.path.join(settings.MATCH_SNAPSHOT_ROOT, f'{kind}-*.npy'))
+    return [int(match.group(1)) for match in map(pattern.search, paths) if match]
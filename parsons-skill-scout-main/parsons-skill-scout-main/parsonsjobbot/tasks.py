@@ -0,0 +1,405 @@
+import logging
+import os
+import signal
+import socket
+import time
+import traceback
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .bulk_resumes import import_resumes, remove_uploads, unpack_uploads
+from .commit_batches import add_on_commit
+from .lexical import fit_lexical_model, lexical_weightings
+from .matching import MatchMatrix, open_sow_positions
+from .models import BackgroundJob, Candidate, SOWPosition, UploadedFile, UploadedSOW, UploadedXlsx, XlsxJob
+from .nee import store_nee_positions
+from .rematch import rematch
+from .resumes import candidate_fields, extract_resume_data
+from .vectors import assign_vectors, position_match_text
+
+logger = logging.getLogger(__name__)
+
+# job kind -> function that does the work, filled in by the @task decorator below
+_tasks = {}
+
+
+def task(kind: str):
+    """
+    Registers a function as the handler for a kind of BackgroundJob.
+
+    The function is called with the job and the job's payload as keyword arguments. It may run more than once for the
+    same job (after a failure or a worker dying half way through) so it should be safe to repeat.
+    """
+    def register(function):
+        _tasks[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind: str, user=None, **payload) -> BackgroundJob:
+    """
+    Adds a job to the database backed queue, a `manage.py run_jobs` worker picks it up once the transaction commits.
+
+    With settings.BACKGROUND_JOBS_EAGER the job runs once, in this process, right after the commit instead, which is
+    handy for tests and for running the site without a worker.
+
+    Args:
+        kind (str): The registered task to run, such as 'score_positions'.
+        user (User): Who asked for the job, they (and staff) can follow it on BackgroundJobStatusView. Anonymous users
+            are the same as nobody.
+        **payload: JSON serialisable keyword arguments for the task.
+
+    Returns:
+        BackgroundJob: The queued job, its status can be looked up while it runs.
+
+    Example:
+        job = enqueue('score_candidates', candidate_ids=[candidate.pk])
+    """
+    if kind not in _tasks:
+        raise ValueError(f"Unknown background job kind: {kind}")
+
+    # nothing comes back for an eager job that failed, so it only gets the one go
+    max_attempts = 1 if settings.BACKGROUND_JOBS_EAGER else settings.BACKGROUND_JOB_MAX_ATTEMPTS
+    user = user if user is not None and user.is_authenticated else None
+    job = BackgroundJob.objects.create(kind=kind, payload=payload, user=user, max_attempts=max_attempts)
+    if settings.BACKGROUND_JOBS_EAGER:
+        transaction.on_commit(lambda: _run_eagerly(job.pk))
+    return job
+
+
+def enqueue_on_commit(kind: str, ids_argument: str, item_id: int):
+    """
+    Queues a job for item_id once the current transaction commits. Every id added for the same kind of job before the
+    commit goes into one job, so saving a whole SOW inside transaction.atomic() rescores it with one job, not one each.
+
+    Args:
+        kind (str): The registered task to run, such as 'score_positions'.
+        ids_argument (str): The payload argument the task takes the list of ids as, such as 'position_ids'.
+        item_id (int): The id to add.
+
+    Example:
+        enqueue_on_commit('score_candidates', 'candidate_ids', candidate.pk)
+    """
+    # one job per kind for the whole transaction, nothing is queued if it rolls back, see commit_batches.py
+    add_on_commit(('enqueue', kind, ids_argument), item_id, lambda item_ids: enqueue(kind, **{ids_argument: sorted(set(item_ids))}))
+
+
+def claim_job(worker: str, job_ids: list = None) -> BackgroundJob:
+    """
+    Takes the next job off the queue for this worker, or returns None when there is nothing to do.
+
+    A job is up for grabs when it is queued and due, or when it is running but the worker that had it let its claim
+    run out (it died, or hung past settings.BACKGROUND_JOB_VISIBILITY_TIMEOUT). The claim itself is a conditional
+    UPDATE so two workers can never both win the same job, no row locking needed (SQLite does not have any).
+
+    Args:
+        worker (str): A name for the worker, stored on the job while it runs.
+        job_ids (list): Only consider these jobs, None considers the whole queue.
+
+    Returns:
+        BackgroundJob: The claimed job, already marked as running.
+    """
+    now = timezone.now()
+    due = BackgroundJob.objects.filter(
+        Q(status=BackgroundJob.QUEUED, available_at__lte=now) | Q(status=BackgroundJob.RUNNING, locked_until__lt=now)
+    ).order_by('available_at', 'pk')
+    if job_ids is not None:
+        due = due.filter(pk__in=job_ids)
+
+    for job in due[:20]:
+        # only the worker whose UPDATE still sees the job the way we read it gets it
+        unchanged = BackgroundJob.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts, locked_until=job.locked_until)
+
+        if job.attempts >= job.max_attempts:
+            # a worker gave up on this one half way through its last attempt
+            unchanged.update(status=BackgroundJob.FAILED, error=job.error or "Timed out", locked_by='', locked_until=None, finished_at=now)
+            continue
+
+        claimed = unchanged.update(
+            status=BackgroundJob.RUNNING,
+            attempts=F('attempts') + 1,
+            locked_by=worker,
+            locked_until=now + timedelta(seconds=settings.BACKGROUND_JOB_VISIBILITY_TIMEOUT),
+            started_at=now,
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job: BackgroundJob) -> str:
+    """
+    Runs a claimed job and records how it went: done, queued again for a retry, or failed for good.
+
+    Failed attempts are retried after settings.BACKGROUND_JOB_RETRY_DELAY seconds, doubling every time.
+
+    Returns:
+        str: The status the job ended up with.
+    """
+    mine = BackgroundJob.objects.filter(pk=job.pk, locked_by=job.locked_by, attempts=job.attempts)
+    started = time.monotonic()
+    try:
+        _tasks[job.kind](job, **job.payload)
+    except Exception:
+        logger.exception("Background job %s (%s) failed on attempt %s of %s", job.pk, job.kind, job.attempts, job.max_attempts)
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            retry_delay = settings.BACKGROUND_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            status = BackgroundJob.QUEUED
+            mine.update(status=status, error=error, locked_by='', locked_until=None, available_at=timezone.now() + timedelta(seconds=retry_delay))
+        else:
+            status = BackgroundJob.FAILED
+            mine.update(status=status, error=error, locked_by='', locked_until=None, finished_at=timezone.now())
+    else:
+        status = BackgroundJob.DONE
+        mine.update(status=status, error='', locked_by='', locked_until=None, finished_at=timezone.now())
+        logger.info("Background job %s (%s) done in %.1fs", job.pk, job.kind, time.monotonic() - started)
+
+    job.refresh_from_db()
+    return status
+
+
+def report_progress(job: BackgroundJob, progress: int, total: int):
+    """
+    Records how far along the job is. This also extends the worker's claim on the job, so long jobs should call it
+    more often than every settings.BACKGROUND_JOB_VISIBILITY_TIMEOUT seconds.
+    """
+    job.progress = progress
+    job.total = total
+    job.locked_until = timezone.now() + timedelta(seconds=settings.BACKGROUND_JOB_VISIBILITY_TIMEOUT)
+    BackgroundJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(progress=progress, total=total, locked_until=job.locked_until)
+
+
+def work(worker: str = None, burst: bool = False, poll_interval: float = None) -> int:
+    """
+    The worker loop behind `manage.py run_jobs`: claims and runs jobs until told to stop.
+
+    SIGTERM or Ctrl+C stops the worker once the job it is running finishes.
+
+    Args:
+        worker (str): A name for the worker, defaults to host:pid.
+        burst (bool): Stop as soon as the queue is empty instead of waiting for more jobs.
+        poll_interval (float): Seconds to wait between looks at an empty queue, defaults to settings.BACKGROUND_JOB_POLL_INTERVAL.
+
+    Returns:
+        int: How many jobs this worker ran.
+    """
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    poll_interval = poll_interval or settings.BACKGROUND_JOB_POLL_INTERVAL
+    stopping = []
+
+    def stop(signum, frame):
+        logger.info("Worker %s stopping after its current job", worker)
+        stopping.append(signum)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, stop)
+
+    ran = 0
+    while not stopping:
+        close_old_connections()
+        job = claim_job(worker)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        logger.info("Worker %s running job %s (%s), attempt %s", worker, job.pk, job.kind, job.attempts)
+        run_job(job)
+        ran += 1
+    close_old_connections()
+    return ran
+
+
+def _run_eagerly(job_id):
+    job = claim_job('eager', job_ids=[job_id])
+    if job is not None:
+        run_job(job)
+
+
+@task('score_positions')
+def score_positions(job, position_ids: list):
+    """
+    Scores new or changed SOW positions against every candidate so their match pages load from a warm cache.
+    """
+    positions = list(SOWPosition.objects.filter(pk__in=position_ids))
+    candidates = list(Candidate.objects.all())
+    chunk_size = settings.BACKGROUND_JOB_CHUNK_SIZE
+    for start in range(0, len(candidates), chunk_size):
+        MatchMatrix(candidates[start:start + chunk_size], positions, cached=True)
+        report_progress(job, min(start + chunk_size, len(candidates)), len(candidates))
+
+
+@task('score_candidates')
+def score_candidates(job, candidate_ids: list):
+    """
+    Scores new or changed candidates against every open position so their match pages load from a warm cache.
+    """
+    candidates = list(Candidate.objects.filter(pk__in=candidate_ids))
+    positions = list(open_sow_positions())
+    chunk_size = settings.BACKGROUND_JOB_CHUNK_SIZE
+    for start in range(0, len(positions), chunk_size):
+        MatchMatrix(candidates, positions[start:start + chunk_size], cached=True)
+        report_progress(job, min(start + chunk_size, len(positions)), len(positions))
+
+
+@task('rematch')
+def rematch_all(job, workers: int = None):
+    """
+    Scores every candidate against every open position on a pool of processes, see rematch.py.
+    """
+    rematch(workers=workers, progress=lambda done, total: report_progress(job, done, total))
+
+
+@task('fit_lexical_model')
+def fit_lexical_models(job, force: bool = False):
+    """
+    Fits the lexical models the settings use over the current candidates and positions, see lexical.fit_lexical_model.
+    A model whose corpus has not drifted by more than settings.LEXICAL_REFIT_DRIFT is left alone unless forced.
+    """
+    weightings = lexical_weightings()
+    for done, weighting in enumerate(weightings, 1):
+        fit_lexical_model(weighting, force=force)
+        report_progress(job, done, len(weightings))
+
+
+@task('parse_resume')
+def parse_resume(job, uploaded_file_id: int, user_id: int, is_own_resume: bool, name: str, education: str, years_of_experience: int):
+    """
+    Parses an uploaded resume with pyresparser and makes (or updates) the Candidate for it, see ResumeView.
+
+    The form fields fill in whatever the parser could not find, and the name from the form always wins.
+    """
+    uploaded_file = UploadedFile.objects.get(pk=uploaded_file_id)
+    user = User.objects.get(pk=user_id)
+
+    # the same resume uploaded before is not parsed again, see resumes.py
+    data = extract_resume_data(uploaded_file)
+    report_progress(job, 1, 2)
+
+    fields = candidate_fields(data, name, education, years_of_experience)
+    fields['resume'] = uploaded_file
+
+    candidate = Candidate.objects.filter(user=user).first()
+    if candidate is None:
+        # if the user has no candidate then make one for the user
+        candidate = Candidate.objects.create(user=user, **fields)
+    elif is_own_resume:
+        # re-upload of the user's own resume, just update their candidate
+        for field, value in fields.items():
+            setattr(candidate, field, value)
+        candidate.save()
+    else:
+        # resume uploaded on another persons behalf
+        candidate = Candidate.objects.create(**fields)
+
+    # saving the candidate queued the scoring of their matches, see signals.py
+    report_progress(job, 2, 2)
+
+
+@task('parse_resumes')
+def parse_resumes(job, files: list, education: str = '', years_of_experience: int = 0, workers: int = None):
+    """
+    Unpacks a bulk resume upload into UploadedFiles, parses them on a pool of processes and makes a Candidate for every
+    resume, see BulkResumeView and bulk_resumes.py. The per file summary (and how many were created, existing, failed
+    or skipped) ends up in job.result, the uploaded files are removed once it is done.
+    """
+    uploads, skipped = unpack_uploads(files)
+    summary = import_resumes(
+        uploads, education, years_of_experience, workers,
+        progress=lambda done, total: report_progress(job, done, total),
+    ) + skipped
+    counts = Counter(entry['status'] for entry in summary)
+    job.result = {status: counts[status] for status in ('created', 'existing', 'failed', 'skipped')}
+    job.result['files'] = summary
+    BackgroundJob.objects.filter(pk=job.pk).update(result=job.result)
+    remove_uploads(files)
+
+
+@task('parse_sow')
+def parse_sow(job, uploaded_sow_id: int):
+    """
+    Pulls the positions out of an uploaded SOW (pdf or docx) and creates or updates a SOWPosition for each, see
+    SOWSubmissionView. The upload is only kept if it brought in a position we did not have before.
+    """
+    # imported here because views imports this module to enqueue jobs
+    from .views import parse_tables_and_position_descs_pdf, parse_tables_and_position_descs_word
+
+    uploaded_sow_file = UploadedSOW.objects.get(pk=uploaded_sow_id)
+    sow_path = uploaded_sow_file.file.path
+    if "pdf" in uploaded_sow_file.file.name:
+        positions = parse_tables_and_position_descs_pdf(sow_path)
+    else:
+        positions = parse_tables_and_position_descs_word(sow_path)
+    report_progress(job, 0, len(positions))
+
+    new_positions = 0
+    sow_positions = []
+    for position in positions:
+        fields = {
+            'tonum': position['Task Order Number'],
+            'location': position['Location'],
+            'posdescnum': position['Position Description'][0],
+            'posdesctitle': position['Position Description'][1],
+            'posdesc': position['Position Description'][2],
+            'level': position['Skill Level'],
+            'service_cat': position['Service Category'],
+            'job_title': position['Job Title'],
+        }
+        try:
+            sow_pos = SOWPosition.objects.get(pos_id=position['Position ID'], posnum=position['Position Number'])
+            for field, value in fields.items():
+                setattr(sow_pos, field, value)
+        except SOWPosition.DoesNotExist:
+            sow_pos = SOWPosition(pos_id=position['Position ID'], posnum=position['Position Number'], **fields)
+            new_positions += 1
+        sow_positions.append(sow_pos)
+
+    # vectorise every new or changed description in one nlp.pipe batch instead of one at a time in pre_save
+    assign_vectors(sow_positions, position_match_text)
+    # one transaction so the new and changed positions are rescored by a single job once they are saved (signals.py).
+    # The progress is reported after it, inside it nobody else would see it (or the longer claim) until the commit
+    with transaction.atomic():
+        for sow_pos in sow_positions:
+            sow_pos.save()
+    report_progress(job, len(sow_positions), len(sow_positions))
+
+    if not new_positions:
+        uploaded_sow_file.file.delete(save=False)
+        uploaded_sow_file.delete()
+
+
+@task('parse_xlsx')
+def parse_xlsx(job, uploaded_xlsx_id: int):
+    """
+    Reads the positions out of an uploaded NEE xlsx and stores the ones we have not seen before, see
+    XlsxSubmissionView and store_nee_positions. How many rows were inserted, unchanged or changed ends up in
+    job.result. The upload is only kept if at least one row was new.
+    """
+    # imported here because views imports this module to enqueue jobs
+    from .views import extract_positions_from_excel
+
+    uploaded_xlsx_file = UploadedXlsx.objects.get(pk=uploaded_xlsx_id)
+    positions = extract_positions_from_excel(uploaded_xlsx_file.file.path)
+    report_progress(job, 0, len(positions))
+
+    job.result, new_jobs = store_nee_positions(positions)
+    BackgroundJob.objects.filter(pk=job.pk).update(result=job.result)
+    report_progress(job, len(positions), len(positions))
+
+    if not new_jobs:
+        uploaded_xlsx_file.file.delete(save=False)
+        uploaded_xlsx_file.delete()
+
+    # positions that just opened up have not been scored against the candidates yet
+    opened = [xlsx_job.pk for xlsx_job in new_jobs if xlsx_job.open_or_closed == 'open']
+    opened_positions = set(XlsxJob.sow_positions.through.objects.filter(xlsxjob__in=opened).values_list('sowposition_id', flat=True))
+    if opened_positions:
+        enqueue('score_positions', position_ids=sorted(opened_positions))
@@ -1,18 +1,71 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from unittest.mock import patch
 from django.contrib.auth.models import Group, User
 from django.urls import reverse
 from django.shortcuts import redirect, render
-from .models import Candidate, Skill, JobSubmission, XlsxJob, SOWPosition, UploadedSOW, UploadedXlsx
-from .views import calculate_score, redirect_to_landing_page, reorganize_dict, extract_positions_from_excel, parse_tables_and_position_descs_word, compute_similarity_percentage, get_candidate_for_position, get_open_positions_for_candidate
+from .models import Candidate, UploadedFile, Skill, JobSubmission, XlsxJob, SOWPosition, UploadedSOW, UploadedXlsx, SimilarityScoreMatcher, BackgroundJob, SkillPosting, PreprocessedText
+from . import language_models
+from .ann_index import VectorIndex, get_index, index_vector, index_path, log_path, unindex, unindexed_ids
+from .lexical import LexicalModel, fit_lexical_model, get_lexical_model
+from .match_cache import data_version
+from .rematch import rematch, precompute_matches
+from .bulk_resumes import import_resumes, store_uploads, unpack_uploads
+from . import resumes
+from .resumes import extract_resume_data
+from .score_pool import score_chunks, score_matrices
+from .async_matching import ascore
+from asgiref.sync import async_to_sync
+from .snapshots import get_snapshot, write_snapshot, snapshot_path
+from .retrieval import shortlist_positions, shortlist_candidates, measure_recall
+from .skill_index import skill_postings, having_all_skills, rank_by_skill_overlap, position_skills, rebuild_skill_index
+from django.core.exceptions import ImproperlyConfigured
+from .matching import MatchMatrix, top_k, open_sow_positions, scoring_key
+from .preprocessing import preprocess_text, preprocess_texts, preprocessing_cache_stats, clear_preprocessing_cache
+from . import preprocessing
+from .tasks import enqueue, enqueue_on_commit, claim_job, run_job
+from django.core.management import call_command
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from datetime import datetime, timedelta
+from django.utils import timezone
+import io
+from .vectors import candidate_vector, candidate_vectors, position_vector, cosine_percentage, vector_from_bytes, assign_vectors, position_match_text
+from .nee import store_nee_positions
+from .views import calculate_score, redirect_to_landing_page, extract_positions_from_excel, parse_tables_and_position_descs_word, compute_similarity_percentage, get_candidate_for_position, get_open_positions_for_candidate, aget_candidate_for_position, aget_open_positions_for_candidate
 
 from pyresparser import ResumeParser
 from docx import Document
 import spacy
 from spacy.lang.en.stop_words import STOP_WORDS
 import pandas as pd
+import numpy as np
+import os
+import json
 import re
+import tempfile
+import hashlib
+import pickle
+import zipfile
+import openpyxl
+import threading
+import multiprocessing
+import unittest
+import time
 nlp = spacy.load('en_core_web_sm')
 
+def create_position(posnum=None, posdesc=None, open_or_closed='open', tonum='1'):
+    """
+    A SOWPosition plus the XlsxJob row that marks it open (or closed) on the NEE sheet, numbered after the positions
+    there are already when no posnum is given.
+    """
+    posnum = str(posnum or SOWPosition.objects.count() + 1)
+    position = SOWPosition.objects.create(tonum=tonum, pos_id='POSID' + posnum, posnum=posnum, posdesc=posdesc or f'Python engineer {posnum}')
+    XlsxJob.objects.create(tonum=tonum, posnum=posnum, open_or_closed=open_or_closed)
+    return position
+
 class CandidateModelTestCase(TestCase):
     def setUp(self):
         self.candidate = Candidate.objects.create(
@@ -90,6 +143,7 @@ class JobSubmissionModelTestCase(TestCase):
 class ViewsTestCase(TestCase):
     def setUp(self):
         self.client = Client()
+        caches['matches'].clear()
 
         # Create a user for testing authentication
         self.user = User.objects.create_user(username='testuser', password='testpassword')
@@ -207,5 +261,1172 @@ class AdditionalViewsTestCase(TestCase):
             education='Education1',
         )
 
+class LanguageModelRegistryTestCase(TestCase):
+    def tearDown(self):
+        language_models._models.pop('test_model', None)
+        language_models._model_stats.pop('test_model', None)
+
+    def test_model_is_only_loaded_once(self):
+        with patch('parsonsjobbot.language_models.spacy.load', return_value=object()) as spacy_load:
+            first = language_models.get_model('test_model')
+            second = language_models.get_model('test_model')
+
+        spacy_load.assert_called_once_with('test_model')
+        self.assertIs(first, second)
+        self.assertIn('load_seconds', language_models.model_stats()['test_model'])
+
+class DocumentVectorStoreTestCase(TestCase):
+    def setUp(self):
+        self.candidate = Candidate.objects.create(
+            name="Jane Doe",
+            skills="Python, Django, SQL",
+            years_of_experience=4,
+            education="Bachelor of Science",
+        )
+        self.sow_position = SOWPosition.objects.create(
+            tonum='1',
+            pos_id='POSID1',
+            posnum='1',
+            posdesc='Software engineer building Python and SQL databases',
+        )
+
+    def test_vectors_are_written_on_save(self):
+        self.assertIsNotNone(self.candidate.vector)
+        self.assertIsNotNone(self.sow_position.vector)
+
+    def test_unchanged_text_is_not_revectorised(self):
+        with patch('parsonsjobbot.vectors.document_vectors') as document_vectors:
+            self.candidate.years_of_experience = 5
+            self.candidate.save()
+        document_vectors.assert_not_called()
+
+    def test_edited_text_is_revectorised(self):
+        old_vector = vector_from_bytes(self.candidate.vector)
+        self.candidate.skills = "Java"
+        self.candidate.save()
+        self.candidate.refresh_from_db()
+        self.assertFalse((vector_from_bytes(self.candidate.vector) == old_vector).all())
+
+    def test_loaddata_leaves_the_rows_alone(self):
+        fixture = [
+            {'model': 'parsonsjobbot.candidate', 'pk': 100, 'fields': {'name': "John Doe", 'skills': "Java", 'years_of_experience': 2, 'education': "Master of Science"}},
+            {'model': 'parsonsjobbot.sowposition', 'pk': 100, 'fields': {'tonum': '2', 'pos_id': 'POSID2', 'posnum': '1', 'posdesc': 'Java developer'}},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rows.json')
+            with open(path, 'w') as fixture_file:
+                json.dump(fixture, fixture_file)
+            with patch('parsonsjobbot.vectors.document_vectors') as document_vectors, patch('parsonsjobbot.signals.index_on_commit') as index_on_commit:
+                with self.captureOnCommitCallbacks(execute=True):
+                    call_command('loaddata', path, verbosity=0)
+        document_vectors.assert_not_called()
+        index_on_commit.assert_not_called()
+        self.assertFalse(BackgroundJob.objects.exists())
+        self.assertFalse(SkillPosting.objects.filter(object_id=100).exists())
+        self.assertIsNone(Candidate.objects.get(pk=100).vector)
+
+    def test_stored_vectors_match_compute_similarity_percentage(self):
+        stored_score = cosine_percentage(candidate_vector(self.candidate), position_vector(self.sow_position))
+        live_score = compute_similarity_percentage("Python, Django, SQL, Bachelor of Science", self.sow_position.posdesc)
+        self.assertAlmostEqual(stored_score, live_score, places=3)
+
+class MatchEngineTestCase(TestCase):
+    def setUp(self):
+        self.candidates = [
+            Candidate.objects.create(name="Python Dev", skills="Python, Django, SQL", years_of_experience=3, education="Bachelor of Science"),
+            Candidate.objects.create(name="Java Dev", skills="Java, Cloud, AWS", years_of_experience=6, education="Master Degree"),
+        ]
+        self.positions = [create_position(1, 'Python and SQL software engineer'), create_position(2, 'AWS cloud network security')]
+
+    def test_top_k_returns_best_first(self):
+        scores = [[10.0, 80.0, 40.0, 60.0]]
+        self.assertEqual(top_k(scores, 2).tolist(), [[1, 3]])
+        self.assertEqual(top_k(scores).tolist(), [[1, 3, 2, 0]])
+
+    def test_matrix_matches_pairwise_scores(self):
+        match = MatchMatrix(self.candidates, self.positions)
+        for row, candidate in enumerate(self.candidates):
+            for column, position in enumerate(self.positions):
+                pairwise = compute_similarity_percentage(candidate.skills + ', ' + candidate.education, position.posdesc)
+                self.assertAlmostEqual(float(match.scores[row, column]), pairwise, places=3)
+
+    def test_views_helpers_are_sorted_and_limited(self):
+        matched_jobs = get_open_positions_for_candidate(self.candidates[0])
+        self.assertEqual(len(matched_jobs), 2)
+        self.assertGreaterEqual(matched_jobs[0][1], matched_jobs[1][1])
+
+        matched_candidates = get_candidate_for_position(self.positions[1], k=1)
+        self.assertEqual(len(matched_candidates), 1)
+
+    def test_no_open_positions(self):
+        XlsxJob.objects.all().delete()
+        self.assertEqual(get_open_positions_for_candidate(self.candidates[0]), [])
+
+class BatchPreprocessingTestCase(TestCase):
+    def test_batch_matches_single_text_in_order(self):
+        texts = ["Python, Django, SQL", "Engineers building databases.", "", "Cloud network security"]
+        self.assertEqual(preprocess_texts(texts, batch_size=2), [preprocess_text(text) for text in texts])
+
+    def test_assign_vectors_only_touches_stale_instances(self):
+        sow_position = SOWPosition.objects.create(tonum='1', pos_id='POSID1', posnum='1', posdesc='Python engineer')
+        new_position = SOWPosition(tonum='1', pos_id='POSID2', posnum='2', posdesc='SQL databases')
+        self.assertEqual(assign_vectors([sow_position, new_position], position_match_text), [new_position])
+        with patch('parsonsjobbot.vectors.document_vectors') as document_vectors:
+            new_position.save()
+        document_vectors.assert_not_called()
+
+class SimilarityScoreCacheTestCase(TestCase):
+    def setUp(self):
+        self.sow_position = create_position(1, 'Python and SQL engineer')
+        self.first = Candidate.objects.create(name="Sam Smith", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+        self.second = Candidate.objects.create(name="Sam Smith", skills="Java", years_of_experience=3, education="Master Degree")
+
+    def test_candidates_with_the_same_name_do_not_share_scores(self):
+        get_open_positions_for_candidate(self.first)
+        get_open_positions_for_candidate(self.second)
+        self.assertEqual(SimilarityScoreMatcher.objects.count(), 2)
+        self.assertEqual(SimilarityScoreMatcher.objects.filter(candidate=self.second).count(), 1)
+
+    def test_cached_score_is_reused(self):
+        get_candidate_for_position(self.sow_position)
+        SimilarityScoreMatcher.objects.filter(candidate=self.first).update(similarity_score=12.5)
+        matched_candidates = dict(get_candidate_for_position(self.sow_position))
+        self.assertEqual(matched_candidates[self.first], 12.5)
+        self.assertEqual(SimilarityScoreMatcher.objects.count(), 2)
+
+class BulkScoreCacheTestCase(TestCase):
+    def setUp(self):
+        self.candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+
+    def count_match_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            get_open_positions_for_candidate(self.candidate)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_positions(self):
+        for _ in range(2):
+            create_position()
+        few_positions = self.count_match_queries()
+        SimilarityScoreMatcher.objects.all().delete()
+        for _ in range(8):
+            create_position()
+        self.assertEqual(self.count_match_queries(), few_positions)
+        self.assertEqual(SimilarityScoreMatcher.objects.count(), 10)
+
+    def test_warm_cache_does_not_write(self):
+        for _ in range(3):
+            create_position()
+        get_open_positions_for_candidate(self.candidate)
+        with CaptureQueriesContext(connection) as queries:
+            get_open_positions_for_candidate(self.candidate)
+        self.assertFalse([query for query in queries if query['sql'].startswith('INSERT')])
+
+class VectorIndexTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((200, 16)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.index = VectorIndex(16, tables=8, bits=4)
+        self.index.add_many(list(range(200)), self.vectors)
+
+    def test_nearest_neighbour_is_found(self):
+        nearest = self.index.query(self.vectors[7], 5)
+        self.assertEqual(nearest[0][0], 7)
+        self.assertAlmostEqual(nearest[0][1], 1.0, places=5)
+
+    def test_remove_and_allowed_ids(self):
+        self.index.remove(7)
+        self.assertNotIn(7, [item_id for item_id, _ in self.index.query(self.vectors[7], 5)])
+        self.assertEqual({item_id for item_id, _ in self.index.query(self.vectors[7], 5, allowed_ids={1, 2})}, {1, 2})
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            self.index.save(path)
+            loaded = VectorIndex.load(path)
+        self.assertEqual(len(loaded), 200)
+        self.assertEqual(loaded.query(self.vectors[3], 3), self.index.query(self.vectors[3], 3))
+
+    def test_views_helper_uses_index_shortlist(self):
+        candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+        for posnum in [1, 2, 3]:
+            create_position(posnum)
+        with tempfile.TemporaryDirectory() as directory, self.settings(MATCH_INDEX_ROOT=directory):
+            matched_jobs = get_open_positions_for_candidate(candidate, k=2)
+            self.assertTrue(os.path.exists(os.path.join(directory, 'positions.npz')))
+        self.assertEqual(len(matched_jobs), 2)
+
+    def test_log_is_folded_into_the_index_file(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(MATCH_INDEX_ROOT=directory, MATCH_INDEX_COMPACT_RATIO=2):
+            get_index('candidates')
+            for item_id in range(20):
+                index_vector('candidates', item_id, self.vectors[item_id], str(item_id))
+            unindex('candidates', 3)
+            # the file was written again along the way and the rows since are in the log, which never grows past
+            # twice the file
+            self.assertGreater(len(VectorIndex.load(index_path('candidates'))), 0)
+            self.assertGreater(os.path.getsize(log_path('candidates')), 0)
+            self.assertLessEqual(os.path.getsize(log_path('candidates')), 2 * os.path.getsize(index_path('candidates')))
+            # a fresh process reads the same index
+            with patch.dict('parsonsjobbot.ann_index._indexes', clear=True):
+                index = get_index('candidates')
+        self.assertEqual(len(index), 19)
+        self.assertNotIn(3, index)
+        self.assertEqual(index.query(self.vectors[7], 1)[0][0], 7)
+
+    def test_changes_never_touch_an_index_being_queried(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(MATCH_INDEX_ROOT=directory):
+            index_vector('candidates', 1, self.vectors[1], 'a')
+            loaded = get_index('candidates')
+            index_vector('candidates', 2, self.vectors[2], 'b')
+            unindex('candidates', 1)
+            current = get_index('candidates')
+        self.assertEqual((list(loaded._vectors), list(current._vectors)), ([1], [2]))
+        self.assertEqual(loaded.query(self.vectors[1], 1)[0][0], 1)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "needs fork")
+    def test_interleaved_index_writers_keep_each_others_rows(self):
+        def add_rows(first_id):
+            for item_id in range(first_id, first_id + 20):
+                index_vector('candidates', item_id, self.vectors[item_id % 200], str(item_id))
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(MATCH_INDEX_ROOT=directory):
+            get_index('candidates')
+            # two processes (web and run_jobs workers, say) loading, changing and saving the same file at once
+            writers = [multiprocessing.get_context('fork').Process(target=add_rows, args=(first_id,)) for first_id in (1000, 2000)]
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+            index = get_index('candidates')
+        self.assertEqual(len(index), 40)
+
+    def test_index_is_logged_once_per_transaction_and_stale_rows_are_shortlisted(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(MATCH_INDEX_ROOT=directory, MATCH_INDEX_COMPACT_RATIO=100):
+            get_index('positions')
+            with patch.object(VectorIndex, 'save', autospec=True) as save, self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for posnum in [1, 2, 3]:
+                        create_position(posnum)
+            # appended to the log as one record, the index file is left alone
+            save.assert_not_called()
+            with open(log_path('positions'), 'rb') as log_file:
+                self.assertEqual(len(pickle.load(log_file)), 3)
+                self.assertEqual(log_file.read(), b'')
+            self.assertEqual(len(get_index('positions')), 3)
+
+            # saved, but the index file has not caught up yet
+            position = create_position(4, 'Java developer')
+            candidate = Candidate.objects.create(name="Jane Doe", skills="Python", years_of_experience=3, education="Bachelor of Science")
+            shortlist = shortlist_positions(candidate, open_sow_positions(), 1, retriever='ann')
+        self.assertIn(position, shortlist)
+
+    def test_rows_that_failed_to_go_in_stay_unindexed(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(MATCH_INDEX_ROOT=directory):
+            get_index('positions')
+            with patch('parsonsjobbot.ann_index._update_index', side_effect=OSError), self.assertLogs('django.test', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    position = create_position(1)
+            self.assertEqual(unindexed_ids('positions'), {position.pk})
+            # the next change to the row gets it in
+            position.posdesc = 'Java developer'
+            with self.captureOnCommitCallbacks(execute=True):
+                position.save()
+            self.assertEqual(unindexed_ids('positions'), set())
+            self.assertIn(position.pk, get_index('positions'))
+
+class BackgroundJobTestCase(TestCase):
+    def setUp(self):
+        self.candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+        self.sow_position = create_position(1, 'Python and SQL engineer')
+        self.index_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.index_directory.cleanup)
+
+    def run_on_commit(self, function, *args, **kwargs):
+        with self.settings(BACKGROUND_JOBS_EAGER=True, MATCH_INDEX_ROOT=self.index_directory.name):
+            with self.captureOnCommitCallbacks(execute=True):
+                return function(*args, **kwargs)
+
+    def test_score_positions_warms_the_cache(self):
+        job = self.run_on_commit(enqueue, 'score_positions', position_ids=[self.sow_position.pk])
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        self.assertEqual((job.progress, job.total), (1, 1))
+        self.assertEqual(SimilarityScoreMatcher.objects.filter(candidate=self.candidate).count(), 1)
+
+    def test_job_waits_for_commit_and_reports_status(self):
+        user = User.objects.create_user(username='ta', password='testpassword')
+        job = enqueue('score_candidates', user=user, candidate_ids=[self.candidate.pk])
+        self.client.login(username='ta', password='testpassword')
+        response = self.client.get(reverse('parsonsjobbot:background-job-status', args=[job.pk]))
+        self.assertEqual(response.json()['status'], BackgroundJob.QUEUED)
+        self.assertFalse(SimilarityScoreMatcher.objects.exists())
+
+    def test_job_status_is_only_shown_to_its_user_and_staff(self):
+        owner = User.objects.create_user(username='owner', password='testpassword')
+        User.objects.create_user(username='other', password='testpassword')
+        User.objects.create_user(username='staff', password='testpassword', is_staff=True)
+        with self.assertLogs('parsonsjobbot.tasks', 'ERROR'):
+            job = self.run_on_commit(enqueue, 'score_candidates', user=owner, candidate_ids='not a list')
+        url = reverse('parsonsjobbot:background-job-status', args=[job.pk])
+
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.login(username='other', password='testpassword')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        for username in ['owner', 'staff']:
+            self.client.login(username=username, password='testpassword')
+            error = self.client.get(url).json()['error']
+            self.assertTrue(error.startswith('ValueError'))
+            self.assertNotIn('Traceback', error)
+
+    def test_failed_job_records_error(self):
+        with self.assertLogs('parsonsjobbot.tasks', 'ERROR'):
+            job = self.run_on_commit(enqueue, 'score_candidates', candidate_ids='not a list')
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.FAILED)
+        self.assertIn('Traceback', job.error)
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            enqueue('does_not_exist')
+
+class JobQueueTestCase(TestCase):
+    def setUp(self):
+        self.candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+
+    def test_failed_job_is_retried_later(self):
+        job = enqueue('score_candidates', candidate_ids='not a list')
+        claimed = claim_job('worker-1')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(claim_job('worker-2'))
+        with self.assertLogs('parsonsjobbot.tasks', 'ERROR'):
+            self.assertEqual(run_job(claimed), BackgroundJob.QUEUED)
+        self.assertGreater(claimed.available_at, timezone.now())
+        self.assertIsNone(claim_job('worker-1'))
+
+    def test_job_with_expired_claim_is_taken_over(self):
+        job = enqueue('score_candidates', candidate_ids=[self.candidate.pk])
+        claim_job('worker-1')
+        BackgroundJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        claimed = claim_job('worker-2')
+        self.assertEqual((claimed.locked_by, claimed.attempts), ('worker-2', 2))
+
+    def test_run_jobs_command_works_through_the_queue(self):
+        job = enqueue('score_candidates', candidate_ids=[self.candidate.pk])
+        output = io.StringIO()
+        call_command('run_jobs', workers=1, burst=True, stdout=output)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        self.assertIn("Ran 1 background jobs", output.getvalue())
+
+    def test_sow_upload_returns_before_parsing(self):
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(user)
+        with tempfile.TemporaryDirectory() as directory, self.settings(MEDIA_ROOT=directory):
+            sow = SimpleUploadedFile('big_sow.pdf', b'%PDF-1.4', content_type='application/pdf')
+            with patch('parsonsjobbot.views.parse_tables_and_position_descs_pdf') as parse:
+                self.client.post(reverse('parsonsjobbot:sow-submission'), {'sow': sow})
+            parse.assert_not_called()
+        job = BackgroundJob.objects.get()
+        self.assertEqual((job.kind, job.status), ('parse_sow', BackgroundJob.QUEUED))
+        self.assertEqual(job.payload, {'uploaded_sow_id': UploadedSOW.objects.get().pk})
+
+class EnqueueOnCommitTestCase(TransactionTestCase):
+    def test_one_job_per_kind_and_transaction(self):
+        with transaction.atomic():
+            enqueue_on_commit('score_candidates', 'candidate_ids', 3)
+            enqueue_on_commit('score_positions', 'position_ids', 2)
+            enqueue_on_commit('score_candidates', 'candidate_ids', 1)
+            self.assertFalse(BackgroundJob.objects.exists())
+        payloads = {job.kind: job.payload for job in BackgroundJob.objects.all()}
+        self.assertEqual(payloads, {'score_candidates': {'candidate_ids': [1, 3]}, 'score_positions': {'position_ids': [2]}})
+
+    def test_nothing_is_queued_for_a_rollback(self):
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    enqueue_on_commit('score_candidates', 'candidate_ids', 5)
+                    raise ValueError
+            except ValueError:
+                pass
+            enqueue_on_commit('score_candidates', 'candidate_ids', 6)
+        self.assertEqual([job.payload for job in BackgroundJob.objects.all()], [{'candidate_ids': [6]}])
+
+class SOWUploadTestCase(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+        XlsxJob.objects.create(tonum='1', posnum='1', open_or_closed='open')
+
+    def upload(self, posdesc):
+        position = {
+            'Task Order Number': '1', 'Location': 'WMA-CS', 'Position Description': ('1', 'Engineer', posdesc),
+            'Skill Level': 'Mid', 'Service Category': 'Engineering', 'Job Title': 'Engineer', 'Position ID': 'POSID1', 'Position Number': '1',
+        }
+        with self.settings(BACKGROUND_JOBS_EAGER=True, MEDIA_ROOT=self.media.name, MATCH_INDEX_ROOT=self.media.name):
+            with patch('parsonsjobbot.views.parse_tables_and_position_descs_pdf', return_value=[position]), self.captureOnCommitCallbacks(execute=True):
+                uploaded_sow = UploadedSOW.objects.create(file=SimpleUploadedFile('sow.pdf', b'%PDF-1.4'))
+                enqueue('parse_sow', uploaded_sow_id=uploaded_sow.pk)
+        return SOWPosition.objects.get(pos_id='POSID1')
+
+    def test_changed_description_is_rescored(self):
+        position = self.upload('Python and SQL engineer')
+        old_hash = position.match_hash
+        self.assertTrue(SimilarityScoreMatcher.objects.filter(sow_hash=old_hash).exists())
+
+        BackgroundJob.objects.all().delete()
+        position = self.upload('Java developer')
+        self.assertNotEqual(position.match_hash, old_hash)
+        # the vector was assigned before the save, the save still counts as a change
+        job = BackgroundJob.objects.get(kind='score_positions')
+        self.assertEqual((job.payload, job.status), ({'position_ids': [position.pk]}, BackgroundJob.DONE))
+        self.assertFalse(SimilarityScoreMatcher.objects.filter(sow_hash=old_hash).exists())
+        self.assertTrue(SimilarityScoreMatcher.objects.filter(sow_hash=position.match_hash).exists())
+        self.assertEqual(BackgroundJob.objects.get(kind='parse_sow').progress, 1)
+
+class ScoreInvalidationTestCase(TestCase):
+    def setUp(self):
+        self.index_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.index_directory.cleanup)
+        self.first = self.save_and_rescore(Candidate(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science"))
+        self.second = self.save_and_rescore(Candidate(name="John Doe", skills="Java", years_of_experience=5, education="Master Degree"))
+        self.positions = []
+        for posnum in ['1', '2']:
+            XlsxJob.objects.create(tonum='1', posnum=posnum, open_or_closed='open')
+            self.positions.append(self.save_and_rescore(SOWPosition(tonum='1', pos_id='POSID' + posnum, posnum=posnum, posdesc='Python engineer ' + posnum)))
+        BackgroundJob.objects.all().delete()
+
+    def save_and_rescore(self, instance):
+        with self.settings(BACKGROUND_JOBS_EAGER=True, MATCH_INDEX_ROOT=self.index_directory.name):
+            with self.captureOnCommitCallbacks(execute=True):
+                instance.save()
+        return instance
+
+    def scores(self):
+        return set(SimilarityScoreMatcher.objects.values_list('candidate_id', 'candidate_hash', 'sow_hash'))
+
+    def test_candidate_edit_only_touches_their_row(self):
+        before = self.scores()
+        self.first.skills = "Rust, Go"
+        self.save_and_rescore(self.first)
+        after = self.scores()
+        self.assertEqual({score for score in before if score[0] == self.second.pk}, {score for score in after if score[0] == self.second.pk})
+        self.assertEqual({score[1] for score in after if score[0] == self.first.pk}, {self.first.match_hash})
+        self.assertEqual(len(after), 4)
+        self.assertEqual(BackgroundJob.objects.get().payload, {'candidate_ids': [self.first.pk]})
+
+    def test_position_edit_only_touches_its_column(self):
+        old_hash = self.positions[0].match_hash
+        untouched = SimilarityScoreMatcher.objects.filter(sow_hash=self.positions[1].match_hash).count()
+        self.positions[0].posdesc = 'Java developer'
+        self.save_and_rescore(self.positions[0])
+        self.assertFalse(SimilarityScoreMatcher.objects.filter(sow_hash=old_hash).exists())
+        self.assertEqual(SimilarityScoreMatcher.objects.filter(sow_hash=self.positions[0].match_hash).count(), 2)
+        self.assertEqual(SimilarityScoreMatcher.objects.filter(sow_hash=self.positions[1].match_hash).count(), untouched)
+
+    def test_shared_description_keeps_its_scores(self):
+        twin = SOWPosition.objects.create(tonum='2', pos_id='POSID3', posnum='3', posdesc=self.positions[0].posdesc)
+        old_hash = self.positions[0].match_hash
+        self.positions[0].posdesc = 'Java developer'
+        self.save_and_rescore(self.positions[0])
+        self.assertEqual(twin.match_hash, old_hash)
+        self.assertTrue(SimilarityScoreMatcher.objects.filter(sow_hash=old_hash).exists())
+
+    def test_unrelated_save_keeps_scores(self):
+        before = self.scores()
+        self.first.years_of_experience = 10
+        self.save_and_rescore(self.first)
+        self.assertEqual(self.scores(), before)
+        self.assertFalse(BackgroundJob.objects.exists())
+
+class OpenPositionLinkTestCase(TestCase):
+    def add_positions(self, count, open_or_closed='open'):
+        for _ in range(count):
+            create_position(posdesc='Python engineer', open_or_closed=open_or_closed)
+
+    def test_no_open_positions(self):
+        self.add_positions(2, 'closed')
+        self.assertFalse(open_sow_positions().exists())
+
+    def test_query_stays_the_same_size(self):
+        self.add_positions(2)
+        self.add_positions(1, 'closed')
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(open_sow_positions()), 2)
+        self.add_positions(100)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(open_sow_positions()), 102)
+        self.assertEqual(len(many), 1)
+        self.assertEqual(len(many[0]['sql']), len(few[0]['sql']))
+
+    def test_links_follow_either_side(self):
+        XlsxJob.objects.create(tonum='7', posnum='1', open_or_closed='open')
+        sow_position = SOWPosition.objects.create(tonum='7', pos_id='POSID1', posnum='2', posdesc='Python engineer')
+        self.assertFalse(open_sow_positions().exists())
+        sow_position.posnum = '1'
+        sow_position.save()
+        self.assertEqual(list(open_sow_positions()), [sow_position])
+
+    def test_open_matcher_search_only_shows_open_positions(self):
+        self.add_positions(1)
+        self.add_positions(1, 'closed')
+        response = self.client.get(reverse('parsonsjobbot:xlsx-sow-open'), {'tonum': '1'})
+        self.assertEqual([position.posnum for position in response.context['sow_positions']], ['1'])
+
+class PreprocessingCacheTestCase(TestCase):
+    def setUp(self):
+        clear_preprocessing_cache()
+        self.addCleanup(clear_preprocessing_cache)
+
+    def test_each_text_goes_through_spacy_once(self):
+        texts = ["Python, Django, SQL", "Engineers building databases.", "Python, Django, SQL"]
+        with patch('parsonsjobbot.preprocessing._run_pipeline', wraps=preprocessing._run_pipeline) as run_pipeline:
+            first = preprocess_texts(texts)
+            self.assertEqual(preprocess_texts(texts), first)
+        run_pipeline.assert_called_once()
+        self.assertEqual(run_pipeline.call_args[0][0], texts[:2])
+        self.assertEqual(preprocessing_cache_stats(), {'memory_hits': 3, 'database_hits': 0, 'misses': 2, 'memory_size': 2})
+
+    def test_database_layer_survives_a_restart(self):
+        expected = preprocess_text("Engineers building databases.")
+        clear_preprocessing_cache()
+        with patch('parsonsjobbot.preprocessing._run_pipeline') as run_pipeline:
+            self.assertEqual(preprocess_text("Engineers building databases."), expected)
+        run_pipeline.assert_not_called()
+        self.assertEqual(preprocessing_cache_stats()['database_hits'], 1)
+
+    def test_new_pipeline_version_misses(self):
+        preprocess_text("Cloud network security")
+        with self.settings(NLP_PREPROCESSING_VERSION='2'):
+            preprocess_text("Cloud network security")
+        self.assertEqual(preprocessing_cache_stats()['misses'], 2)
+
+    def test_warm_cache_never_loads_spacy(self):
+        preprocess_text("Cloud network security")
+        clear_preprocessing_cache()
+        with patch('parsonsjobbot.preprocessing.get_preprocessing_model') as get_model:
+            preprocess_text("Cloud network security")
+        get_model.assert_not_called()
+        self.assertEqual(preprocessing_cache_stats()['database_hits'], 1)
+
+    def test_memory_layer_is_bounded(self):
+        with self.settings(NLP_PREPROCESS_CACHE_SIZE=2, NLP_PREPROCESS_CACHE_DATABASE=False):
+            preprocess_texts(["one", "two", "three"])
+            self.assertEqual(preprocessing_cache_stats()['memory_size'], 2)
+
+class LexicalBackendTestCase(TestCase):
+    def test_weightings_score_overlap(self):
+        corpus = ["python sql database", "java spring", "cloud network security", "python machine learning"]
+        for weighting in ['tfidf', 'bm25']:
+            model = LexicalModel(corpus, weighting=weighting)
+            scores = model.similarity(model.transform(["python sql"]), model.transform(corpus))
+            self.assertEqual(int(np.argmax(scores)), 0)
+            self.assertEqual(scores[0, 1], 0)
+            self.assertAlmostEqual(float(model.similarity(model.transform(corpus[:1]), model.transform(corpus[:1]))[0, 0]), 100, places=3)
+
+    def test_bm25_backend_does_not_need_document_vectors(self):
+        with self.settings(SIMILARITY_BACKEND='bm25'), patch('parsonsjobbot.vectors.document_vectors') as document_vectors:
+            candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+            for posnum, posdesc in [(1, 'Java developer'), (2, 'Python and SQL engineer')]:
+                create_position(posnum, posdesc)
+            fit_lexical_model()
+            matched_jobs = get_open_positions_for_candidate(candidate, k=1)
+        document_vectors.assert_not_called()
+        self.assertIsNone(candidate.vector)
+        self.assertEqual(matched_jobs[0][0].posnum, '2')
+        self.assertEqual(set(SimilarityScoreMatcher.objects.values_list('scoring_model', flat=True)), {'bm25'})
+
+    def test_no_model_is_fitted_in_a_request(self):
+        with self.settings(SIMILARITY_BACKEND='bm25'), self.captureOnCommitCallbacks(execute=True):
+            candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+            create_position(1, 'Python and SQL engineer')
+            with self.assertRaises(ImproperlyConfigured):
+                get_open_positions_for_candidate(candidate)
+
+            fingerprint = fit_lexical_model().fingerprint
+            create_position(2, 'Java developer')
+            with patch('parsonsjobbot.lexical.LexicalModel') as lexical_model:
+                get_open_positions_for_candidate(candidate)
+            lexical_model.assert_not_called()
+            self.assertEqual(get_lexical_model().fingerprint, fingerprint)
+        self.assertFalse(BackgroundJob.objects.filter(kind='fit_lexical_model').exists())
+
+    def test_refit_once_the_corpus_has_drifted(self):
+        with self.settings(SIMILARITY_BACKEND='bm25', LEXICAL_REFIT_DRIFT=0.5):
+            Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+            for posnum, posdesc in [(1, 'Python and SQL engineer'), (2, 'Java developer'), (3, 'Data analyst')]:
+                create_position(posnum, posdesc)
+            fingerprint = fit_lexical_model().fingerprint
+
+            # one new text in four is not enough to fit again, even with new words in it
+            create_position(4, 'Cloud network engineer')
+            with patch('parsonsjobbot.lexical.LexicalModel') as lexical_model:
+                call_command('fit_lexical_model', stdout=io.StringIO())
+            lexical_model.assert_not_called()
+            self.assertEqual(get_lexical_model().transform(["cloud network"]).nnz, 0)
+
+            create_position(5, 'Cloud security engineer')
+            create_position(6, 'Network technician')
+            self.assertNotEqual(fit_lexical_model().fingerprint, fingerprint)
+            self.assertEqual(get_lexical_model().transform(["cloud network"]).nnz, 2)
+
+    def test_refit_keeps_the_previous_fits_scores(self):
+        with self.settings(SIMILARITY_BACKEND='bm25'):
+            candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+            keys = []
+            for posnum, posdesc in [(1, 'Python and SQL engineer'), (2, 'Java developer'), (3, 'Data analyst')]:
+                create_position(posnum, posdesc)
+                fit_lexical_model(force=True)
+                get_open_positions_for_candidate(candidate)
+                keys.append(scoring_key())
+            self.assertEqual(len(set(keys)), 3)
+            # the first fit's scores are gone, the one before the current fit is kept for who still has it loaded
+            versions = set(SimilarityScoreMatcher.objects.values_list('scoring_version', flat=True))
+            self.assertEqual(versions, {keys[1][1], keys[2][1]})
+
+    def test_unknown_backend(self):
+        with self.settings(SIMILARITY_BACKEND='word2vec'), self.assertRaises(ImproperlyConfigured):
+            compute_similarity_percentage("Python", "Python")
+
+class SkillIndexTestCase(TestCase):
+    def setUp(self):
+        self.jane = Candidate.objects.create(name="Jane Doe", skills="Python, SQL, Django", years_of_experience=3, education="BS")
+        self.john = Candidate.objects.create(name="John Doe", skills="Python, Java", years_of_experience=5, education="MS")
+        self.ann = Candidate.objects.create(name="Ann Doe", skills="sql", years_of_experience=1, education="BA")
+
+    def test_candidates_are_indexed_on_save(self):
+        self.assertEqual(skill_postings('candidates', ["PYTHON", "sql"]), {
+            'python': sorted([self.jane.pk, self.john.pk]),
+            'sql': sorted([self.jane.pk, self.ann.pk]),
+        })
+        self.john.skills = "Java, SQL"
+        self.john.save()
+        self.assertEqual(having_all_skills('candidates', ["java", "sql"]), [self.john.pk])
+        self.john.delete()
+        self.assertEqual(skill_postings('candidates', ["java"]), {'java': []})
+
+    def test_having_all_skills_reads_no_skills_text(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(having_all_skills('candidates', ["python", "sql"]), [self.jane.pk])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('parsonsjobbot_candidate', queries[0]['sql'])
+        self.assertEqual(having_all_skills('candidates', ["python", "cobol"]), [])
+
+    def test_rank_by_skill_overlap(self):
+        ranked = rank_by_skill_overlap('candidates', ["python", "sql", "django"])
+        self.assertEqual(ranked[0], (self.jane.pk, 3))
+        self.assertEqual({pk for pk, overlap in ranked[1:]}, {self.john.pk, self.ann.pk})
+        self.assertEqual(rank_by_skill_overlap('candidates', ["python", "sql", "django"], limit=1), [(self.jane.pk, 3)])
+
+    def test_positions_and_job_submissions(self):
+        position = SOWPosition.objects.create(tonum='1', pos_id='POSID1', posnum='1', posdesc="Builds Machine Learning services in Python.")
+        self.assertTrue({'machine learning', 'python'} <= position_skills(position))
+        self.assertIn(position.pk, having_all_skills('positions', ["python", "machine learning"]))
+
+        # a new skill name is picked up in position descriptions that already mention it
+        Skill.objects.create(name="Widget Wrangling")
+        position.posdesc = "Widget wrangling and Python"
+        position.save()
+        self.assertEqual(having_all_skills('positions', ["widget wrangling"]), [position.pk])
+
+        job = JobSubmission.objects.create(position_id='1', position_description=1, skill_level=2, job_title='Dev')
+        python, java = Skill.objects.create(name="Python"), Skill.objects.create(name="Java")
+        job.skills.add(python, java)
+        self.assertEqual(having_all_skills('job_submissions', ["python", "java"]), [job.pk])
+        self.assertEqual(calculate_score(self.jane, job), 50)
+        java.jobsubmission_set.clear()
+        self.assertEqual(calculate_score(self.jane, job), 100)
+        python.delete()
+        self.assertEqual(calculate_score(self.jane, job), 0)
+
+    def test_rebuild(self):
+        SkillPosting.objects.all().delete()
+        SkillPosting.objects.create(skill='python', kind='candidates', object_id=999)
+        self.assertEqual(rebuild_skill_index()['candidates'], 3)
+        self.assertEqual(having_all_skills('candidates', ["python"]), sorted([self.jane.pk, self.john.pk]))
+
+    def test_candidate_view_skills_filter(self):
+        user = User.objects.create_user(username='ta', password='testpassword')
+        user.groups.add(Group.objects.create(name='TA'))
+        self.client.login(username='ta', password='testpassword')
+        response = self.client.get(reverse('parsonsjobbot:candidates'), {'skills': 'python, sql'})
+        self.assertEqual(list(response.context['job_rec']), [self.jane])
+
+class RetrievalTestCase(TestCase):
+    def setUp(self):
+        self.jane = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+        self.john = Candidate.objects.create(name="John Doe", skills="Java, Spring", years_of_experience=5, education="Master of Science")
+        descriptions = ['Python and SQL engineer', 'Java developer', 'Python data analyst', 'Network technician']
+        for posnum, posdesc in enumerate(descriptions, start=1):
+            create_position(posnum, posdesc)
+        fit_lexical_model('bm25')
+
+    def test_skills_retriever(self):
+        shortlist = shortlist_positions(self.jane, open_sow_positions(), 5, retriever='skills')
+        self.assertEqual(set(shortlist.values_list('posnum', flat=True)), {'1', '3'})
+        position = SOWPosition.objects.get(posnum='2')
+        self.assertEqual(list(shortlist_candidates(position, 5, retriever='skills')), [self.john])
+
+    def test_lexical_retriever(self):
+        shortlist = shortlist_positions(self.jane, open_sow_positions(), 1, retriever='lexical')
+        self.assertEqual(list(shortlist.values_list('posnum', flat=True)), ['1'])
+
+    def test_lexical_retriever_only_weights_the_query_and_changed_rows(self):
+        model = get_lexical_model('bm25')
+        position = SOWPosition.objects.get(posnum='2')
+        with patch.object(model, 'transform', wraps=model.transform) as transform:
+            self.assertEqual(list(shortlist_candidates(position, 1, retriever='lexical')), [self.john])
+            self.assertEqual([len(call.args[0]) for call in transform.call_args_list], [1])
+
+            sam = Candidate.objects.create(name="Sam Doe", skills="Java developer, Spring", years_of_experience=2, education="Bachelor of Science")
+            transform.reset_mock()
+            self.assertEqual(list(shortlist_candidates(position, 1, retriever='lexical')), [sam])
+        # the new candidate and the query
+        self.assertEqual(sorted(len(call.args[0]) for call in transform.call_args_list), [1, 1])
+
+    def test_views_helper_reranks_the_shortlist(self):
+        with self.settings(MATCH_RETRIEVER='skills'), patch('parsonsjobbot.matching.lexical_similarity_matrix') as lexical:
+            matched_jobs = get_open_positions_for_candidate(self.jane, k=1, n=2)
+        self.assertEqual(matched_jobs[0][0].posnum, '1')
+        self.assertEqual(len(matched_jobs), 1)
+        lexical.assert_not_called()
+
+    def test_lexical_backend_with_skills_retriever(self):
+        with self.settings(SIMILARITY_BACKEND='bm25', MATCH_RETRIEVER='skills'):
+            matched_candidates = get_candidate_for_position(SOWPosition.objects.get(posnum='1'), k=5)
+        self.assertEqual([candidate for candidate, _ in matched_candidates], [self.jane])
+
+    def test_measure_recall(self):
+        with self.settings(SIMILARITY_BACKEND='bm25'):
+            full = measure_recall('positions', retriever=None, n=1, k=2)
+            skills = measure_recall('positions', retriever='skills', n=1, k=2)
+            out = io.StringIO()
+            call_command('measure_recall', '--retriever', 'skills', '--retriever', 'lexical', '--n', '4', '--k', '2', stdout=out)
+        self.assertEqual((full['retriever'], full['recall'], full['queries']), ('full', 1.0, 2))
+        self.assertEqual(skills['recall'], 0.5)
+        self.assertIn('lexical: recall@2 1.000', out.getvalue())
+
+class VectorSnapshotTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = self.settings(MATCH_SNAPSHOT_ROOT=directory.name, MATCH_SNAPSHOT_CHECK_INTERVAL=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.jane = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+        self.john = Candidate.objects.create(name="John Doe", skills="Java", years_of_experience=5, education="Master of Science")
+
+    def test_snapshot_serves_vectors_without_reading_them(self):
+        write_snapshot('candidates')
+        candidates = list(Candidate.objects.defer('vector').order_by('pk'))
+        with CaptureQueriesContext(connection) as queries:
+            vectors = candidate_vectors(candidates)
+        self.assertEqual(len(queries), 0)
+        self.assertTrue(np.allclose(vectors[0], vector_from_bytes(self.jane.vector)))
+        self.assertIsInstance(get_snapshot('candidates').vectors, np.memmap)
+
+    def test_edited_rows_are_read_from_the_database(self):
+        write_snapshot('candidates')
+        self.jane.skills = "Cobol"
+        self.jane.save()
+        self.assertEqual(get_snapshot('candidates').vectors_for([self.jane, self.john])[0], None)
+        stale = Candidate.objects.defer('vector').get(pk=self.jane.pk)
+        self.assertTrue(np.allclose(candidate_vector(stale), vector_from_bytes(self.jane.vector)))
+
+    def test_new_versions_are_picked_up(self):
+        self.assertIsNone(get_snapshot('candidates'))
+        self.assertEqual(write_snapshot('candidates').version, 1)
+        self.assertEqual(len(get_snapshot('candidates')), 2)
+        Candidate.objects.create(name="Ann Doe", skills="SQL", years_of_experience=1, education="BA")
+        out = io.StringIO()
+        call_command('write_vector_snapshot', '--kind', 'candidates', stdout=out)
+        call_command('write_vector_snapshot', '--kind', 'candidates', stdout=out)
+        self.assertIn("version 3 with 3 vectors", out.getvalue())
+        self.assertEqual(get_snapshot('candidates').version, 3)
+        self.assertFalse(os.path.exists(snapshot_path('candidates', 1)))
+
+    def test_match_matrix_with_snapshot(self):
+        create_position(1, 'Python and SQL engineer')
+        expected = MatchMatrix().scores
+        write_snapshot('candidates')
+        write_snapshot('positions')
+        self.assertTrue(np.allclose(MatchMatrix().scores, expected))
+
+class RematchTestCase(TestCase):
+    def setUp(self):
+        for name, skills in [("Jane Doe", "Python, SQL"), ("John Doe", "Java"), ("Ann Doe", "Networking")]:
+            Candidate.objects.create(name=name, skills=skills, years_of_experience=3, education="Bachelor of Science")
+        for posnum, posdesc in [(1, 'Python and SQL engineer'), (2, 'Java developer'), (3, 'Java developer')]:
+            create_position(posnum, posdesc)
+
+    def test_score_chunks_streams_in_order(self):
+        rng = np.random.default_rng(0)
+        candidates, positions = rng.standard_normal((10, 4)).astype(np.float32), rng.standard_normal((3, 4)).astype(np.float32)
+        chunks = list(score_chunks(candidates, positions, chunk_rows=3, workers=2))
+        self.assertEqual([start for start, _ in chunks], [0, 3, 6, 9])
+        self.assertTrue(np.allclose(np.vstack([scores for _, scores in chunks]), candidates @ positions.T * 100, atol=1e-4))
+
+    def test_rematch_fills_the_score_cache(self):
+        fit_lexical_model('bm25')
+        for backend in ['vectors', 'bm25']:
+            with self.settings(SIMILARITY_BACKEND=backend, SCORING_CHUNK_PAIRS=2):
+                progress = []
+                # the two Java positions share a description and so a column
+                self.assertEqual(rematch(workers=2, progress=lambda done, total: progress.append(done)), 6)
+                self.assertEqual(progress, [1, 2, 3])
+                expected = MatchMatrix()
+                cached = MatchMatrix(cached=True)
+            self.assertTrue(np.allclose(cached.scores, expected.scores, atol=1e-4))
+        self.assertEqual(SimilarityScoreMatcher.objects.count(), 12)
+
+    def test_cached_match_matrix_scores_only_the_misses(self):
+        jane, john, ann = Candidate.objects.order_by('pk')
+        expected = MatchMatrix().scores
+        MatchMatrix([jane], cached=True)
+        with patch('parsonsjobbot.matching.score_matrices', wraps=score_matrices) as scored:
+            cached = MatchMatrix(cached=True)
+        # jane's row came from the cache, only john and ann were scored
+        self.assertEqual(scored.call_count, 1)
+        self.assertEqual(scored.call_args[0][0].shape[0], 2)
+        self.assertTrue(np.allclose(cached.scores, expected, atol=1e-4))
+
+        with patch('parsonsjobbot.matching.score_matrices') as scored:
+            MatchMatrix(cached=True)
+        scored.assert_not_called()
+
+    def test_big_cache_reads_are_chunked(self):
+        expected = MatchMatrix(cached=True).scores
+        # 3 candidates against 2 distinct texts, read a text at a time rather than the whole table
+        with patch('parsonsjobbot.matching.MAX_CACHE_FILTER_IDS', 1), patch('parsonsjobbot.matching.score_matrices') as scored:
+            with CaptureQueriesContext(connection) as queries:
+                cached = MatchMatrix(cached=True)
+        scored.assert_not_called()
+        self.assertTrue(np.array_equal(cached.scores, expected))
+        reads = [query['sql'] for query in queries.captured_queries if 'similarityscorematcher' in query['sql']]
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(all('sow_hash' in sql.split('WHERE')[1] for sql in reads))
+
+    def test_precompute_matches_skips_cached_pairs_and_resumes(self):
+        jane, john, ann = Candidate.objects.order_by('pk')
+        MatchMatrix([jane], cached=True)
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'precompute.json')
+
+        def interrupt(done, total):
+            raise KeyboardInterrupt
+
+        with self.settings(SCORING_CHUNK_PAIRS=2):
+            with self.assertRaises(KeyboardInterrupt):
+                precompute_matches(workers=1, checkpoint=checkpoint, progress=interrupt)
+            self.assertTrue(os.path.exists(checkpoint))
+
+            result = precompute_matches(workers=1, checkpoint=checkpoint)
+        self.assertEqual(result, {'scored': 2, 'cached': 0, 'resumed_after': john.pk})
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(SimilarityScoreMatcher.objects.count(), 6)
+        self.assertTrue(np.allclose(MatchMatrix(cached=True).scores, MatchMatrix().scores, atol=1e-4))
+
+        # a finished run leaves no checkpoint, the next one looks at everyone and finds it all cached
+        output = io.StringIO()
+        call_command('precompute_matches', checkpoint=checkpoint, workers=1, stdout=output)
+        self.assertIn("Scored 0 pairs (6 already cached)", output.getvalue())
+
+class MatchCacheTestCase(TestCase):
+    def setUp(self):
+        caches['matches'].clear()
+        self.user = User.objects.create_user(username='ta', password='testpassword')
+        self.user.groups.add(Group.objects.create(name='TA'))
+        self.client.login(username='ta', password='testpassword')
+        self.candidate = Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science")
+        self.position = create_position(1, 'Python and SQL engineer')
+        self.xlsx_job = self.position.xlsx_jobs.get()
+
+    def test_candidate_matches_are_cached_until_the_data_changes(self):
+        url = reverse('parsonsjobbot:candidate-detail', args=[self.candidate.pk])
+        with patch('parsonsjobbot.views.aget_open_positions_for_candidate', wraps=aget_open_positions_for_candidate) as compute:
+            first = self.client.get(url).context['matched_jobs']
+            second = self.client.get(url).context['matched_jobs']
+            self.assertEqual(compute.call_count, 1)
+            self.assertEqual([(position.pk, score) for position, score in second], [(position.pk, score) for position, score in first])
+
+            self.position.posdesc = 'Java developer'
+            self.position.save()
+            self.client.get(url)
+            self.assertEqual(compute.call_count, 2)
+
+            version = data_version()
+            self.xlsx_job.open_or_closed = 'closed'
+            self.xlsx_job.save()
+            self.assertEqual(data_version(), version + 1)
+            self.assertEqual(self.client.get(url).context['matched_jobs'], [])
+
+    def test_invalid_reassign_form_still_shows_the_matches(self):
+        response = self.client.post(reverse('parsonsjobbot:candidate-detail', args=[self.candidate.pk]), {'user': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([position for position, _ in response.context['matched_jobs']], [self.position])
+
+    def test_position_matches_are_cached(self):
+        url = reverse('parsonsjobbot:xlsx-sow-open-detail-match', args=[self.position.pk])
+        # the ANN index is only updated on commit, which never comes in a TestCase, so this scores everyone
+        with self.settings(MATCH_RETRIEVER=None), patch('parsonsjobbot.views.aget_candidate_for_position', wraps=aget_candidate_for_position) as compute:
+            self.assertEqual(self.client.get(url).context['matched_candidates'][0][0], self.candidate)
+            self.client.get(url)
+            self.assertEqual(compute.call_count, 1)
+            Candidate.objects.create(name="John Doe", skills="Java", years_of_experience=5, education="Master of Science")
+            self.assertEqual(len(self.client.get(url).context['matched_candidates']), 2)
+            self.assertEqual(compute.call_count, 2)
+
+class AsyncMatchingTestCase(TestCase):
+    def setUp(self):
+        self.candidates = [
+            Candidate.objects.create(name="Jane Doe", skills="Python, SQL", years_of_experience=3, education="Bachelor of Science"),
+            Candidate.objects.create(name="John Doe", skills="Java, Spring", years_of_experience=5, education="Master of Science"),
+        ]
+        self.positions = [
+            SOWPosition.objects.create(tonum=str(number), pos_id=f'POSID{number}', posnum='1', posdesc=description)
+            for number, description in enumerate(['Python and SQL engineer', 'Java developer', 'Data analyst with SQL'])
+        ]
+
+    def test_ascore_matches_the_score_cache(self):
+        SimilarityScoreMatcher.objects.all().delete()
+        expected = MatchMatrix(self.candidates, self.positions, cached=True).scores
+        SimilarityScoreMatcher.objects.all().delete()
+        with self.settings(MATCH_ASYNC_CHUNK_SIZE=1):
+            scores = async_to_sync(ascore)(self.candidates, self.positions)
+        self.assertTrue(np.allclose(scores, expected, atol=1e-4))
+        self.assertEqual(SimilarityScoreMatcher.objects.count(), 6)
+
+        # everything is cached now, nothing is scored again
+        with patch('parsonsjobbot.matching.score_matrices') as scored:
+            self.assertTrue(np.allclose(async_to_sync(ascore)(self.candidates, self.positions), expected, atol=1e-4))
+            scored.assert_not_called()
+
+    def test_ascore_scores_chunks_concurrently(self):
+        running, overlapped = [0], [False]
+        lock = threading.Lock()
+
+        def slow_score(candidate_matrix, position_matrix):
+            with lock:
+                running[0] += 1
+                overlapped[0] = overlapped[0] or running[0] > 1
+            time.sleep(0.2)
+            with lock:
+                running[0] -= 1
+            return score_matrices(candidate_matrix, position_matrix)
+
+        # a chunk per worker even though all three misses fit in one MATCH_ASYNC_CHUNK_SIZE
+        with self.settings(MATCH_ASYNC_WORKERS=3), patch('parsonsjobbot.matching.score_matrices', side_effect=slow_score) as scored:
+            async_to_sync(ascore)(self.candidates[:1], self.positions)
+        self.assertEqual(scored.call_count, 3)
+        self.assertTrue(overlapped[0])
+
+    def test_ascore_preprocesses_on_the_pool(self):
+        clear_preprocessing_cache()
+        self.addCleanup(clear_preprocessing_cache)
+        PreprocessedText.objects.all().delete()
+        threads = []
+
+        def run_pipeline(texts, batch_size=None, n_process=None):
+            threads.append(threading.current_thread().name)
+            return [text.lower() for text in texts]
+
+        with self.settings(SIMILARITY_BACKEND='tfidf', MATCH_ASYNC_WORKERS=3):
+            fit_lexical_model('tfidf')
+            SimilarityScoreMatcher.objects.all().delete()
+            clear_preprocessing_cache()
+            PreprocessedText.objects.all().delete()
+            with patch('parsonsjobbot.preprocessing._run_pipeline', side_effect=run_pipeline):
+                async_to_sync(ascore)(self.candidates[:1], self.positions)
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('match-scoring') for name in threads))
+        # what the pool preprocessed is cached afterwards, on the thread that may use the database
+        self.assertEqual(PreprocessedText.objects.count(), 4)
+
+class BulkResumeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ta', password='testpassword')
+        self.client.login(username='ta', password='testpassword')
+
+    def parse(self, path):
+        if 'broken' in path:
+            raise ValueError("File is not a valid PDF")
+        name = 'Jane Doe' if 'jane_doe' in path else 'John Doe'
+        return {'name': name, 'skills': ['Python', 'SQL'], 'degree': None, 'total_experience': 0}
+
+    def test_bulk_upload_parses_every_resume(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('resumes/john_doe.docx', b'PK\x03\x04docx')
+            zip_file.writestr('resumes/virus.pdf', b'MZ\x90\x00')
+            zip_file.writestr('resumes/notes.txt', b'text')
+            zip_file.writestr('__MACOSX/resumes/._john_doe.docx', b'fork')
+        files = [
+            SimpleUploadedFile('jane_doe.pdf', b'%PDF jane', content_type='application/pdf'),
+            SimpleUploadedFile('broken.pdf', b'%PDF broken', content_type='application/pdf'),
+            SimpleUploadedFile('jane_doe_again.pdf', b'%PDF jane', content_type='application/pdf'),
+            SimpleUploadedFile('resumes.zip', archive.getvalue(), content_type='application/zip'),
+        ]
+
+        with self.settings(BACKGROUND_JOBS_EAGER=True, BULK_RESUME_WORKERS=1, BULK_RESUME_BATCH_SIZE=1):
+            with patch('parsonsjobbot.bulk_resumes.parse_resume_file', side_effect=self.parse), self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('parsonsjobbot:resume-bulk'), {'resumes': files, 'education': 'Bachelor of Science'})
+        self.assertRedirects(response, reverse('parsonsjobbot:resume-bulk'))
+
+        job = BackgroundJob.objects.get(kind='parse_resumes')
+        self.assertEqual(job.status, BackgroundJob.DONE)
+        self.assertEqual((job.result['created'], job.result['failed'], job.result['skipped']), (2, 1, 3))
+        statuses = {entry['file']: entry['status'] for entry in job.result['files']}
+        self.assertEqual(statuses, {'jane_doe.pdf': 'created', 'broken.pdf': 'failed', 'jane_doe_again.pdf': 'skipped', 'john_doe.docx': 'created', 'notes.txt': 'skipped', 'virus.pdf': 'skipped'})
+
+        candidates = Candidate.objects.order_by('name')
+        self.assertEqual([candidate.name for candidate in candidates], ['Jane Doe', 'John Doe'])
+        self.assertEqual(candidates[0].education, 'Bachelor of Science')
+        # the candidates were vectorised ahead of the save and still got their matches scored
+        self.assertTrue(all(candidate.match_hash for candidate in candidates))
+        scored = [candidate_id for job in BackgroundJob.objects.filter(kind='score_candidates') for candidate_id in job.payload['candidate_ids']]
+        self.assertEqual(sorted(scored), [candidate.pk for candidate in Candidate.objects.order_by('pk')])
+
+        # the uploads are gone, and importing them again does not make the candidates twice
+        self.assertFalse(any(default_storage.exists(upload['path']) for upload in job.payload['files']))
+        uploads = [{'uploaded_file_id': uploaded_file.pk, 'file': str(uploaded_file)} for uploaded_file in UploadedFile.objects.order_by('pk')]
+        with patch('parsonsjobbot.bulk_resumes.parse_resume_file', side_effect=self.parse):
+            self.assertEqual([entry['status'] for entry in import_resumes(uploads, workers=1)], ['existing', 'failed', 'existing'])
+        self.assertEqual(Candidate.objects.count(), 2)
+
+    def test_request_only_stores_the_upload(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('jane_doe.pdf', b'%PDF jane')
+        response = self.client.post(reverse('parsonsjobbot:resume-bulk'), {'resumes': [SimpleUploadedFile('resumes.zip', archive.getvalue())]})
+        self.assertRedirects(response, reverse('parsonsjobbot:resume-bulk'))
+        self.assertFalse(UploadedFile.objects.exists())
+        job = BackgroundJob.objects.get(kind='parse_resumes')
+        self.assertEqual([upload['file'] for upload in job.payload['files']], ['resumes.zip'])
+        self.assertTrue(default_storage.exists(job.payload['files'][0]['path']))
+
+    def test_unpacking_picks_up_where_it_stopped(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for name in ['jane_doe.pdf', 'john_doe.pdf', 'ann_doe.pdf']:
+                zip_file.writestr(name, b'%PDF ' + name.encode())
+        stored = store_uploads([SimpleUploadedFile('resumes.zip', archive.getvalue())])
+
+        calls = []
+
+        def store_resume(file):
+            calls.append(file.name)
+            if len(calls) == 3:
+                raise OSError("Disk full")
+            return resumes.store_resume(file)
+
+        with self.settings(BULK_RESUME_BATCH_SIZE=2), patch('parsonsjobbot.bulk_resumes.store_resume', side_effect=store_resume):
+            with self.assertRaises(OSError):
+                unpack_uploads(stored)
+            # the first batch of two is kept, the one that failed rolled back
+            self.assertEqual(UploadedFile.objects.count(), 2)
+            uploads, skipped = unpack_uploads(stored)
+        self.assertEqual([upload['file'] for upload in uploads], ['jane_doe.pdf', 'john_doe.pdf', 'ann_doe.pdf'])
+        self.assertEqual((skipped, UploadedFile.objects.count()), ([], 3))
+
+    def test_same_resume_is_stored_and_parsed_once(self):
+        fields = {'name': 'Jane Doe', 'education': 'Bachelor of Science', 'years_of_experience': 3, 'is_own_resume': True}
+        with self.settings(BACKGROUND_JOBS_EAGER=True), patch('parsonsjobbot.resumes.parse_resume_file', side_effect=self.parse) as parse:
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    resume = SimpleUploadedFile('jane_doe.pdf', b'%PDF jane', content_type='application/pdf')
+                    self.client.post(reverse('parsonsjobbot:resume-home'), {'resume': resume, **fields})
+            self.assertEqual(parse.call_count, 1)
+
+            uploaded_file = UploadedFile.objects.get()
+            self.assertEqual(uploaded_file.parsed_data['name'], 'Jane Doe')
+            self.assertEqual(Candidate.objects.get(user=self.user).resume, uploaded_file)
+            self.assertEqual(BackgroundJob.objects.filter(kind='parse_resume', status=BackgroundJob.DONE).count(), 2)
+
+            # a new parser version parses it again
+            with self.settings(RESUME_PARSER_VERSION='2'):
+                self.assertEqual(extract_resume_data(uploaded_file)['name'], 'Jane Doe')
+            self.assertEqual(parse.call_count, 2)
+
+    def test_uploads_are_hashed_and_sniffed_while_they_stream_in(self):
+        fields = {'name': 'Jane Doe', 'education': 'Bachelor of Science', 'years_of_experience': 3}
+        resume = SimpleUploadedFile('jane_doe.pdf', b'MZ\x90\x00 not a resume', content_type='application/pdf')
+        response = self.client.post(reverse('parsonsjobbot:resume-home'), {'resume': resume, **fields})
+        self.assertContains(response, "This does not look like a PDF file")
+        self.assertFalse(UploadedFile.objects.exists())
+
+        content = b'%PDF-1.7 jane'
+        with patch.object(TemporaryUploadedFile, 'chunks') as chunks:
+            self.client.post(reverse('parsonsjobbot:resume-home'), {'resume': SimpleUploadedFile('jane_doe.pdf', content), **fields})
+        uploaded_file = UploadedFile.objects.get()
+        self.assertEqual(uploaded_file.content_hash, hashlib.sha256(content).hexdigest())
+        # hashed by the upload handler and moved into place, nothing read the upload again
+        chunks.assert_not_called()
+        with open(uploaded_file.file.path, 'rb') as stored:
+            self.assertEqual(stored.read(), content)
+
+class NEEExtractionTestCase(TestCase):
+    def nee_workbook(self):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['NEE Report'])
+        sheet.append([None, None, None, 'Open Positions'])
+        sheet.append(['TONum', 'PDNum', 'Previous Names', 'Project', 'Status', 'Labor Cat', 'Level', 'CLIN', 'Location', 'Release Date'])
+        sheet.append(['1 / 34', 9, 'TO FILL', 'Requirements Engineering', 'First come, first serve', 'Systems Engineer', '2 - Mid (6+ to 12)', '1', 'WMA-CS', datetime(2023, 5, 23)])
+        sheet.append(['2 / 7\nbackfill', 3.0, None, 'Cyber', 'First come, first serve', 'Analyst', '1 - Junior', 2, 'WMA-CS', datetime(2023, 5, 24)])
+        sheet.append([None, None, None, 'Closed Positions'])
+        sheet.append(['16 / 9 (moved)', 4, 'TO FILL', 'CLOSED ', 'First come, first serve', 'Systems Engineer', '3 - Senior (12+ to 18)', '0009', 'WMA-CS', datetime(2023, 6, 13)])
+        sheet.append([])
+        path = os.path.join(tempfile.mkdtemp(), 'nee.xlsx')
+        workbook.save(path)
+        return path
+
+    def test_extract_positions_from_excel(self):
+        positions = extract_positions_from_excel(self.nee_workbook())
+        self.assertEqual([(position['tonum'], position['posnum'], position['open_or_closed']) for position in positions], [('1', '34', 'open'), ('2', '7', 'open'), ('16', '9', 'closed')])
+        self.assertEqual(positions[0]['release_date'], '2023-05-23')
+        self.assertEqual(positions[0]['project'], 'Requirements Engineering')
+        # the same values pd.read_excel gave: whole numbers are ints and empty cells NaN
+        self.assertEqual((positions[1]['pdnum'], positions[1]['clin']), (3, 2))
+        self.assertTrue(pd.isna(positions[1]['previous_names']))
+        self.assertEqual(positions[2]['clin'], '0009')
+
+    def position(self, posnum, **values):
+        position = {'tonum': '1', 'posnum': posnum, 'pdnum': 9, 'previous_names': np.nan, 'project': 'Cyber', 'status': 'First come, first serve', 'labor_cat': 'Analyst', 'level': '1 - Junior', 'clin': 2, 'location': 'WMA-CS', 'release_date': '2023-05-23', 'open_or_closed': 'open'}
+        position.update(values)
+        return position
+
+    def test_store_nee_positions(self):
+        sow_position = SOWPosition.objects.create(tonum='1', posnum='3', pos_id='P3', location='WMA-CS', posdescnum='1', posdesctitle='Analyst', posdesc='Python and SQL')
+        self.assertEqual(store_nee_positions([self.position('1'), self.position('2')])[0], {'inserted': 2, 'unchanged': 0, 'changed': 0})
+        # NaN and the numbers compare the way they were stored ('nan', '9')
+        self.assertEqual(XlsxJob.objects.get(posnum='1').previous_names, 'nan')
+
+        upload = [self.position('1'), self.position('2', open_or_closed='closed'), self.position('3'), self.position('3')]
+        counts, new_jobs = store_nee_positions(upload)
+        self.assertEqual(counts, {'inserted': 1, 'unchanged': 2, 'changed': 1})
+        self.assertEqual(sorted((xlsx_job.posnum, xlsx_job.open_or_closed) for xlsx_job in new_jobs), [('2', 'closed'), ('3', 'open')])
+        self.assertEqual(XlsxJob.objects.count(), 4)
+        # the new rows are linked to their SOW positions like a save would have
+        self.assertEqual(list(sow_position.xlsx_jobs.all()), [job for job in new_jobs if job.posnum == '3'])
+
+        # the queries grow with the INSERT batches (about 80 rows each on SQLite), not with the rows
+        with CaptureQueriesContext(connection) as small:
+            store_nee_positions([self.position(str(posnum), tonum='2') for posnum in range(5)])
+        with CaptureQueriesContext(connection) as large:
+            store_nee_positions([self.position(str(posnum), tonum='3') for posnum in range(400)])
+        self.assertEqual(XlsxJob.objects.filter(tonum='3').count(), 400)
+        self.assertLessEqual(len(large.captured_queries), len(small.captured_queries) + 400 // 80)
+        # nothing tries to drop links the new rows cannot have yet
+        self.assertFalse(any('DELETE' in query['sql'] for query in large.captured_queries))
+
+    def test_parse_xlsx_reports_counts(self):
+        for _ in range(2):
+            with open(self.nee_workbook(), 'rb') as xlsx, self.settings(BACKGROUND_JOBS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('parsonsjobbot:job-xlsx-submission'), {'xlsx': SimpleUploadedFile('nee.xlsx', xlsx.read())})
 
+        first, second = BackgroundJob.objects.filter(kind='parse_xlsx').order_by('pk')
+        self.assertEqual(first.result, {'inserted': 3, 'unchanged': 0, 'changed': 0})
+        self.assertEqual(second.result, {'inserted': 0, 'unchanged': 3, 'changed': 0})
+        # the second upload brought nothing new and was dropped
+        self.assertEqual(UploadedXlsx.objects.count(), 1)
 
@@ -0,0 +1,92 @@
+# the streaming side of uploads: every file is hashed and its type sniffed from its first bytes while the chunks are
+# written to the temporary file, so nothing has to read the upload again for either. See FILE_UPLOAD_HANDLERS
+import hashlib
+import os
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+# how many leading bytes sniff_file_type looks at
+MAGIC_BYTES_LENGTH = 8
+
+# the leading bytes of the kinds of files we take
+MAGIC_BYTES = [
+    (b'%PDF', 'pdf'),
+    # zip files, and docx and xlsx which are zip files underneath
+    (b'PK\x03\x04', 'zip'),
+    # the old binary Office formats (doc, xls)
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),
+]
+
+# what a file with each extension we take should sniff as
+EXTENSION_FILE_TYPES = {
+    '.pdf': 'pdf',
+    '.doc': 'ole',
+    '.docx': 'zip',
+    '.xlsx': 'zip',
+    '.zip': 'zip',
+}
+
+
+def sniff_file_type(head: bytes):
+    """
+    'pdf', 'zip' or 'ole' going by the first bytes of a file, None for anything else.
+
+    Example:
+        sniff_file_type(b'%PDF-1.7')
+        # Output: 'pdf'
+    """
+    for magic, file_type in MAGIC_BYTES:
+        if head.startswith(magic):
+            return file_type
+    return None
+
+
+def file_head(file) -> bytes:
+    """
+    The first MAGIC_BYTES_LENGTH bytes of a file, as captured by HashingUploadHandler or else read (and rewound).
+    """
+    head = getattr(file, 'magic_bytes', None)
+    if head is None:
+        file.seek(0)
+        head = file.read(MAGIC_BYTES_LENGTH)
+        file.seek(0)
+    return head
+
+
+def matches_extension(file, name: str = None) -> bool:
+    """
+    Whether the file's content is what its extension says it is, so a renamed executable does not pass for a resume.
+
+    Args:
+        file (File): The uploaded file.
+        name (str): The name to take the extension from, defaults to file.name.
+    """
+    expected = EXTENSION_FILE_TYPES.get(os.path.splitext(name or file.name)[1].lower())
+    return expected is not None and sniff_file_type(file_head(file)) == expected
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """
+    TemporaryFileUploadHandler that also works out each file's sha256 (content_hash, see hashing.file_hash) and keeps
+    its first bytes (magic_bytes, see matches_extension) as the chunks arrive.
+
+    The temporary file goes in settings.FILE_UPLOAD_TEMP_DIR, which is inside MEDIA_ROOT so that saving the upload to a
+    FileField is a rename on the same filesystem rather than a copy.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.head = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        if len(self.head) < MAGIC_BYTES_LENGTH:
+            self.head += raw_data[:MAGIC_BYTES_LENGTH - len(self.head)]
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.content_hash = self.digest.hexdigest()
+        file.magic_bytes = self.head
+        return file
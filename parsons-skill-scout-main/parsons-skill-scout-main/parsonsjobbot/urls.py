@@ -13,6 +13,7 @@ urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('landing_page/', views.redirect_to_landing_page, name='redirect-to-landing-page'),
     path('resume/', views.ResumeView.as_view(), name='resume-home'),
+    path('resume/bulk/', views.BulkResumeView.as_view(), name='resume-bulk'),
     path('about/', views.AboutView.as_view(), name='about'),
     path('metrics/', views.MetricsView.as_view(), name='metrics'),
 
@@ -22,7 +23,7 @@ urlpatterns = [
 
     # candidate stuff
     path('candidates/', views.CandidateView.as_view(), name='candidates'),
-    path('candidates/<int:pk>/', views.CandidateDetailView.as_view(), name='candidate-detail'),
+    path('candidates/<int:pk>/', views.AsyncCandidateDetailView.as_view(), name='candidate-detail'),
     path('candidates/my_candidate', views.MyCandidateProfileView.as_view(), name='my-candidate-profile'),
     path('candidates/<int:pk>/matched', views.CandidateDetailMatchedView.as_view(), name='candidate-detail-matched'),
     
@@ -30,6 +31,7 @@ urlpatterns = [
     path('job_submission/', views.JobSubmissionView.as_view(), name='job-submission'),
     path('job_xlsx_submission/', views.XlsxSubmissionView.as_view(), name='job-xlsx-submission'),
     path('jobs/<int:pk>/', views.JobDetailView.as_view(), name='job-detail'),
+    path('background-jobs/<int:pk>/', views.BackgroundJobStatusView.as_view(), name='background-job-status'),
 
     #sow stuff
     path('sow_submission/', views.SOWSubmissionView.as_view(), name='sow-submission'),
@@ -37,7 +39,7 @@ urlpatterns = [
     #Xlsx and SOW matching stuff
     path('xlsx-sow-open-matcher/', views.XlsxSOWOpenMatcherView.as_view(), name='xlsx-sow-open'),
     path('xlsx-sow-open-matcher/<int:pk>/', views.XlsxSOWOpenDeatilView.as_view(), name='xlsx-sow-open-detail'),
-    path('xlsx-sow-open-matcher/<int:pk>/detail', views.XlsxSOWOpenDeatilMatchView.as_view(), name='xlsx-sow-open-detail-match'),
+    path('xlsx-sow-open-matcher/<int:pk>/detail', views.AsyncXlsxSOWOpenDeatilMatchView.as_view(), name='xlsx-sow-open-detail-match'),
     
 
     #out of service links for now
@@ -0,0 +1,160 @@
+import numpy as np
+from django.conf import settings
+
+from .hashing import content_hash
+from .language_models import get_similarity_model
+from .preprocessing import preprocess_texts
+from .snapshots import get_snapshot
+
+# vectors are stored on the Candidate and SOWPosition rows as raw float32 bytes
+VECTOR_DTYPE = np.float32
+# the settings.SIMILARITY_BACKEND that scores with these vectors, the others are in lexical.py
+VECTOR_BACKEND = 'vectors'
+
+
+def vectors_enabled() -> bool:
+    """
+    Whether settings.SIMILARITY_BACKEND scores with document vectors. When it does not, rows are saved without one and
+    en_core_web_lg is never loaded.
+    """
+    return settings.SIMILARITY_BACKEND == VECTOR_BACKEND
+
+
+def candidate_match_text(candidate) -> str:
+    """
+    The text a candidate is matched on: their skills followed by their education.
+    """
+    return candidate.skills + ', ' + candidate.education
+
+
+def position_match_text(sow_position) -> str:
+    """
+    The text a SOW position is matched on: its position description.
+    """
+    return sow_position.posdesc
+
+
+def document_vector(text: str) -> np.ndarray:
+    """
+    Computes the unit length document vector spaCy would use for doc.similarity on the preprocessed text.
+
+    A dot product between two of these vectors is the same cosine similarity doc1.similarity(doc2) gives.
+    Texts with no known words get the zero vector, which scores 0 against everything just like spaCy does.
+
+    Args:
+        text (str): The raw text to vectorise.
+
+    Returns:
+        np.ndarray: A normalised float32 vector.
+    """
+    return document_vectors([text])[0]
+
+
+def document_vectors(texts: list[str], batch_size: int = None, n_process: int = None) -> list[np.ndarray]:
+    """
+    document_vector for many texts at once, the preprocessing is batched through nlp.pipe (see preprocess_texts).
+
+    Returns:
+        list: One normalised float32 vector per text, in input order.
+    """
+    nlp = get_similarity_model()
+    vectors = []
+    for preprocessed_text in preprocess_texts(texts, batch_size=batch_size, n_process=n_process):
+        vector = np.asarray(nlp.make_doc(preprocessed_text).vector, dtype=VECTOR_DTYPE)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        vectors.append(vector.astype(VECTOR_DTYPE))
+    return vectors
+
+
+def assign_vectors(instances: list, match_text) -> list:
+    """
+    Computes fresh vectors, in one batch, for every instance whose vector is missing or out of date with its text.
+
+    The vector (and the match_hash of the text it was made from) is set on the instance but not saved, saving is up to
+    the caller (pre_save does it for normal saves). Without the vector backend (see vectors_enabled) only the
+    match_hash is kept up to date.
+
+    Args:
+        instances (list): Candidate or SOWPosition instances.
+        match_text (function): candidate_match_text or position_match_text.
+
+    Returns:
+        list: The instances that got a new vector.
+    """
+    enabled = vectors_enabled()
+    stale = [
+        instance for instance in instances
+        if match_text(instance) != getattr(instance, '_vector_text', None) or not (instance.vector if enabled else instance.match_hash)
+    ]
+    if not stale:
+        return []
+    texts = [match_text(instance) for instance in stale]
+    vectors = document_vectors(texts) if enabled else [None] * len(texts)
+    for instance, text, vector in zip(stale, texts, vectors):
+        # without the vector backend the old vector is dropped, _stored_vectors makes a new one if it is ever needed
+        instance.vector = vector_to_bytes(vector) if vector is not None else None
+        instance.match_hash = content_hash(text)
+        # remember which text this vector belongs to so pre_save does not compute it again
+        instance._vector_text = text
+    return stale
+
+
+def vector_to_bytes(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+
+
+def vector_from_bytes(data) -> np.ndarray:
+    # BinaryField hands back bytes on sqlite but a memoryview on some other databases
+    return np.frombuffer(bytes(data), dtype=VECTOR_DTYPE)
+
+
+def cosine_percentage(vector1: np.ndarray, vector2: np.ndarray) -> float:
+    """
+    Similarity percentage between two stored (already normalised) vectors.
+    """
+    return float(np.dot(vector1, vector2)) * 100
+
+
+def candidate_vectors(candidates: list) -> list[np.ndarray]:
+    """
+    Returns the stored vectors for the candidates, computing and saving any that predate the vector store.
+    """
+    return _stored_vectors(candidates, candidate_match_text, 'candidates')
+
+
+def position_vectors(sow_positions: list) -> list[np.ndarray]:
+    """
+    Returns the stored vectors for the SOW positions, computing and saving any that predate the vector store.
+    """
+    return _stored_vectors(sow_positions, position_match_text, 'positions')
+
+
+def candidate_vector(candidate) -> np.ndarray:
+    return candidate_vectors([candidate])[0]
+
+
+def position_vector(sow_position) -> np.ndarray:
+    return position_vectors([sow_position])[0]
+
+
+def _stored_vectors(instances: list, match_text, kind: str) -> list[np.ndarray]:
+    # the shared memory mapped snapshot first (see snapshots.py), the rows themselves for whatever is newer than it
+    snapshot = get_snapshot(kind) if instances else None
+    vectors = snapshot.vectors_for(instances) if snapshot is not None else [None] * len(instances)
+    unsnapshotted = [instance for instance, vector in zip(instances, vectors) if vector is None]
+
+    # rows loaded with defer('vector') get theirs in one query rather than one query each
+    deferred = [instance for instance in unsnapshotted if 'vector' in instance.get_deferred_fields()]
+    if deferred:
+        stored = dict(type(deferred[0]).objects.filter(pk__in=[instance.pk for instance in deferred]).values_list('pk', 'vector'))
+        for instance in deferred:
+            instance.vector = stored.get(instance.pk)
+
+    missing = [instance for instance in unsnapshotted if not instance.vector]
+    if missing:
+        assign_vectors(missing, match_text)
+        # bulk_update skips the save signals so this does not compute the vectors a second time
+        type(missing[0]).objects.bulk_update(missing, ['vector', 'match_hash'])
+    return [vector if vector is not None else vector_from_bytes(instance.vector) for instance, vector in zip(instances, vectors)]
@@ -7,13 +7,11 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import View
 from django.contrib.auth.models import Group, User
 from django.db.models import Q
-from functools import reduce
+from django.http import JsonResponse
+from asgiref.sync import sync_to_async
 
 #imports 
-from pyresparser import ResumeParser
 from docx import Document
-import spacy
-from spacy.lang.en.stop_words import STOP_WORDS
 import pandas as pd
 import re
 import tabula
@@ -26,16 +24,28 @@ import plotly.express as px
 import io
 import urllib, base64
 
-nlp = spacy.load('en_core_web_sm')
-
 #imported models here
 
-from .models import Candidate, UploadedFile, JobSubmission, Skill, UploadedXlsx, XlsxJob, SOWPosition, UploadedSOW, SimilarityScoreMatcher
-from .forms import ResumeUploadForm, XlsxUploadForm, SOWUploadForm, UserSelectionForm
+from .models import Candidate, UploadedFile, JobSubmission, Skill, UploadedXlsx, XlsxJob, SOWPosition, UploadedSOW, BackgroundJob, SkillPosting
+from .forms import ResumeUploadForm, BulkResumeUploadForm, XlsxUploadForm, SOWUploadForm, UserSelectionForm
+from .vectors import VECTOR_BACKEND, document_vectors, cosine_percentage
+from .matching import MatchMatrix, open_sow_positions, similarity_backend, top_k
+from .match_cache import cached_matches, acached_matches
+from .async_matching import ascore
+from .retrieval import shortlist_positions, shortlist_candidates, shortlist_size
+from .lexical import lexical_similarity_matrix
+from .skill_index import candidate_skills, having_all_skills, skill_match_percentages
+from .tasks import enqueue
+from .bulk_resumes import store_uploads
+from .resumes import store_resume
+from .nee import nee_positions, read_nee_sheet
 
 
 # Create your views here.
 
+# added to upload messages, the upload is parsed and scored by a BackgroundJob (see tasks.py)
+PROCESSING_IN_BACKGROUND = " - it is being processed in the background (job {job.pk})"
+
 
 class HomeView(generic.TemplateView):
     """
@@ -80,104 +90,64 @@ class ResumeView(generic.FormView):
 
     def form_valid(self, form):
             """
-            Handles the information from the HTML file and combines that to make a Candidate or update a candidate
+            Saves the resume and queues a parse_resume job (see tasks.py) that makes a Candidate or updates a candidate,
+            so the request does not wait on the resume parser.
             """
             try:
-                resume_file = form.cleaned_data['resume']
-                is_own_resume = form.cleaned_data['is_own_resume']
-                resume_path = form.files['resume'].temporary_file_path() 
-
-                # upload to admin backend
-                uploaded_file = UploadedFile(file=resume_file)
-            
-                # parse the uploaded resume using pyresparser
-                data = ResumeParser(resume_path).get_extracted_data()
+                if not self.request.user.is_authenticated:
+                    raise PermissionError("Resumes can only be uploaded by a signed in user")
+
+                # upload to admin backend (or reuse the copy we already have), the job reads the file from there
+                uploaded_file = store_resume(form.cleaned_data['resume'])
+
+                job = enqueue(
+                    'parse_resume',
+                    user=self.request.user,
+                    uploaded_file_id=uploaded_file.pk,
+                    user_id=self.request.user.pk,
+                    is_own_resume=form.cleaned_data['is_own_resume'],
+                    name=form.cleaned_data['name'],
+                    education=form.cleaned_data['education'],
+                    years_of_experience=form.cleaned_data['years_of_experience'],
+                )
+
+                messages.success(self.request, "Resume Upload Successful" + PROCESSING_IN_BACKGROUND.format(job=job))
+                return redirect(reverse('parsonsjobbot:resume-home'))
+            except:
+                messages.success(self.request, "Resume Upload unsuccessful")
+                return redirect(reverse('parsonsjobbot:resume-home'))
 
-                name = data['name']
-                # for skills you can always take an input list and then add it to the skills found in the resume as well
-                skills = ', '.join(data.get('skills', []))
-                years_of_experience = data.get('total_experience', 0)
-                try:
-                    education = ', '.join(data.get('degree', []))
-                except:
-                    education = None
+class BulkResumeView(generic.FormView):
+    """
+    Takes many resumes at once, as separate files and/or zip files, for onboarding a whole contract in one go.
 
-                # manual - if the parser doesnt catch everything
-                if name != form.cleaned_data['name']:
-                    name = form.cleaned_data['name']
-                
-                if not education:
-                    if form.cleaned_data['education']:
-                        education = form.cleaned_data['education']
-                    
-                if years_of_experience == 0:
-                    if form.cleaned_data['years_of_experience']:
-                        years_of_experience = form.cleaned_data['years_of_experience']
-                        #print(years_of_experience)
-                
-                
+    The request only stores the files as they are uploaded. A single parse_resumes job (see tasks.py and
+    bulk_resumes.py) unpacks the zips, parses the resumes on a pool of processes and makes a floating Candidate for each. How every file went is in the job's result, see
+    BackgroundJobStatusView.
 
+    Attributes:
+        template_name (str): The name of the template used to render the bulk upload page.
+        form_class (Form): BulkResumeUploadForm.
+    """
+    template_name = 'parsonsjobbot/bulk_resume_submission_page.html'
+    form_class = BulkResumeUploadForm
 
-                # if the user has already made a Candidate just update that candidate
-                # visit the Candidate model for more information
-                try:
-                    candidate = Candidate.objects.get(user=self.request.user)
-                    # if candidate wants to upload a resume on their behalf
-                    if is_own_resume:
-                        candidate.name=name
-                        candidate.skills=skills
-                        candidate.years_of_experience=years_of_experience
-                        candidate.education=education
-
-                        uploaded_file.save()
-
-                        candidate.resume = uploaded_file
-                        
-                        candidate.save()
-
-                        messages.success(self.request, "Resume Re-Upload Successful")
-                        return redirect(reverse('parsonsjobbot:resume-home'))
-                    
-                    # if candidate wants to upload resume on another persons behalf
-                    else:
-                        candidate = Candidate.objects.create(
-                            name=name,
-                            skills=skills,
-                            years_of_experience=years_of_experience,
-                            education=education,
-                        )
-
-                        uploaded_file.save()
-
-                        candidate.resume = uploaded_file
-                        
-                        candidate.save()
-
-                        messages.success(self.request, "Resume Upload for another Candidate Successful")
-                        return redirect(reverse('parsonsjobbot:resume-home'))
-
-                # if the user has no candidate then make one for the user.
-                except Candidate.DoesNotExist:
-
-                    candidate = Candidate.objects.create(
-                            user=self.request.user,
-                            name=name,
-                            skills=skills,
-                            years_of_experience=years_of_experience,
-                            education=education,
-                        )
-                    
-                    uploaded_file.save()
-
-                    candidate.resume = uploaded_file
-                    
-                    candidate.save()
-
-                    messages.success(self.request, "Resume Uploaded Successfully")
-                    return redirect(reverse('parsonsjobbot:resume-home'))
-            except:
-                messages.success(self.request, "Resume Upload unsuccessful")
-                return redirect(reverse('parsonsjobbot:resume-home'))
+    def form_valid(self, form):
+        if not self.request.user.is_authenticated:
+            messages.success(self.request, "Resume Upload unsuccessful")
+            return redirect(reverse('parsonsjobbot:resume-bulk'))
+
+        files = store_uploads(form.cleaned_data['resumes'])
+        job = enqueue(
+            'parse_resumes',
+            user=self.request.user,
+            files=files,
+            education=form.cleaned_data['education'] or '',
+            years_of_experience=form.cleaned_data['years_of_experience'] or 0,
+        )
+
+        messages.success(self.request, f"Uploaded {len(files)} files" + PROCESSING_IN_BACKGROUND.format(job=job))
+        return redirect(reverse('parsonsjobbot:resume-bulk'))
 
 class MetricsView(generic.TemplateView):
     """
@@ -240,7 +210,8 @@ class CandidateView(generic.ListView):
         model (Model): The model associated with this view. In this case, it is the Candidate model.
 
     Methods:
-        get_queryset(): Override this method to customize the queryset of candidates based on the user's group.
+        get_queryset(): Override this method to customize the queryset of candidates based on the user's group, narrowed
+            down by name (?q=) and by required skills (?skills=python,sql).
 
     Usage:
         The CandidateView is a subclass of generic.ListView provided by Django. It displays a list of candidates with
@@ -268,6 +239,11 @@ class CandidateView(generic.ListView):
         else:
             queryset = Candidate.objects.none()
 
+        # ?skills=python,sql keeps the candidates with every one of the skills, straight from the skill index
+        required_skills = [skill for skill in self.request.GET.get('skills', '').split(',') if skill.strip()]
+        if required_skills:
+            queryset = queryset.filter(pk__in=having_all_skills(SkillPosting.CANDIDATES, required_skills))
+
         return queryset
 
 class CandidateDetailView(generic.DetailView):
@@ -292,17 +268,28 @@ class CandidateDetailView(generic.DetailView):
     model = Candidate
     template_name = 'parsonsjobbot/candidate_detail.html'
     context_object_name = 'candidate'
+    # how many of the best positions to show, and how many the retriever shortlists for scoring (None: MATCH_SHORTLIST_OVERSAMPLE x match_limit)
+    match_limit = 25
+    shortlist_size = None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         candidate_id = self.kwargs['pk']
         candidate = Candidate.objects.get(pk=candidate_id)
-        matched_jobs = get_open_positions_for_candidate(candidate)
+        matched_jobs = self.get_matched_jobs(candidate)
 
         context['matched_jobs'] = matched_jobs
         context['reassign_user_form'] = UserSelectionForm()
         return context
 
+    def get_matched_jobs(self, candidate):
+        # the sorted list comes from the match cache until a candidate, position or the XLSX changes (match_cache.py)
+        return cached_matches(
+            SOWPosition, 'positions_for_candidate', candidate.pk,
+            lambda: get_open_positions_for_candidate(candidate, k=self.match_limit, n=self.shortlist_size),
+            k=self.match_limit, n=self.shortlist_size,
+        )
+
     def post(self, request, *args, **kwargs):
         form = UserSelectionForm(request.POST)
 
@@ -316,10 +303,40 @@ class CandidateDetailView(generic.DetailView):
 
             return redirect(reverse('parsonsjobbot:resume-home'))
 
+        self.object = self.get_object()
         context = self.get_context_data(**kwargs)
         context['form'] = form
         return self.render_to_response(context)
 
+class AsyncCandidateDetailView(CandidateDetailView):
+    """
+    CandidateDetailView as an async view: the open positions that are not in the score cache yet are scored
+    concurrently on a bounded thread pool (see async_matching.py) and the worker is free for other requests meanwhile.
+
+    Usage:
+        Served through jobbot/asgi.py it never ties up a worker thread while scoring. It renders the same page with the
+        same context as CandidateDetailView.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        self.object = await sync_to_async(self.get_object)()
+        self.matched_jobs = await acached_matches(
+            SOWPosition, 'positions_for_candidate', self.object.pk,
+            lambda: aget_open_positions_for_candidate(self.object, k=self.match_limit, n=self.shortlist_size),
+            k=self.match_limit, n=self.shortlist_size,
+        )
+        context = await sync_to_async(self.get_context_data)(object=self.object)
+        return self.render_to_response(context)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(super().post)(request, *args, **kwargs)
+
+    def get_matched_jobs(self, candidate):
+        # worked out asynchronously in get(), a post with an invalid form works them out here
+        if not hasattr(self, 'matched_jobs'):
+            return super().get_matched_jobs(candidate)
+        return self.matched_jobs
+
 class CandidateDetailMatchedView(generic.DetailView):
     """
     This view displays detailed information about a candidate, showing only their personal information rendered onto a page.
@@ -359,6 +376,9 @@ class MyCandidateProfileView(generic.DetailView):
     model = Candidate
     template_name = 'parsonsjobbot/my_candidate_profile.html'
     context_object_name = 'candidate'
+    # how many of the best positions to show, and how many the retriever shortlists for scoring (None: MATCH_SHORTLIST_OVERSAMPLE x match_limit)
+    match_limit = 25
+    shortlist_size = None
 
     def get_object(self, queryset=None):
         user = self.request.user
@@ -372,7 +392,11 @@ class MyCandidateProfileView(generic.DetailView):
         candidate = self.object
         
         if candidate:
-            matched_jobs = get_open_positions_for_candidate(candidate)
+            matched_jobs = cached_matches(
+                SOWPosition, 'positions_for_candidate', candidate.pk,
+                lambda: get_open_positions_for_candidate(candidate, k=self.match_limit, n=self.shortlist_size),
+                k=self.match_limit, n=self.shortlist_size,
+            )
             context['matched_jobs'] = matched_jobs
         
         return context
@@ -533,47 +557,13 @@ class XlsxSubmissionView(generic.FormView):
 
     def form_valid(self, form):
         try:
-            xlsx_file = form.cleaned_data['xlsx']
+            # the parse_xlsx job (see tasks.py) reads the positions from the saved file and drops it again if nothing was new
+            uploaded_xlsx_file = UploadedXlsx(file=form.cleaned_data['xlsx'])
+            uploaded_xlsx_file.save()
 
-            xlsx_path = form.files['xlsx'].temporary_file_path()
+            job = enqueue('parse_xlsx', user=self.request.user, uploaded_xlsx_id=uploaded_xlsx_file.pk)
 
-            uploaded_xlsx_file = UploadedXlsx(file=xlsx_file)
-
-            positions = extract_positions_from_excel(xlsx_path)
-            try:
-                upload_counter = 0
-                for position in positions:
-                    #check if there is a new file
-                    xlsx_job = XlsxJob(**position)
-                    xlsx_job_stored = XlsxJob.objects.filter(  
-                        tonum = position['tonum'],
-                        posnum = position['posnum'],
-                        pdnum = position['pdnum'],
-                        previous_names = position['previous_names'],
-                        project = position['project'],
-                        status = position['status'],
-                        labor_cat = position['labor_cat'],
-                        level = position['level'],
-                        clin = position['clin'],
-                        location = position['location'],
-                        release_date = position['release_date'],
-                        open_or_closed = position['open_or_closed']
-                    )
-                    if xlsx_job_stored.exists():
-                        upload_counter += 1
-                        continue
-                    else:
-                        xlsx_job = XlsxJob(**position)
-                        xlsx_job.save()
-                    
-                if upload_counter != len(positions):
-                    uploaded_xlsx_file.save()
-
-            except:
-                messages.success(self.request, "Something went wrong while parsing valid positions.")
-                return redirect(reverse('parsonsjobbot:job-xlsx-submission'))
-            
-            messages.success(self.request, "Xlsx Upload Successful")
+            messages.success(self.request, "Xlsx Upload Successful" + PROCESSING_IN_BACKGROUND.format(job=job))
             return redirect(reverse('parsonsjobbot:job-xlsx-submission'))
         
         except:
@@ -605,83 +595,22 @@ class SOWSubmissionView(generic.FormView):
         try:
             sow_file = form.cleaned_data['sow']
 
-            sow_path = form.files['sow'].temporary_file_path()
-
-            uploaded_sow_file = UploadedSOW(file=sow_file)
-
-            if "pdf" in sow_file.name:
-                positions = parse_tables_and_position_descs_pdf(sow_path)
-            elif "docx" in sow_file.name:
-                positions = parse_tables_and_position_descs_word(sow_path)
-            else:
+            if "pdf" not in sow_file.name and "docx" not in sow_file.name:
                 messages.success(self.request, "SOW Upload Type is not PDF or Word (.docx)")
                 return redirect(reverse('parsonsjobbot:sow-submission'))
 
-            
-            # important parts of positions looks like this for the most part:
-            # positions = [
-            #     {'Position ID': str,
-            #      'Position Number': str,
-            #      'Position Description': [str(position number), str(position title), str(position description)],
-            #      'Skill Level': str,
-            #      'Service Category': str,
-            #      'Job Title': str,
-            #      'Task Order Number': str},
-            #      {
-            #         ...
-            #       },
-            #       etc
-            # ]
-
-            total_pos = counter = len(positions)
-            for position in positions:
-                
+            # big SOW pdfs take tabula longer than the proxy waits, so the parse_sow job (see tasks.py) does the parsing
+            # from the saved file and drops it again if it did not bring in any new positions
+            uploaded_sow_file = UploadedSOW(file=sow_file)
+            uploaded_sow_file.save()
 
-                try:
-                    sow_pos = SOWPosition.objects.get(pos_id=position['Position ID'], posnum=position['Position Number'])
-
-                    sow_pos.tonum = position['Task Order Number']
-                    sow_pos.pos_id = position['Position ID']
-                    sow_pos.posnum = position['Position Number']
-                    sow_pos.location = position['Location']
-                    sow_pos.posdescnum = position['Position Description'][0]
-                    sow_pos.posdesctitle = position['Position Description'][1]
-                    sow_pos.posdesc = position['Position Description'][2]
-                    sow_pos.level = position['Skill Level']
-                    sow_pos.service_cat = position['Service Category']
-                    sow_pos.job_title = position['Job Title']
-                    sow_pos.save()
-
-                    
-
-                except SOWPosition.DoesNotExist:
-                    sow_pos = SOWPosition.objects.create(
-                        tonum = position['Task Order Number'],
-                        pos_id = position['Position ID'],
-                        posnum = position['Position Number'],
-                        location = position['Location'],
-                        posdescnum = position['Position Description'][0],
-                        posdesctitle = position['Position Description'][1],
-                        posdesc = position['Position Description'][2],
-                        level = position['Skill Level'],
-                        service_cat = position['Service Category'],
-                        job_title = position['Job Title'],
-                    )
-                    sow_pos.save()
-
-                    counter -= 1
-            
-            if counter != total_pos:
-                uploaded_sow_file.save()
+            job = enqueue('parse_sow', user=self.request.user, uploaded_sow_id=uploaded_sow_file.pk)
 
-            messages.success(self.request, "SOW Upload Successful")
+            messages.success(self.request, "SOW Upload Successful" + PROCESSING_IN_BACKGROUND.format(job=job))
             return redirect(reverse('parsonsjobbot:sow-submission'))
 
-        except KeyError:
-            messages.success(self.request, "SOW Upload Unsuccessful - Something went wrong with making the position")
-            return redirect(reverse('parsonsjobbot:sow-submission'))
         except:
-            messages.success(self.request, "SOW Upload Unsuccessful - Something went wrong with parsing the SOW")
+            messages.success(self.request, "SOW Upload Unsuccessful - Something went wrong with saving the SOW")
             return redirect(reverse('parsonsjobbot:sow-submission'))
 
 class XlsxSOWOpenMatcherView(generic.ListView):
@@ -708,38 +637,12 @@ class XlsxSOWOpenMatcherView(generic.ListView):
         tonum_query = self.request.GET.get('tonum')
         posnum_query = self.request.GET.get('posnum')
 
-        sow_positions = []
-
-        if tonum_query and posnum_query:
-            try:
-                xlsxposition = XlsxJob.objects.filter(tonum=tonum_query, posnum=posnum_query, open_or_closed='open')
-                sow_positions = SOWPosition.objects.filter(tonum=tonum_query, posnum=posnum_query)
-                return sow_positions
-            except XlsxJob.DoesNotExist:
-                return SOWPosition.objects.none()
-        elif tonum_query:
-            try:
-                xlsxposition = XlsxJob.objects.filter(tonum=tonum_query, open_or_closed='open')
-                sow_positions = SOWPosition.objects.filter(tonum=tonum_query)
-                return sow_positions
-            except XlsxJob.DoesNotExist:
-                return SOWPosition.objects.none()
-        elif posnum_query:
-            try:
-                xlsxposition = XlsxJob.objects.filter(posnum=posnum_query, open_or_closed='open')
-                sow_positions = SOWPosition.objects.filter(posnum=posnum_query)
-                return sow_positions
-            except XlsxJob.DoesNotExist:
-                return SOWPosition.objects.none()
-        # if no search parameters provided, show all open positions
-        else:
-            open_xlsx_jobs = XlsxJob.objects.filter(open_or_closed='open')
-            tonum_list = open_xlsx_jobs.values_list('tonum', flat=True)
-            posnum_list = open_xlsx_jobs.values_list('posnum', flat=True)
-
-            tonum_posnum_pairs = zip(tonum_list, posnum_list)
-            
-            sow_positions = SOWPosition.objects.filter(reduce(lambda x, y: x | y, [Q(tonum=tonum, posnum=posnum) for tonum, posnum in tonum_posnum_pairs]))
+        # all open positions, narrowed down by whichever search parameters were provided
+        sow_positions = open_sow_positions()
+        if tonum_query:
+            sow_positions = sow_positions.filter(tonum=tonum_query)
+        if posnum_query:
+            sow_positions = sow_positions.filter(posnum=posnum_query)
 
         return sow_positions
 
@@ -783,44 +686,86 @@ class XlsxSOWOpenDeatilMatchView(generic.DetailView):
     model = SOWPosition
     template_name = 'parsonsjobbot/xlsx_sow_detail_match.html'
     context_object_name = 'position'
+    # how many of the best candidates to show, and how many the retriever shortlists for scoring (None: MATCH_SHORTLIST_OVERSAMPLE x match_limit)
+    match_limit = 25
+    shortlist_size = None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         sow_position_id = self.kwargs['pk']
         sow_position = SOWPosition.objects.get(pk=sow_position_id)
         
-        matched_candidates = get_candidate_for_position(sow_position)
+        matched_candidates = self.get_matched_candidates(sow_position)
 
         context['matched_candidates'] = matched_candidates
         return context
 
+    def get_matched_candidates(self, sow_position):
+        return cached_matches(
+            Candidate, 'candidates_for_position', sow_position.pk,
+            lambda: get_candidate_for_position(sow_position, k=self.match_limit, n=self.shortlist_size),
+            k=self.match_limit, n=self.shortlist_size,
+        )
+
+class AsyncXlsxSOWOpenDeatilMatchView(XlsxSOWOpenDeatilMatchView):
+    """
+    XlsxSOWOpenDeatilMatchView as an async view: the shortlisted candidates that are not in the score cache yet are
+    scored concurrently on a bounded thread pool (see async_matching.py).
+    """
+
+    async def get(self, request, *args, **kwargs):
+        self.object = await sync_to_async(self.get_object)()
+        self.matched_candidates = await acached_matches(
+            Candidate, 'candidates_for_position', self.object.pk,
+            lambda: aget_candidate_for_position(self.object, k=self.match_limit, n=self.shortlist_size),
+            k=self.match_limit, n=self.shortlist_size,
+        )
+        context = await sync_to_async(self.get_context_data)(object=self.object)
+        return self.render_to_response(context)
+
+    def get_matched_candidates(self, sow_position):
+        # worked out asynchronously in get()
+        return self.matched_candidates
+
 #helper functions / redirects to go back to other apps
 
-def redirect_to_landing_page(request):
+class BackgroundJobStatusView(LoginRequiredMixin, View):
     """
-    return to the other app landing_page
+    Reports how far along a BackgroundJob (like scoring a freshly uploaded SOW) is, as JSON.
+
+    Only the user who queued the job and staff can see it, anybody else gets a 404 like for a job that does not
+    exist. The error is just the exception, the full traceback stays in the admin.
+
+    Methods:
+        get(request, pk): Returns the job's kind, status, progress and total.
+
+    Usage:
+        Poll /jobbot/background-jobs/<pk>/ after an upload to know when the match pages will load from a warm cache.
+        # Output: {"id": 1, "kind": "score_positions", "status": "running", "progress": 200, "total": 500, "error": "", "result": {}}
     """
-    return redirect('landing_page:landing_page')
 
-def reorganize_dict(positions_list: list[dict]) -> list[dict]:
+    def get(self, request, pk):
+        jobs = BackgroundJob.objects.all() if request.user.is_staff else BackgroundJob.objects.filter(user=request.user)
+        job = get_object_or_404(jobs, pk=pk)
+        return JsonResponse({
+            'id': job.pk,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': job.progress,
+            'total': job.total,
+            'error': job.short_error,
+            'result': job.result,
+        })
+
+def redirect_to_landing_page(request):
     """
-    Seprating the ToNum key in dictionary with the PosNum as well and then putting it in the dictonary independently separated
-    Also chnaged the Date to look more realistic and not just a datetime object
+    return to the other app landing_page
     """
-    for position in positions_list:
-        tonum_parts = position['tonum'].split(' / ')
-        position['tonum'] = tonum_parts[0].strip()
-        posnum = tonum_parts[1].strip().replace('\n', ' ')
-        if " " in posnum:
-            position['posnum'] = posnum.split(' ')[0]
-        else:
-            position['posnum'] = posnum
-        position['release_date'] = position['release_date'].strftime('%Y-%m-%d')
-    return positions_list
+    return redirect('landing_page:landing_page')
 
 def extract_positions_from_excel(xlsx_file: UploadedFile) -> list[dict]:
     """
-    Interpret the NEE xlsx files and return a list of positions
+    Interpret the NEE xlsx files and return a list of positions, the open ones first
 
     Args:
         xlsx_file (str): The path to the NEE xlsx file.
@@ -836,36 +781,8 @@ def extract_positions_from_excel(xlsx_file: UploadedFile) -> list[dict]:
         'Location': 'WMA-CS', 'Release Date': '2023-06-13', 'PosNum': '9'}, ...]
     ]
     """
-    df = pd.read_excel(xlsx_file, header=None)
-    open_positions = []
-    closed_positions = []
-
-
-    position_headers = ["tonum", "pdnum", "previous_names", "project", "status", "labor_cat", "level", "clin", "location", "release_date"]
-    det = False
-    for row_id, row in df.iterrows():
-        if "open positions" in str(row[3]).lower():
-            det = True
-        elif "closed positions" in str(row[3]).lower():
-            det = False
-
-        # if we are in open position and we are not in the header row
-        elif det and not ("project" in str(row[3]).lower()):
-            zipped_dict_row = dict(zip(position_headers, row))
-            zipped_dict_row["open_or_closed"] = 'open'
-            open_positions.append(zipped_dict_row)
-        elif not det and not pd.isna(row[3]):
-            zipped_dict_row = dict(zip(position_headers, row))
-            zipped_dict_row["open_or_closed"] = 'closed'
-            closed_positions.append(zipped_dict_row)
-
-
-    positions = reorganized_positions = reorganize_dict(open_positions)
-    reorganized_closed_positions = reorganize_dict(closed_positions)
-
-    positions.extend(reorganized_closed_positions)
-
-    return positions
+    # streamed and worked out a column at a time rather than with read_excel and iterrows, see nee.py
+    return nee_positions(read_nee_sheet(xlsx_file))
 
 def parse_tables_and_position_descs_word(path: UploadedFile) -> list[dict]:
     """
@@ -1196,37 +1113,33 @@ def compute_similarity_percentage(str1: str, str2: str) -> float:
         str2 (str): The second input string.
 
     Returns:
-        float: The similarity percentage between the two strings.
+        float: The similarity percentage between the two strings, from whichever settings.SIMILARITY_BACKEND is selected.
 
     Example:
         similarity = compute_similarity_percentage("This is a sample text.", "Sample text for comparison.")
         # Output: similarity = 88.20533968855472
     """
 
-    def preprocess_text(text):
-        nlp = spacy.load("en_core_web_sm")
-        doc = nlp(text)
+    if similarity_backend() != VECTOR_BACKEND:
+        # TF-IDF or BM25 word overlap, see lexical.py
+        return float(lexical_similarity_matrix([str1], [str2])[0, 0])
 
-        tokens = [token.lemma_.lower() for token in doc if not token.is_stop and not token.is_punct and token.text.lower() not in STOP_WORDS]
-        preprocessed_text = ' '.join(tokens)
-
-        return preprocessed_text
-
-    nlp = spacy.load("en_core_web_lg")
-    with nlp.disable_pipes():
-        doc1 = nlp(preprocess_text(str1))
-        doc2 = nlp(preprocess_text(str2))
-    
-    similarity_percentage = doc1.similarity(doc2) * 100
+    # same cosine spaCy's doc.similarity computes, on the same preprocessed text
+    vector1, vector2 = document_vectors([str1, str2])
+    similarity_percentage = cosine_percentage(vector1, vector2)
     return similarity_percentage
 
-def get_open_positions_for_candidate(candidate: Candidate) -> list[(SOWPosition, float)]:
+def get_open_positions_for_candidate(candidate: Candidate, k: int = None, n: int = None, retriever: str = None) -> list[(SOWPosition, float)]:
     """
     Modularized getting open positions for a candidate so that it can move wherever needed easier.
     Also caches the processes so that it is stored for later use.
 
     Args:
         candidate (Candidate): The candidate model instance for which open positions are to be found.
+        k (int): Only return the k best positions, None returns all of them. With a k a retriever shortlists the
+            positions first so only the shortlist is scored (see retrieval.py).
+        n (int): How many positions to shortlist, defaults to settings.MATCH_SHORTLIST_OVERSAMPLE times k.
+        retriever (str): How to shortlist, defaults to settings.MATCH_RETRIEVER.
 
     Returns:
         list: A list of tuples containing matched SOWPosition models and their similarity scores.
@@ -1237,49 +1150,25 @@ def get_open_positions_for_candidate(candidate: Candidate) -> list[(SOWPosition,
         # Output: matched_jobs = [(<SOWPosition: SOWPosition object (1)>, 83.32475812503635), ...]
     """
 
-    #print("in here")
-    candidate_skills = candidate.skills
-    candiate_skill_and_education = candidate_skills + ', ' + candidate.education
-    # get all XlsxJob models
-    sow_positions = []
-    open_xlsx_jobs = XlsxJob.objects.filter(open_or_closed='open')
-    candidate_similarity_scores = SimilarityScoreMatcher.objects.filter(candidate_name=candidate.name, candidate_info=candiate_skill_and_education)
-    tonum_list = open_xlsx_jobs.values_list('tonum', flat=True)
-    posnum_list = open_xlsx_jobs.values_list('posnum', flat=True)
-    tonum_posnum_pairs = zip(tonum_list, posnum_list)
-    
-    sow_positions = SOWPosition.objects.filter(reduce(lambda x, y: x | y, [Q(tonum=tonum, posnum=posnum) for tonum, posnum in tonum_posnum_pairs]))
-    #print(sow_positions)
-    # gather the similarity score matching
-    similarity_scores = []
-    for sow_position in sow_positions:
-        # its good that we cache but if we update the resume of a candidate then we have a problem that it will 
-        # of course give the right score based on the candidates resume used but it wont clear space so we need to clear next
-        cached = SimilarityScoreMatcher.objects.filter(candidate_name=candidate.name, candidate_info=candiate_skill_and_education, sow_info=sow_position.posdesc)
-        if cached:
-            similarity_scores.append(cached[0].similarity_score)
-        else:
-            #score calculation is very expensive so if we did it once already just store that for later use
-            similarity_score_instance = compute_similarity_percentage(candiate_skill_and_education, sow_position.posdesc)
-            SimilarityScoreMatcher.objects.create(
-                candidate_name=candidate.name, 
-                candidate_info=candiate_skill_and_education, 
-                sow_info=sow_position.posdesc,
-                similarity_score=similarity_score_instance
-            )
-            similarity_scores.append(similarity_score_instance)
-    # setup a list of tuples of sow_positions and similarity scores
-    matched_jobs = list(zip(sow_positions, similarity_scores))
-    matched_jobs.sort(key=lambda job: job[1], reverse=True)
-    return matched_jobs
+    sow_positions = open_sow_positions()
+    if k is not None:
+        sow_positions = shortlist_positions(candidate, sow_positions, shortlist_size(k, n), retriever)
 
-def get_candidate_for_position(sow_position: SOWPosition) -> list[(Candidate, float)]:
+    # one matrix multiply scores the candidate against every (shortlisted) open position, see matching.py
+    match = MatchMatrix([candidate], sow_positions, cached=True)
+    return match.positions_for_candidate(0, k)
+
+def get_candidate_for_position(sow_position: SOWPosition, k: int = None, n: int = None, retriever: str = None) -> list[(Candidate, float)]:
     """
     Modularized getting candidates for a given SOWPosition based on similarity of skills and education.
     Also caches the processes so that it is stored for later use.
 
     Args:
         sow_position (SOWPosition): The SOWPosition object for which matching candidates are to be found.
+        k (int): Only return the k best candidates, None returns all of them. With a k a retriever shortlists the
+            candidates first so only the shortlist is scored (see retrieval.py).
+        n (int): How many candidates to shortlist, defaults to settings.MATCH_SHORTLIST_OVERSAMPLE times k.
+        retriever (str): How to shortlist, defaults to settings.MATCH_RETRIEVER.
 
     Returns:
         list: A list of tuples containing matched Candidate models and their similarity scores.
@@ -1290,61 +1179,55 @@ def get_candidate_for_position(sow_position: SOWPosition) -> list[(Candidate, fl
         # Output: matched_candidates = [(<Candidate: Candidate object (1)>, 83.32475812503635), ...]
     """
 
-
-    #print("in here")
-    sow_position_desc = sow_position.posdesc
-    # get all Candidate models
     candidates = Candidate.objects.all()
-    similarity_scores = []
-    for candidate in candidates:
-        candidate_skills = candidate.skills
-        candiate_skill_and_education = candidate_skills + ', ' + candidate.education
-        cached = SimilarityScoreMatcher.objects.filter(candidate_name=candidate.name, candidate_info=candiate_skill_and_education, sow_info=sow_position_desc)
-        if cached:
-            similarity_scores.append(cached[0].similarity_score)
-        else:
-            #score calculation is very expensive so if we did it once already just store that for later use
-            similarity_score_instance = compute_similarity_percentage(candiate_skill_and_education, sow_position.posdesc)
-            SimilarityScoreMatcher.objects.create(
-                candidate_name=candidate.name, 
-                candidate_info=candiate_skill_and_education, 
-                sow_info=sow_position_desc,
-                similarity_score=similarity_score_instance
-            )
-            similarity_scores.append(similarity_score_instance)
-    # setup a list of tuples of sow_positions and similarity scores
-    matched_candidates = list(zip(candidates, similarity_scores))
-    matched_candidates.sort(key=lambda job: job[1], reverse=True)
-    return matched_candidates
+    if k is not None:
+        candidates = shortlist_candidates(sow_position, shortlist_size(k, n), retriever)
 
+    # one matrix multiply scores every (shortlisted) candidate against the position, see matching.py
+    match = MatchMatrix(candidates, [sow_position], cached=True)
+    return match.candidates_for_position(0, k)
 
-#Out of service Views and Helpers
+async def aget_open_positions_for_candidate(candidate: Candidate, k: int = None, n: int = None, retriever: str = None) -> list[(SOWPosition, float)]:
+    """
+    get_open_positions_for_candidate for async views, the cache misses are scored concurrently (see async_matching.py).
+    """
+    def open_positions():
+        sow_positions = open_sow_positions()
+        if k is not None:
+            sow_positions = shortlist_positions(candidate, sow_positions, shortlist_size(k, n), retriever)
+        return list(sow_positions.defer('vector'))
 
-def calculate_score(candidate: Candidate, job_submission: SOWPosition) -> float:
+    sow_positions = await sync_to_async(open_positions)()
+    scores = await ascore([candidate], sow_positions)
+    return [(sow_positions[column], float(scores[0, column])) for column in top_k(scores[0], k)[0]]
+
+async def aget_candidate_for_position(sow_position: SOWPosition, k: int = None, n: int = None, retriever: str = None) -> list[(Candidate, float)]:
     """
-    this is a function used to help assist in deermining the score for the MatchedJobsView.
-    Assigns weight to a job in comparison to the candidate where the better score means a higher score
+    get_candidate_for_position for async views, the cache misses are scored concurrently (see async_matching.py).
     """
-    # Example scoring mechanism
-    score = 0
-   
-    # Increase score based on matching skills
-    candidate_skills = set([skill.strip().lower() for skill in candidate.skills.split(',')])
-    job_skills = set([skill.name.lower() for skill in job_submission.skills.all()])
-    matched_skills = candidate_skills.intersection(job_skills)
-    num_matched_skills = len(matched_skills)
-    total_skills_required = len(job_skills)
+    def candidates_to_score():
+        candidates = Candidate.objects.all()
+        if k is not None:
+            candidates = shortlist_candidates(sow_position, shortlist_size(k, n), retriever)
+        return list(candidates.defer('vector'))
 
+    candidates = await sync_to_async(candidates_to_score)()
+    scores = await ascore(candidates, [sow_position])
+    return [(candidates[row], float(scores[row, 0])) for row in top_k(scores[:, 0], k)[0]]
 
-    # Calculate percentage match
-    percentage_match = (num_matched_skills / total_skills_required) * 100
-    score += percentage_match
-   
-    # Adjust score based on other criteria (e.g., skill level, position description)
-    # Add relevant scoring logic based on your requirements
 
+#Out of service Views and Helpers
+
+def calculate_score(candidate: Candidate, job_submission: JobSubmission) -> float:
+    """
+    this is a function used to help assist in deermining the score for the MatchedJobsView.
+    Assigns weight to a job in comparison to the candidate where the better score means a higher score
 
-    return score
+    The percentage of the job's required skills the candidate has, worked out from the skill index (skill_index.py)
+    rather than the job's skills relation. A job with no required skills scores 0.
+    """
+    # skill_match_percentages can score any number of jobs in the same two queries, see rank_by_skill_overlap
+    return skill_match_percentages(SkillPosting.JOB_SUBMISSIONS, candidate_skills(candidate), [job_submission.pk]).get(job_submission.pk, 0)
 
 class JobListView(View):
     """